@@ -0,0 +1,36 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Offline micro benchmarks for the cryptographic primitives and the pair verify handshake as well as benchmarks of
+sequential and pipelined requests against a local accessory server. Run them with
+
+    python3 -m benchmarks -o results.json --baseline benchmarks/baseline.json
+
+See `python3 -m benchmarks -h` for all options.
+"""
+
+__all__ = [
+    'Benchmark', 'compare_results', 'load_results', 'run_benchmarks', 'save_results', 'BENCHMARKS'
+]
+
+from benchmarks.tools import Benchmark, compare_results, load_results, run_benchmarks, save_results
+from benchmarks.crypto_benchmarks import CRYPTO_BENCHMARKS
+from benchmarks.handshake_benchmarks import HANDSHAKE_BENCHMARKS
+from benchmarks.pipelining_benchmarks import PIPELINING_BENCHMARKS
+
+BENCHMARKS = CRYPTO_BENCHMARKS + HANDSHAKE_BENCHMARKS + PIPELINING_BENCHMARKS
@@ -0,0 +1,58 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import argparse
+import sys
+
+from benchmarks import BENCHMARKS, compare_results, load_results, run_benchmarks, save_results
+
+
+def setup_args_parser():
+    parser = argparse.ArgumentParser(description='HomeKit crypto and handshake benchmarks')
+    parser.add_argument('-o', action='store', dest='output', help='File to write the results to (JSON)')
+    parser.add_argument('--baseline', action='store', dest='baseline',
+                        help='File with results of an earlier run to compare against (JSON)')
+    parser.add_argument('--tolerance', action='store', dest='tolerance', type=float, default=0.25,
+                        help='Allowed slow down relative to the baseline (defaults to 0.25 for 25%%)')
+    parser.add_argument('--filter', action='store', dest='filter',
+                        help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--min-time', action='store', dest='min_time', type=float, default=0.2,
+                        help='Minimal duration of one measuring loop in seconds (defaults to 0.2)')
+    parser.add_argument('--repeat', action='store', dest='repeat', type=int, default=3,
+                        help='Number of measuring loops per benchmark (defaults to 3)')
+    return parser.parse_args()
+
+
+def print_result(name, duration):
+    print('{name:<45} {duration:>12.2f} µs'.format(name=name, duration=duration * 1e6))
+
+
+if __name__ == '__main__':
+    args = setup_args_parser()
+
+    results = run_benchmarks(BENCHMARKS, args.filter, args.min_time, args.repeat, print_result)
+
+    if args.output:
+        save_results(results, args.output)
+
+    if args.baseline:
+        regressions = compare_results(results, load_results(args.baseline), args.tolerance)
+        for name, baseline_duration, duration in regressions:
+            print('REGRESSION {name}: {old:.2f} µs -> {new:.2f} µs'.format(
+                name=name, old=baseline_duration * 1e6, new=duration * 1e6))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,143 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+
+from homekit.crypto import SessionCipher, SrpClient, SrpServer
+from homekit.crypto.chacha20poly1305 import AEAD_BACKENDS, chacha20_aead_decrypt, chacha20_aead_encrypt, poly1305_mac
+from benchmarks.tools import Benchmark
+
+# payload sizes from a 2 byte length field up to large resources (e.g. camera snapshots)
+PAYLOAD_SIZES = [2, 64, 1024, 65536]
+
+SETUP_CODE = '123-45-678'
+
+
+def _backend_encrypt(backend, size):
+    def setup():
+        cipher = backend(os.urandom(32))
+        nonce = bytes(12)
+        plaintext = os.urandom(size)
+        aad = os.urandom(2)
+        return lambda: cipher.encrypt(nonce, plaintext, aad)
+    return setup
+
+
+def _backend_decrypt(backend, size):
+    def setup():
+        cipher = backend(os.urandom(32))
+        nonce = bytes(12)
+        aad = os.urandom(2)
+        data = cipher.encrypt(nonce, os.urandom(size), aad)
+        return lambda: cipher.decrypt(nonce, data, aad)
+    return setup
+
+
+def _aead_encrypt(size):
+    def setup():
+        key = os.urandom(32)
+        plaintext = os.urandom(size)
+        return lambda: chacha20_aead_encrypt(b'', key, bytes(8), bytes(4), plaintext)
+    return setup
+
+
+def _aead_decrypt(size):
+    def setup():
+        key = os.urandom(32)
+        cipher_text, tag = chacha20_aead_encrypt(b'', key, bytes(8), bytes(4), os.urandom(size))
+        data = bytes(cipher_text + tag)
+        return lambda: chacha20_aead_decrypt(b'', key, bytes(8), bytes(4), data)
+    return setup
+
+
+def _seal_frames(size):
+    def setup():
+        cipher = SessionCipher(os.urandom(32))
+        data = os.urandom(size)
+        return lambda: cipher.seal_frames(data)
+    return setup
+
+
+def _open_frames(size):
+    def setup():
+        key = os.urandom(32)
+        frames = SessionCipher(key).seal_frames(os.urandom(size))
+
+        def open_frames():
+            SessionCipher(key).open_frames(frames)
+        return open_frames
+    return setup
+
+
+def _poly1305(size):
+    def setup():
+        key = os.urandom(32)
+        message = os.urandom(size)
+        return lambda: poly1305_mac(message, key)
+    return setup
+
+
+def _srp_client():
+    return lambda: SrpClient('Pair-Setup', SETUP_CODE)
+
+
+def _srp_server():
+    return lambda: SrpServer('Pair-Setup', SETUP_CODE)
+
+
+def _srp_server_stored_verifier():
+    server = SrpServer('Pair-Setup', SETUP_CODE)
+    salt = server.get_salt()
+    verifier = server.get_verifier()
+    return lambda: SrpServer('Pair-Setup', SETUP_CODE, salt=salt, verifier=verifier)
+
+
+def _srp_exchange():
+    def exchange():
+        server = SrpServer('Pair-Setup', SETUP_CODE)
+        client = SrpClient('Pair-Setup', SETUP_CODE)
+        client.set_salt(server.get_salt())
+        client.set_server_public_key(server.get_public_key())
+        server.set_client_public_key(client.get_public_key())
+        client_proof = client.get_proof()
+        assert server.verify_clients_proof(client_proof)
+        assert client.verify_servers_proof(server.get_proof(client_proof))
+    return exchange
+
+
+def _create_benchmarks():
+    benchmarks = []
+    for backend in AEAD_BACKENDS:
+        for size in PAYLOAD_SIZES:
+            benchmarks.append(Benchmark('aead_encrypt[{}][{}]'.format(backend.name, size),
+                                        _backend_encrypt(backend, size)))
+            benchmarks.append(Benchmark('aead_decrypt[{}][{}]'.format(backend.name, size),
+                                        _backend_decrypt(backend, size)))
+    for size in PAYLOAD_SIZES:
+        benchmarks.append(Benchmark('chacha20_aead_encrypt[{}]'.format(size), _aead_encrypt(size)))
+        benchmarks.append(Benchmark('chacha20_aead_decrypt[{}]'.format(size), _aead_decrypt(size)))
+        benchmarks.append(Benchmark('session_cipher_seal_frames[{}]'.format(size), _seal_frames(size)))
+        benchmarks.append(Benchmark('session_cipher_open_frames[{}]'.format(size), _open_frames(size)))
+        benchmarks.append(Benchmark('poly1305_mac[{}]'.format(size), _poly1305(size)))
+    benchmarks.append(Benchmark('srp_client_init', _srp_client))
+    benchmarks.append(Benchmark('srp_server_init', _srp_server))
+    benchmarks.append(Benchmark('srp_server_init_stored_verifier', _srp_server_stored_verifier))
+    benchmarks.append(Benchmark('srp_exchange', _srp_exchange))
+    return benchmarks
+
+
+CRYPTO_BENCHMARKS = _create_benchmarks()
@@ -0,0 +1,193 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import hashlib
+import os
+import uuid
+
+import ed25519
+import hkdf
+import tlv8
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+
+from homekit.crypto import chacha20_aead_decrypt, chacha20_aead_encrypt
+from homekit.protocol import get_session_keys, derive_resume_key, derive_resume_session_id, ResumeCache, PairingKeys
+from homekit.protocol.methods import Methods
+from homekit.protocol.states import States
+from homekit.protocol.tlv_types import TlvTypes
+from benchmarks.tools import Benchmark
+
+
+class SimulatedAccessory(object):
+    """
+    Accessory side of pair verify (see chapter 4.8 page 47 ff) and pair resume working on TLV bytes, so that the
+    controller side can be measured without network or a running accessory server.
+    """
+
+    def __init__(self):
+        self.pairing_id = '12:34:56:78:90:AB'
+        self.ltsk, self.ltpk = ed25519.create_keypair()
+        self.controller_ltsk, self.controller_ltpk = ed25519.create_keypair()
+        self.controller_id = str(uuid.uuid4())
+        self._key = None
+        self._public_key = None
+        self._controller_public_key = None
+        self._shared_secret = None
+        self._session_key = None
+        self.resume_cache = ResumeCache()
+
+    def create_pairing_data(self) -> dict:
+        """
+        :return: pairing data of a controller paired with this accessory
+        """
+        return {
+            'AccessoryPairingID': self.pairing_id,
+            'AccessoryLTPK': self.ltpk.to_bytes().hex(),
+            'iOSPairingId': self.controller_id,
+            'iOSDeviceLTSK': self.controller_ltsk.to_seed().hex(),
+            'iOSDeviceLTPK': self.controller_ltpk.to_bytes().hex(),
+            'Connection': 'IP',
+        }
+
+    def pair_verify(self, request: bytes) -> bytes:
+        """
+        Handles one request of the pair verify exchange.
+
+        :param request: the TLV encoded request (M1 or M3)
+        :return: the TLV encoded response (M2 or M4)
+        """
+        request = tlv8.decode(request, {
+            TlvTypes.State: tlv8.DataType.INTEGER,
+            TlvTypes.Method: tlv8.DataType.INTEGER,
+            TlvTypes.PublicKey: tlv8.DataType.BYTES,
+            TlvTypes.EncryptedData: tlv8.DataType.BYTES,
+            TlvTypes.SessionID: tlv8.DataType.BYTES
+        })
+        if request.first_by_id(TlvTypes.State).data == States.M1:
+            method = request.first_by_id(TlvTypes.Method)
+            if method and method.data == Methods.kTLVMethod_Resume:
+                response = self._handle_resume(request)
+                if response:
+                    return response
+            return self._handle_m1(request)
+        return self._handle_m3(request)
+
+    def _handle_resume(self, request):
+        controller_public_key = bytes(request.first_by_id(TlvTypes.PublicKey).data)
+        session_id = bytes(request.first_by_id(TlvTypes.SessionID).data)
+        resumable = self.resume_cache.pop(session_id)
+        if resumable is None:
+            return None
+        shared_secret = resumable[1]
+        request_key = derive_resume_key(shared_secret, controller_public_key, session_id, 'Pair-Resume-Request-Info')
+        if chacha20_aead_decrypt(bytes(), request_key, 'PR-Msg01'.encode(), bytes([0, 0, 0, 0]),
+                                 request.first_by_id(TlvTypes.EncryptedData).data) is False:
+            return None
+
+        new_session_id = os.urandom(8)
+        response_key, self._shared_secret = derive_resume_key(shared_secret, controller_public_key, new_session_id,
+                                                              'Pair-Resume-Response-Info',
+                                                              'Pair-Resume-Shared-Secret-Info')
+        _, tag = chacha20_aead_encrypt(bytes(), response_key, 'PR-Msg02'.encode(), bytes([0, 0, 0, 0]), bytes())
+        self.resume_cache.put(new_session_id, new_session_id, self._shared_secret)
+        return tlv8.encode([
+            tlv8.Entry(TlvTypes.State, States.M2),
+            tlv8.Entry(TlvTypes.SessionID, new_session_id),
+            tlv8.Entry(TlvTypes.EncryptedData, tag)
+        ])
+
+    def _handle_m1(self, request) -> bytes:
+        self._controller_public_key = bytes(request.first_by_id(TlvTypes.PublicKey).data)
+        self._key = x25519.X25519PrivateKey.generate()
+        self._public_key = self._key.public_key().public_bytes(encoding=serialization.Encoding.Raw,
+                                                               format=serialization.PublicFormat.Raw)
+        self._shared_secret = self._key.exchange(x25519.X25519PublicKey.from_public_bytes(self._controller_public_key))
+
+        accessory_info = self._public_key + self.pairing_id.encode() + self._controller_public_key
+        sub_tlv = tlv8.encode([
+            tlv8.Entry(TlvTypes.Identifier, self.pairing_id.encode()),
+            tlv8.Entry(TlvTypes.Signature, self.ltsk.sign(accessory_info))
+        ])
+        hkdf_inst = hkdf.Hkdf('Pair-Verify-Encrypt-Salt'.encode(), self._shared_secret, hash=hashlib.sha512)
+        self._session_key = hkdf_inst.expand('Pair-Verify-Encrypt-Info'.encode(), 32)
+        cipher_text, tag = chacha20_aead_encrypt(bytes(), self._session_key, 'PV-Msg02'.encode(), bytes([0, 0, 0, 0]),
+                                                 sub_tlv)
+        return tlv8.encode([
+            tlv8.Entry(TlvTypes.State, States.M2),
+            tlv8.Entry(TlvTypes.PublicKey, self._public_key),
+            tlv8.Entry(TlvTypes.EncryptedData, bytes(cipher_text + tag))
+        ])
+
+    def _handle_m3(self, request) -> bytes:
+        encrypted = bytes(request.first_by_id(TlvTypes.EncryptedData).data)
+        decrypted = chacha20_aead_decrypt(bytes(), self._session_key, 'PV-Msg03'.encode(), bytes([0, 0, 0, 0]),
+                                          encrypted)
+        assert decrypted is not False, 'pair verify M3 could not be decrypted'
+        sub_tlv = tlv8.decode(decrypted, {
+            TlvTypes.Identifier: tlv8.DataType.BYTES,
+            TlvTypes.Signature: tlv8.DataType.BYTES
+        })
+        controller_info = self._controller_public_key + self.controller_id.encode() + self._public_key
+        self.controller_ltpk.verify(bytes(sub_tlv.first_by_id(TlvTypes.Signature).data), controller_info)
+        session_id = derive_resume_session_id(self._shared_secret)
+        self.resume_cache.put(session_id, session_id, self._shared_secret)
+        return tlv8.encode([tlv8.Entry(TlvTypes.State, States.M4)])
+
+
+def perform_pair_verify(pairing_data: dict, accessory: SimulatedAccessory, resume_cache=None,
+                        pairing_keys=None) -> tuple:
+    """
+    Runs the controller's pair verify state machine against the simulated accessory.
+
+    :param pairing_data: the controller's pairing data
+    :param accessory: the simulated accessory
+    :param resume_cache: the controller's ResumeCache to try a pair resume first or None for a full pair verify
+    :param pairing_keys: the parsed PairingKeys as kept by the pairing objects or None to parse the pairing data
+    :return: tuple of the session keys (controller_to_accessory_key and accessory_to_controller_key)
+    """
+    state_machine = get_session_keys(pairing_data, resume_cache, pairing_keys)
+    request, expected = state_machine.send(None)
+    while True:
+        response = accessory.pair_verify(tlv8.encode(request))
+        try:
+            request, expected = state_machine.send(tlv8.decode(response, expected))
+        except StopIteration as result:
+            return result.value
+
+
+def _pair_verify():
+    accessory = SimulatedAccessory()
+    pairing_data = accessory.create_pairing_data()
+    pairing_keys = PairingKeys(pairing_data)
+    return lambda: perform_pair_verify(pairing_data, accessory, pairing_keys=pairing_keys)
+
+
+def _pair_resume():
+    accessory = SimulatedAccessory()
+    pairing_data = accessory.create_pairing_data()
+    pairing_keys = PairingKeys(pairing_data)
+    resume_cache = ResumeCache()
+    # the first verify is a full one, each measured run then resumes the session of the previous one
+    perform_pair_verify(pairing_data, accessory, resume_cache, pairing_keys)
+    return lambda: perform_pair_verify(pairing_data, accessory, resume_cache, pairing_keys)
+
+
+HANDSHAKE_BENCHMARKS = [
+    Benchmark('pair_verify', _pair_verify),
+    Benchmark('pair_resume', _pair_resume),
+]
@@ -0,0 +1,207 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import atexit
+import json
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+import ed25519
+
+from homekit.accessoryserver import AccessoryServer
+from homekit.controller.ip_implementation import IpSession
+from homekit.model import Accessory
+from homekit.model.services import LightBulbService
+from benchmarks.tools import Benchmark
+
+# number of requests per measured call
+REQUESTS = 10
+# simulated round trip time between controller and accessory in seconds
+ROUND_TRIP_TIME = 0.005
+
+
+class LocalAccessoryServer(object):
+    """
+    An AccessoryServer with one light bulb listening on a free port of the loopback interface. The server is paired
+    with a generated controller and is not published via zeroconf.
+    """
+
+    def __init__(self):
+        accessory_ltsk, accessory_ltpk = ed25519.create_keypair()
+        controller_ltsk, controller_ltpk = ed25519.create_keypair()
+        controller_id = str(uuid.uuid4())
+        config = {
+            'accessory_ltpk': accessory_ltpk.to_bytes().hex(),
+            'accessory_ltsk': accessory_ltsk.to_seed().hex(),
+            'accessory_pairing_id': '12:34:56:00:01:0B',
+            'accessory_pin': '031-45-154',
+            'c#': 1,
+            'category': 'Lightbulb',
+            'host_ip': '127.0.0.1',
+            'host_port': 0,
+            'name': 'benchmarkLight',
+            'peers': {
+                controller_id: {'admin': True, 'key': controller_ltpk.to_bytes().hex()}
+            },
+            'unsuccessful_tries': 0
+        }
+        fd, self.config_file = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as config_fp:
+            json.dump(config, config_fp)
+        atexit.register(os.unlink, self.config_file)
+
+        self.server = AccessoryServer(self.config_file, logger=None)
+        # connections kept open by the benchmarks must not block the exit
+        self.server.daemon_threads = True
+        accessory = Accessory('Benchmarklicht', 'lusiardi.de', 'Demoserver', '0001', '0.1')
+        accessory.services.append(LightBulbService())
+        self.server.add_accessory(accessory)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.pairing_data = {
+            'AccessoryPairingID': config['accessory_pairing_id'],
+            'AccessoryLTPK': config['accessory_ltpk'],
+            'AccessoryIP': '127.0.0.1',
+            'AccessoryPort': self.server.server_address[1],
+            'iOSPairingId': controller_id,
+            'iOSDeviceLTSK': controller_ltsk.to_seed().hex(),
+            'iOSDeviceLTPK': controller_ltpk.to_bytes().hex(),
+            'Connection': 'IP',
+        }
+
+    def create_session(self, pipelining: bool, address: tuple = None) -> IpSession:
+        """
+        :param pipelining: the pipelining setting of the pairing
+        :param address: tuple of ip and port to connect to instead of the server's address (e.g. of a LatencyProxy)
+        :return: a new verified session with the server
+        """
+        pairing_data = dict(self.pairing_data)
+        pairing_data['Pipelining'] = pipelining
+        if address:
+            pairing_data['AccessoryIP'], pairing_data['AccessoryPort'] = address
+        return IpSession(pairing_data)
+
+
+class LatencyProxy(object):
+    """
+    Forwards TCP connections to a target and delays the data in both directions by half the round trip time. Data is
+    read continuously and forwarded in order, so requests sent back to back stay in flight at the same time like on a
+    real network.
+    """
+
+    def __init__(self, target_address: tuple, round_trip_time: float):
+        """
+        :param target_address: tuple of ip and port to forward connections to
+        :param round_trip_time: the simulated round trip time in seconds
+        """
+        self.target_address = target_address
+        self.delay = round_trip_time / 2
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.address = self.listener.getsockname()
+        self._start(self._accept)
+
+    @staticmethod
+    def _start(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(self.target_address)
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._forward(client, upstream)
+            self._forward(upstream, client)
+
+    def _forward(self, source, destination):
+        chunks = queue.Queue()
+        self._start(self._receive, source, chunks)
+        self._start(self._send, destination, chunks)
+
+    def _receive(self, source, chunks):
+        while True:
+            try:
+                data = source.recv(65536)
+            except OSError:
+                data = b''
+            chunks.put((time.monotonic() + self.delay, data))
+            if not data:
+                return
+
+    @staticmethod
+    def _send(destination, chunks):
+        while True:
+            due, data = chunks.get()
+            time.sleep(max(0, due - time.monotonic()))
+            if not data:
+                destination.close()
+                return
+            try:
+                destination.sendall(data)
+            except OSError:
+                return
+
+
+_server = None
+_proxy = None
+
+
+def _get_server() -> LocalAccessoryServer:
+    # the server is only started if one of the benchmarks of this module runs
+    global _server
+    if _server is None:
+        _server = LocalAccessoryServer()
+    return _server
+
+
+def _get_proxy() -> LatencyProxy:
+    global _proxy
+    if _proxy is None:
+        _proxy = LatencyProxy(_get_server().server.server_address, ROUND_TRIP_TIME)
+    return _proxy
+
+
+def _get_characteristics(pipelining: bool, simulate_latency: bool):
+    def setup():
+        address = _get_proxy().address if simulate_latency else None
+        session = _get_server().create_session(pipelining, address)
+        target = '/characteristics?id=1.4'
+
+        def measure():
+            futures = [session.submit('GET', target) for _ in range(REQUESTS)]
+            for future in futures:
+                future.result().read()
+        return measure
+    return setup
+
+
+PIPELINING_BENCHMARKS = [
+    Benchmark('ip_get_characteristics[sequential][{n}]'.format(n=REQUESTS), _get_characteristics(False, False)),
+    Benchmark('ip_get_characteristics[pipelined][{n}]'.format(n=REQUESTS), _get_characteristics(True, False)),
+    Benchmark('ip_get_characteristics[sequential][{n}][rtt]'.format(n=REQUESTS), _get_characteristics(False, True)),
+    Benchmark('ip_get_characteristics[pipelined][{n}][rtt]'.format(n=REQUESTS), _get_characteristics(True, True)),
+]
@@ -0,0 +1,133 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import json
+import platform
+import sys
+import time
+
+from homekit.crypto import get_backend_name
+from homekit.tools import NUMPY_SUPPORTED
+
+
+class Benchmark(object):
+    """
+    A single benchmark. The setup function is called once and returns the callable that is timed.
+    """
+
+    def __init__(self, name: str, setup):
+        """
+        :param name: the unique name of the benchmark (e.g. chacha20_aead_encrypt[python][1024])
+        :param setup: function without parameters returning the function to measure
+        """
+        self.name = name
+        self.setup = setup
+
+    def measure(self, min_time: float = 0.2, repeat: int = 3) -> float:
+        """
+        Measures the function. It is called in loops that take at least min_time seconds, the best of repeat loops
+        is used.
+
+        :param min_time: the minimal duration of one loop in seconds
+        :param repeat: the number of loops
+        :return: the duration of one call in seconds
+        """
+        function = self.setup()
+        function()
+        best = None
+        for _ in range(repeat):
+            number = 0
+            start = time.perf_counter()
+            elapsed = 0
+            while elapsed < min_time:
+                function()
+                number += 1
+                elapsed = time.perf_counter() - start
+            per_call = elapsed / number
+            if best is None or per_call < best:
+                best = per_call
+        return best
+
+
+def run_benchmarks(benchmarks: list, name_filter: str = None, min_time: float = 0.2, repeat: int = 3,
+                   progress=None) -> dict:
+    """
+    Runs the given benchmarks.
+
+    :param benchmarks: list of Benchmark instances
+    :param name_filter: if set, only benchmarks with this string in their name are run
+    :param min_time: see Benchmark.measure
+    :param repeat: see Benchmark.measure
+    :param progress: optional function called with the name and the result of each finished benchmark
+    :return: dict with information about the environment and the duration per call (in seconds) for each benchmark
+    """
+    results = {}
+    for benchmark in benchmarks:
+        if name_filter and name_filter not in benchmark.name:
+            continue
+        results[benchmark.name] = benchmark.measure(min_time, repeat)
+        if progress:
+            progress(benchmark.name, results[benchmark.name])
+    return {
+        'python': platform.python_version(),
+        'platform': sys.platform,
+        'backend': get_backend_name(),
+        'numpy': NUMPY_SUPPORTED,
+        'results': results
+    }
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float = 0.25) -> list:
+    """
+    Compares the results of a run with a baseline. Benchmarks that are missing in one of both are ignored.
+
+    :param results: the results as returned by run_benchmarks
+    :param baseline: the results of an earlier run
+    :param tolerance: the allowed slow down relative to the baseline (0.25 means 25% slower)
+    :return: list of tuples (name, baseline duration, current duration) of all benchmarks that got slower
+    """
+    regressions = []
+    for name, duration in sorted(results['results'].items()):
+        baseline_duration = baseline['results'].get(name)
+        if baseline_duration is None:
+            continue
+        if duration > baseline_duration * (1 + tolerance):
+            regressions.append((name, baseline_duration, duration))
+    return regressions
+
+
+def load_results(filename: str) -> dict:
+    """
+    Loads results stored by save_results.
+
+    :param filename: the name of the JSON file
+    :return: the results
+    """
+    with open(filename, 'r') as input_fp:
+        return json.load(input_fp)
+
+
+def save_results(results: dict, filename: str):
+    """
+    Stores results as JSON.
+
+    :param results: the results as returned by run_benchmarks
+    :param filename: the name of the JSON file
+    """
+    with open(filename, 'w') as output_fp:
+        json.dump(results, output_fp, indent=2, sort_keys=True)
+        output_fp.write('\n')
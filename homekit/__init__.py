@@ -17,23 +17,25 @@
 __all__ = [
     'Controller', 'BluetoothAdapterError', 'AccessoryDisconnectedError', 'AccessoryNotFoundError',
     'AlreadyPairedError', 'AuthenticationError', 'BackoffError', 'BusyError', 'CharacteristicPermissionError',
-    'ConfigLoadingError', 'ConfigSavingError', 'ConfigurationError', 'FormatError', 'HomeKitException',
-    'HttpException', 'IncorrectPairingIdError', 'PairingAuthError', 'InvalidAuthTagError', 'InvalidError',
-    'InvalidSignatureError', 'MaxPeersError', 'MaxTriesError', 'ProtocolError', 'RequestRejected', 'UnavailableError',
-    'UnknownError', 'UnpairedError'
+    'CircuitOpenError', 'ConfigLoadingError', 'ConfigSavingError', 'ConfigurationError', 'ConnectionLimitError',
+    'FormatError', 'HomeKitException', 'HttpException', 'IncorrectPairingIdError', 'PairingAuthError',
+    'InvalidAuthTagError', 'InvalidError', 'InvalidSignatureError', 'MaxPeersError', 'MaxTriesError', 'ProtocolError',
+    'RequestRejected', 'UnavailableError', 'UnknownError', 'UnpairedError'
 ]
 
 from homekit.controller import Controller
 from homekit.exceptions import BluetoothAdapterError, AccessoryDisconnectedError, AccessoryNotFoundError, \
-    AlreadyPairedError, AuthenticationError, BackoffError, BusyError, CharacteristicPermissionError, \
-    ConfigLoadingError, ConfigSavingError, ConfigurationError, FormatError, HomeKitException, HttpException, \
-    IncorrectPairingIdError, PairingAuthError, InvalidAuthTagError, InvalidError, InvalidSignatureError, \
-    MaxPeersError, MaxTriesError, ProtocolError, RequestRejected, UnavailableError, UnknownError, UnpairedError
+    AlreadyPairedError, AuthenticationError, BackoffError, BusyError, CharacteristicPermissionError, CircuitOpenError, \
+    ConfigLoadingError, ConfigSavingError, ConfigurationError, ConnectionLimitError, FormatError, HomeKitException, \
+    HttpException, IncorrectPairingIdError, PairingAuthError, InvalidAuthTagError, InvalidError, \
+    InvalidSignatureError, MaxPeersError, MaxTriesError, ProtocolError, RequestRejected, UnavailableError, \
+    UnknownError, UnpairedError
 
 from homekit.tools import IP_TRANSPORT_SUPPORTED
 
 if IP_TRANSPORT_SUPPORTED:
     # TODO: change import and let it be imported from its specific file
     from homekit.accessoryserver import AccessoryServer  # noqa: F401
+    from homekit.controller import AsyncController  # noqa: F401
 
-    __all__.append('AccessoryServer')
+    __all__.extend(['AccessoryServer', 'AsyncController'])
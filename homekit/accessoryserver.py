@@ -18,6 +18,7 @@ import binascii
 import hashlib
 import io
 import json
+import os
 from json.decoder import JSONDecodeError
 import select
 import threading
@@ -37,14 +38,18 @@ from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives import serialization
 
 from homekit.crypto.chacha20poly1305 import chacha20_aead_decrypt, chacha20_aead_encrypt
+from homekit.crypto.key_derivation import derive_keys
+from homekit.crypto.session_cipher import SessionCipher
 from homekit.crypto.srp import SrpServer
 
 from homekit.exceptions import ConfigurationError, ConfigLoadingError, ConfigSavingError, FormatError, \
-    CharacteristicPermissionError, DisconnectedControllerError
-from homekit.http_impl import HttpStatusCodes
+    CharacteristicPermissionError, DisconnectedControllerError, EncryptionError
+from homekit.http_impl import HttpStatusCodes, HapFrameDecoder
 from homekit.model import Accessories, Categories
 from homekit.model.characteristics import CharacteristicsTypes
-from homekit.protocol import States, Methods, Errors, TlvTypes
+from homekit.protocol import States, Methods, Errors, TlvTypes, ResumeCache, derive_control_keys, \
+    derive_resume_key, derive_resume_session_id
+from homekit.protocol.session_resume import SESSION_ID_LENGTH
 from homekit.protocol.statuscodes import HapStatusCodes
 
 
@@ -173,6 +178,42 @@ class AccessoryServerData:
         self.data['accessory_ltsk'] = binascii.hexlify(accessory_ltsk).decode()[:64]
         self._save_data()
 
+    @property
+    def srp_verifier(self) -> tuple:
+        """
+        Returns the SRP salt and verifier stored for the current setup code. Computing the verifier is expensive, so it
+        is reused for all pair setup attempts until a pairing succeeded or the setup code changed. The trade-off is
+        that all controllers attempting pair setup in that time get the same salt, so the verifier is rotated after
+        each successful pairing (see clear_srp_verifier) to not hand out one salt for the lifetime of the accessory.
+
+        :return: tuple of salt and verifier as ints or None if there is nothing stored for the current setup code
+        """
+        entry = self.data.get('srp_verifier')
+        if not entry or entry['setup_code'] != self.setup_code:
+            return None
+        return int(entry['salt'], 16), int(entry['verifier'], 16)
+
+    def set_srp_verifier(self, salt: int, verifier: int):
+        """
+        Stores the SRP salt and verifier computed for the current setup code.
+
+        :param salt: the salt as int
+        :param verifier: the verifier as int
+        """
+        self.data['srp_verifier'] = {
+            'setup_code': self.setup_code,
+            'salt': format(salt, 'x'),
+            'verifier': format(verifier, 'x')
+        }
+        self._save_data()
+
+    def clear_srp_verifier(self):
+        """
+        Drops the stored SRP salt and verifier, so the next pair setup computes them with a new salt.
+        """
+        if self.data.pop('srp_verifier', None) is not None:
+            self._save_data()
+
     @property
     def configuration_number(self) -> int:
         return self.data['c#']
@@ -203,6 +244,8 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
     DEBUG_PAIR_VERIFY = False
     DEBUG_GET_CHARACTERISTICS = False
     timeout = 300
+    # responses are written as soon as they are complete, so there is nothing to gain from delaying small segments
+    disable_nagle_algorithm = True
 
     def __init__(self, request, client_address, server):
         # keep pycharm from complaining about those not being define in __init__
@@ -246,6 +289,10 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
 
         self.write_lock = threading.Lock()
         self.subscriptions = set()
+        # decodes the encrypted frames of the controller once the session is verified
+        self.frame_decoder = None
+        # decrypted data of requests that were not handled yet (e.g. pipelined requests)
+        self.request_buffer = bytearray()
 
         # init super class
         BaseHTTPRequestHandler.__init__(self, request, client_address, server)
@@ -292,21 +339,8 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
                 self.log_message('response >%s<', data)
                 self.log_message('len(response) %s', len(data))
 
-            block_size = 1024
-            out_data = bytearray()
-            while len(data) > 0:
-                block = data[:block_size]
-                if AccessoryRequestHandler.DEBUG_CRYPT:
-                    self.log_message('==> BLOCK: len %s', len(block))
-                data = data[block_size:]
-
-                len_bytes = len(block).to_bytes(2, byteorder='little')
-                a2c_key = self.server.sessions[self.session_id]['accessory_to_controller_key']
-                cnt_bytes = self.server.sessions[self.session_id]['accessory_to_controller_count']. \
-                    to_bytes(8, byteorder='little')
-                ciper_and_mac = chacha20_aead_encrypt(len_bytes, a2c_key, cnt_bytes, bytes([0, 0, 0, 0]), block)
-                self.server.sessions[self.session_id]['accessory_to_controller_count'] += 1
-                out_data += len_bytes + ciper_and_mac[0] + ciper_and_mac[1]
+            a2c_cipher = self.server.sessions[self.session_id]['accessory_to_controller_cipher']
+            out_data = a2c_cipher.seal_frames(data)
 
             # TODO what exceptions/Errors could be raised here?
             try:
@@ -322,6 +356,11 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
         the request. To be valid unencrypted HTTP call, it must be one of the methods defined in RFC7231 Section 4
         "Request Methods".
         """
+        if self.request_buffer or (self.frame_decoder is not None and self.frame_decoder.pending):
+            # the rest of an encrypted request or the next pipelined request was already received
+            self._handle_encrypted_request()
+            return
+
         try:
             # make connection non blocking so the select can work
             self.connection.setblocking(0)
@@ -367,34 +406,77 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             self.log_debug('Unicode exception %s' % e)
             pass
 
-        # the first 2 bytes are the length of the encrypted data to follow
-        len_bytes = self.rfile.read(2)
-        data_len = int.from_bytes(len_bytes, byteorder='little')
+        self._handle_encrypted_request()
 
-        # the auth tag is not counted, so add its length
-        data = self.rfile.read(data_len + 16)
-        if AccessoryRequestHandler.DEBUG_CRYPT:
-            self.log_message('data >%i< >%s<', len(data), binascii.hexlify(data))
+    def _receive_frames(self):
+        """
+        Receives from the controller until at least one complete frame is available and decrypts all complete frames.
 
-        # get the crypto key from the session
-        c2a_key = self.server.sessions[self.session_id]['controller_to_accessory_key']
+        :return: the list of decrypted segments or None if the connection has to be closed
+        """
+        c2a_cipher = self.server.sessions[self.session_id]['controller_to_accessory_cipher']
+        if self.frame_decoder is None or self.frame_decoder.cipher is not c2a_cipher:
+            self.frame_decoder = HapFrameDecoder(c2a_cipher)
 
-        # verify & decrypt the read data
-        cnt_bytes = self.server.sessions[self.session_id]['controller_to_accessory_count'].to_bytes(8,
-                                                                                                    byteorder='little')
-        decrypted = chacha20_aead_decrypt(len_bytes, c2a_key, cnt_bytes, bytes([0, 0, 0, 0]),
-                                          data)
-        if decrypted is False:
+        try:
+            segments = self.frame_decoder.decode()
+            while not segments:
+                received = self.frame_decoder.receive_from(self.rfile)
+                if received == 0:
+                    self.log_error('connection closed within a frame')
+                    return None
+                if received is None and not select.select([self.connection], [], [], 1)[0]:
+                    self.log_error('incomplete frame')
+                    return None
+                segments = self.frame_decoder.decode()
+        except EncryptionError:
             # crypto error, log it and request close of connection
-            self.log_error('SEVERE: Could not decrypt %s', binascii.hexlify(data))
-            self.close_connection = True
-            return
+            self.log_error('SEVERE: Could not decrypt frame')
+            return None
+        except (socket.timeout, OSError) as e:
+            self.log_error(' %r', e)
+            return None
+        return segments
+
+    @staticmethod
+    def _request_length(data):
+        """
+        Determines the length of the first request in the decrypted data using the Content-Length header.
+
+        :param data: the decrypted data
+        :return: the length of the first request or None if the request is not complete yet
+        """
+        header_end = data.find(b'\r\n\r\n')
+        if header_end == -1:
+            return None
+        length = header_end + 4
+        for line in bytes(data[:header_end]).split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                try:
+                    length += int(value.strip())
+                except ValueError:
+                    # the request is handled as it is and the error is reported by the HTTP parser
+                    pass
+        return length if len(data) >= length else None
+
+    def _handle_encrypted_request(self):
+        # a request may span several frames and one read may also contain the frames of several requests
+        length = self._request_length(self.request_buffer)
+        while length is None:
+            segments = self._receive_frames()
+            if segments is None:
+                self.close_connection = True
+                return
+            for segment in segments:
+                self.request_buffer += segment
+            length = self._request_length(self.request_buffer)
+        decrypted = bytes(self.request_buffer[:length])
+        del self.request_buffer[:length]
 
         if AccessoryRequestHandler.DEBUG_CRYPT:
             self.log_message('crypted request >%s<', decrypted)
 
-        self.server.sessions[self.session_id]['controller_to_accessory_count'] += 1
-
         # replace the original rfile with a fake with the decrypted stuff
         old_rfile = self.rfile
         self.rfile = io.BytesIO(decrypted)
@@ -649,13 +731,23 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
         self._log_wrong_content_type('application/pairing+tlv8')
         d_req = tlv8.decode(self.body, {
             TlvTypes.State: tlv8.DataType.INTEGER,
+            TlvTypes.Method: tlv8.DataType.INTEGER,
             TlvTypes.PublicKey: tlv8.DataType.BYTES,
             TlvTypes.EncryptedData: tlv8.DataType.BYTES,
+            TlvTypes.SessionID: tlv8.DataType.BYTES,
         })
 
         d_res = []
 
         state = d_req.first_by_id(TlvTypes.State).data
+        method = d_req.first_by_id(TlvTypes.Method)
+        if state == States.M1 and method and method.data == Methods.kTLVMethod_Resume:
+            if self._pair_resume(d_req):
+                return
+            # the session cannot be resumed, so go on with a full pair verify using the request's public key
+            if AccessoryRequestHandler.DEBUG_PAIR_VERIFY:
+                self.log_message('pair resume failed, falling back to pair verify')
+
         if state == States.M1:
             # step #2 Accessory -> iOS Device Verify Start Response
             if AccessoryRequestHandler.DEBUG_PAIR_VERIFY:
@@ -695,8 +787,8 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             sub_tlv_b = tlv8.encode(sub_tlv)
 
             # 6) derive session key
-            hkdf_inst = hkdf.Hkdf('Pair-Verify-Encrypt-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-            session_key = hkdf_inst.expand('Pair-Verify-Encrypt-Info'.encode(), 32)
+            session_key, = derive_keys('Pair-Verify-Encrypt-Salt'.encode(), shared_secret,
+                                       'Pair-Verify-Encrypt-Info'.encode())
             self.server.sessions[self.session_id]['session_key'] = session_key
 
             # 7) encrypt sub tlv
@@ -765,15 +857,11 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
 
             #
             shared_secret = self.server.sessions[self.session_id]['shared_secret']
-            hkdf_inst = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-            controller_to_accessory_key = hkdf_inst.expand('Control-Write-Encryption-Key'.encode(), 32)
-            self.server.sessions[self.session_id]['controller_to_accessory_key'] = controller_to_accessory_key
-            self.server.sessions[self.session_id]['controller_to_accessory_count'] = 0
+            self._set_session_keys(shared_secret)
 
-            hkdf_inst = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-            accessory_to_controller_key = hkdf_inst.expand('Control-Read-Encryption-Key'.encode(), 32)
-            self.server.sessions[self.session_id]['accessory_to_controller_key'] = accessory_to_controller_key
-            self.server.sessions[self.session_id]['accessory_to_controller_count'] = 0
+            # remember the session so the controller can resume it with its next connection
+            resume_session_id = derive_resume_session_id(shared_secret)
+            self.server.resume_cache.put(resume_session_id, resume_session_id, shared_secret, ios_device_pairing_id)
 
             d_res.append(tlv8.Entry(TlvTypes.State, States.M4))
 
@@ -791,6 +879,66 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
         """
         self.send_error(HttpStatusCodes.NOT_FOUND)
 
+    def _set_session_keys(self, shared_secret):
+        controller_to_accessory_key, accessory_to_controller_key = derive_control_keys(shared_secret)
+        self.server.sessions[self.session_id]['controller_to_accessory_cipher'] = \
+            SessionCipher(controller_to_accessory_key)
+        self.server.sessions[self.session_id]['accessory_to_controller_cipher'] = \
+            SessionCipher(accessory_to_controller_key)
+
+    def _pair_resume(self, d_req):
+        """
+        Handles a pair resume request (M1 with method resume, see Table 6-27 page 116) by answering with M2 if the
+        session is known to the accessory and the request's auth tag is valid.
+
+        :param d_req: the decoded request
+        :return: True if the session was resumed and the response was sent, False if a full pair verify is required
+        """
+        if AccessoryRequestHandler.DEBUG_PAIR_VERIFY:
+            self.log_message('Step #2 /pair-verify (resume)')
+
+        session_id = d_req.first_by_id(TlvTypes.SessionID)
+        ios_device_pub_key = d_req.first_by_id(TlvTypes.PublicKey)
+        encrypted = d_req.first_by_id(TlvTypes.EncryptedData)
+        if not session_id or not ios_device_pub_key or not encrypted:
+            return False
+        ios_device_pub_key = bytes(ios_device_pub_key.data)
+
+        # each session can be resumed only once
+        resumable = self.server.resume_cache.pop(bytes(session_id.data))
+        if resumable is None:
+            return False
+        _, shared_secret, ios_device_pairing_id = resumable
+
+        # the controller might have been removed since the session was established
+        if self.server.data.get_peer_key(ios_device_pairing_id) is None:
+            return False
+
+        request_key = derive_resume_key(shared_secret, ios_device_pub_key, session_id.data, 'Pair-Resume-Request-Info')
+        if chacha20_aead_decrypt(bytes(), request_key, 'PR-Msg01'.encode(), bytes([0, 0, 0, 0]),
+                                 encrypted.data) is False:
+            return False
+
+        new_session_id = os.urandom(SESSION_ID_LENGTH)
+        response_key, shared_secret = derive_resume_key(shared_secret, ios_device_pub_key, new_session_id,
+                                                        'Pair-Resume-Response-Info', 'Pair-Resume-Shared-Secret-Info')
+        _, auth_tag = chacha20_aead_encrypt(bytes(), response_key, 'PR-Msg02'.encode(), bytes([0, 0, 0, 0]),
+                                            bytes())
+        self.server.resume_cache.put(new_session_id, new_session_id, shared_secret, ios_device_pairing_id)
+
+        self.server.sessions[self.session_id]['ios_device_pairing_id'] = ios_device_pairing_id
+        self._set_session_keys(shared_secret)
+
+        d_res = [
+            tlv8.Entry(TlvTypes.State, States.M2),
+            tlv8.Entry(TlvTypes.SessionID, new_session_id),
+            tlv8.Entry(TlvTypes.EncryptedData, auth_tag)
+        ]
+        self._send_response_tlv(d_res)
+        if AccessoryRequestHandler.DEBUG_PAIR_VERIFY:
+            self.log_message('after step #2 (resume)\n%s', tlv8.format_string(d_res))
+        return True
+
     def _post_pairings(self):
         """
 
@@ -997,8 +1145,15 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
                 self.send_error_reply(States.M2, Errors.Busy)
                 return
 
-            # 4) 5) 7) Create in SRP Session, set username and password
-            server = SrpServer('Pair-Setup', self.server.data.setup_code)
+            # 4) 5) 7) Create in SRP Session, set username and password. Salt and verifier are reused if they were
+            # already computed for this setup code since the last successful pairing
+            srp_verifier = self.server.data.srp_verifier
+            if srp_verifier:
+                salt, verifier = srp_verifier
+                server = SrpServer('Pair-Setup', self.server.data.setup_code, salt=salt, verifier=verifier)
+            else:
+                server = SrpServer('Pair-Setup', self.server.data.setup_code)
+                self.server.data.set_srp_verifier(server.get_salt(), server.get_verifier())
 
             # 6) create salt
             salt = server.get_salt()
@@ -1111,6 +1266,8 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
 
             # 6) save ios_device_pairing_id and ios_device_ltpk
             self.server.data.add_peer(ios_device_pairing_id, ios_device_ltpk, True)
+            # the next pair setup uses a new salt
+            self.server.data.clear_srp_verifier()
 
             # Response Generation
             # 1) generate accessoryLTPK if not existing
@@ -1292,6 +1449,7 @@ class AccessoryServer(ThreadingMixIn, HTTPServer):
         self.data = AccessoryServerData(config_file)
         self.data.increase_configuration_number()
         self.sessions = {}
+        self.resume_cache = ResumeCache()
         self.zeroconf = Zeroconf()
         self.mdns_type = '_hap._tcp.local.'
         self.mdns_name = self.data.name + '._hap._tcp.local.'
@@ -19,3 +19,9 @@ __all__ = [
 ]
 
 from homekit.controller.controller import Controller, PairingAuth, PairingAuthMap
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit.controller.async_ip_implementation import AsyncController, AsyncIpPairing  # noqa: F401
+
+    __all__.extend(['AsyncController', 'AsyncIpPairing'])
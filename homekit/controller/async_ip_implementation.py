@@ -0,0 +1,652 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from json.decoder import JSONDecodeError
+
+import tlv8
+
+from homekit.controller.attribute_database import AttributeDatabase
+from homekit.controller.controller import Controller
+from homekit.controller.ip_implementation import _cached_accessories, _characteristics_body, _characteristics_url, \
+    _decode_characteristics, _decode_errors, _decode_events, _dump_json, _events_body, _normalize_accessories, \
+    _set_config_number, _store_accessories
+from homekit.controller.tools import RESUME_CACHE
+from homekit.crypto.session_cipher import SessionCipher
+from homekit.exceptions import AccessoryDisconnectedError, AccessoryNotFoundError, EncryptionError, HttpException
+from homekit.http_impl import HttpContentTypes
+from homekit.http_impl.frame_decoder import HapFrameDecoder
+from homekit.http_impl.request_builder import RequestBuilder
+from homekit.http_impl.response import HttpResponse
+from homekit.protocol import get_session_keys
+from homekit.protocol.pairing_keys import PairingKeys
+from homekit.zeroconf_impl import find_device_ip_port_props
+
+
+class AsyncIpSession(object):
+    """
+    An encrypted session with a HomeKit IP accessory on top of asyncio streams. A reader task reads all messages of the
+    session, passes events to the event listeners and resolves the waiting requests in FIFO order. So requests issued
+    concurrently by several tasks share the connection with the event stream.
+    """
+
+    def __init__(self, pairing_data, resume_cache=RESUME_CACHE, pairing_keys=None, timeout=10):
+        """
+        Creates an unconnected session, call connect to establish it.
+
+        :param pairing_data: the pairing data of the accessory
+        :param resume_cache: the ResumeCache to resume earlier sessions from or None to always perform a full pair
+                             verify
+        :param pairing_keys: the PairingKeys of the pairing or None to parse the keys from the pairing data
+        :param timeout: the number of seconds to wait for connections and responses
+        """
+        self.pairing_data = pairing_data
+        self.resume_cache = resume_cache
+        self.pairing_keys = pairing_keys
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.event_listeners = []
+        self._requests = None
+        self._c2a_cipher = None
+        self._decoder = None
+        self._pending = deque()
+        self._read_task = None
+        # without pipelining only one request may be in flight
+        self._request_lock = None if pairing_data.get('Pipelining', False) else asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        """
+        :return: True while the session is established
+        """
+        return self.writer is not None
+
+    async def connect(self):
+        """
+        Connects to the accessory and performs pair verify (or pair resume). If the accessory is not reachable at the
+        known address, it is looked up via zeroconf.
+
+        :raises AccessoryNotFoundError: if the device can not be found via zeroconf
+        """
+        logging.debug('init async session')
+        connected = False
+        if 'AccessoryIP' in self.pairing_data and 'AccessoryPort' in self.pairing_data:
+            connected = await self._connect(self.pairing_data['AccessoryIP'], self.pairing_data['AccessoryPort'])
+
+        if not connected:
+            # the zeroconf lookup blocks, so it runs in the default executor
+            device_id = self.pairing_data['AccessoryPairingID']
+            connection_data = await asyncio.get_event_loop().run_in_executor(None, find_device_ip_port_props,
+                                                                             device_id)
+            if connection_data is None:
+                raise AccessoryNotFoundError('Device {id} not found'.format(id=device_id))
+            self.pairing_data['AccessoryIP'] = connection_data['ip']
+            self.pairing_data['AccessoryPort'] = connection_data['port']
+            _set_config_number(self.pairing_data, connection_data['properties'].get('c#'))
+            if not await self._connect(connection_data['ip'], connection_data['port']):
+                raise AccessoryNotFoundError('Device {id} not reachable'.format(id=device_id))
+
+        logging.debug('async session established')
+
+    async def _connect(self, accessory_ip, accessory_port):
+        try:
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(accessory_ip, accessory_port),
+                                                              self.timeout)
+            self._requests = RequestBuilder(accessory_ip, accessory_port,
+                                            (HttpContentTypes.JSON, HttpContentTypes.TLV))
+
+            state_machine = get_session_keys(self.pairing_data, self.resume_cache, self.pairing_keys)
+            request, expected = state_machine.send(None)
+            while True:
+                response = await asyncio.wait_for(self._pair_verify_request(request, expected), self.timeout)
+                try:
+                    request, expected = state_machine.send(response)
+                except StopIteration as result:
+                    c2a_key, a2c_key = result.value
+                    break
+        except (OSError, asyncio.TimeoutError, AccessoryDisconnectedError) as e:
+            logging.debug('Failed to connect to accessory: %s', e)
+            self._close_writer()
+            return False
+        except Exception:
+            self._close_writer()
+            raise
+
+        self._c2a_cipher = SessionCipher(c2a_key)
+        self._decoder = HapFrameDecoder(SessionCipher(a2c_key))
+        self._read_task = asyncio.ensure_future(self._read_loop())
+        return True
+
+    async def _pair_verify_request(self, request, expected):
+        """
+        Sends one unencrypted request of the pair verify exchange and reads the response.
+
+        :param request: the TLV entries of the request
+        :param expected: the TLV types and data types expected in the response
+        :return: the decoded TLV response
+        """
+        body = tlv8.encode(request)
+        logging.debug('write message: %s', tlv8.format_string(tlv8.deep_decode(body)))
+        self.writer.write(self._requests.build(b'POST', '/pair-verify', body, HttpContentTypes.TLV))
+        response = HttpResponse()
+        while not response.is_read_completely():
+            data = await self.reader.read(4096)
+            if not data:
+                raise AccessoryDisconnectedError('Connection closed by the accessory')
+            response.parse(data)
+        response_tlv = tlv8.decode(response.read(), expected)
+        logging.debug('response: %s', tlv8.format_string(response_tlv))
+        return response_tlv
+
+    async def _read_loop(self):
+        response = HttpResponse()
+        try:
+            while True:
+                received = await self._decoder.receive_from_stream(self.reader)
+                if not received:
+                    raise AccessoryDisconnectedError('Connection closed by the accessory')
+                for segment in self._decoder.decode():
+                    data = segment
+                    while data:
+                        data = response.parse(data)
+                        if response.is_read_completely():
+                            self._dispatch(response)
+                            response = HttpResponse()
+        except asyncio.CancelledError:
+            self._fail(AccessoryDisconnectedError('Session closed'))
+            raise
+        except (AccessoryDisconnectedError, EncryptionError, HttpException, OSError) as e:
+            if not isinstance(e, (AccessoryDisconnectedError, EncryptionError)):
+                e = AccessoryDisconnectedError(str(e))
+            self._fail(e)
+
+    def _dispatch(self, response):
+        if response.get_http_name() == 'EVENT':
+            self._notify(response)
+            return
+        if not self._pending:
+            logging.debug('dropping response without request')
+            return
+        # each response belongs to the oldest request, even if its caller was cancelled meanwhile
+        future = self._pending.popleft()
+        if future.done():
+            logging.debug('dropping response of cancelled request')
+        else:
+            future.set_result(response)
+
+    def _notify(self, event):
+        for listener in list(self.event_listeners):
+            try:
+                listener(event)
+            except Exception:
+                logging.exception('event listener failed')
+
+    def _fail(self, error):
+        """
+        Closes the connection, fails all outstanding requests and passes the error to the event listeners.
+        """
+        self._close_writer()
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+        self._notify(error)
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def request(self, method, target, body=None, content_type=HttpContentTypes.JSON):
+        """
+        Performs a HTTP request via the encrypted session.
+
+        :param method: the HTTP method, e.g. GET or PUT
+        :param target: the target of the request, e.g. /characteristics?id=1.10
+        :param body: the body as str or bytes or None for requests without body
+        :param content_type: the content of the content-type header, used only if there is a body
+        :return: a homekit.http_impl.HttpResponse object
+        :raises AccessoryDisconnectedError: if the connection broke or the accessory did not answer in time
+        """
+        if self._request_lock is None:
+            return await self._request(method, target, body, content_type)
+        async with self._request_lock:
+            return await self._request(method, target, body, content_type)
+
+    async def _request(self, method, target, body, content_type):
+        if self.writer is None:
+            raise AccessoryDisconnectedError('Session is closed')
+        data = self._requests.build(method.encode(), target, body, content_type)
+        logging.debug('handle request: %s', data)
+        future = asyncio.get_event_loop().create_future()
+        # there is no await between queueing and writing, so the queue has the order of the requests on the wire
+        self._pending.append(future)
+        self.writer.write(self._c2a_cipher.seal_frames(data))
+        try:
+            await self.writer.drain()
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            # the following responses cannot be matched anymore, so the connection is unusable
+            error = AccessoryDisconnectedError('No complete response within {t} seconds'.format(t=self.timeout))
+            self._fail(error)
+            raise error
+        except OSError as e:
+            raise AccessoryDisconnectedError(str(e))
+
+    async def get(self, url):
+        return await self.request('GET', url)
+
+    async def put(self, url, body, content_type=HttpContentTypes.JSON):
+        return await self.request('PUT', url, body, content_type)
+
+    async def post(self, url, body, content_type=HttpContentTypes.JSON):
+        return await self.request('POST', url, body, content_type)
+
+    async def close(self):
+        """
+        Closes the session. Outstanding requests fail with AccessoryDisconnectedError.
+        """
+        self._close_writer()
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+            self._read_task = None
+
+    def abort(self):
+        """
+        Closes the session without waiting for the reader task, e.g. outside of a coroutine. Outstanding requests fail
+        with AccessoryDisconnectedError once the event loop ran the cancelled reader task.
+        """
+        self._close_writer()
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+
+
+class AsyncEventIterator(object):
+    """
+    Asynchronous iterator over the events of characteristics. The first iteration step registers for the events
+    (this can also be done before with subscribe). Each step returns a list of 3-tupels of aid, iid and the value, e.g.:
+      [(1, 9, 26.1), (1, 10, 30.5)]
+
+    The iteration ends after max_events events or max_seconds seconds or immediately if the accessory rejected the
+    registration for any of the characteristics. In the latter case errors holds a dict mapping 2-tupels of aid and iid
+    to dicts with status and description.
+    """
+
+    def __init__(self, pairing, characteristics, max_events=-1, max_seconds=-1):
+        self.pairing = pairing
+        self.characteristics = characteristics
+        self.max_events = max_events
+        self.max_seconds = max_seconds
+        self.errors = None
+        # created on first use, so the iterator can be created outside of the event loop
+        self._events = None
+        self._session = None
+        self._event_count = 0
+        self._end = None
+
+    async def subscribe(self) -> dict:
+        """
+        Registers for the events unless this was done already.
+
+        :return: a dict mapping 2-tupels of aid and iid to dicts with status and description for all characteristics
+                 the accessory rejected
+        """
+        if self.errors is not None:
+            return self.errors
+        self._session = await self.pairing._get_session()
+        self._events = asyncio.Queue()
+        # listen before registering, so no event gets lost
+        self._session.event_listeners.append(self._events.put_nowait)
+        response = await self.pairing._request('PUT', '/characteristics', _events_body(self.characteristics))
+        self.errors = {}
+        if response.code != 204:
+            self.errors = _decode_errors(await self.pairing._decode_json(response, 'characteristics'))
+        if self.max_seconds != -1:
+            self._end = time.monotonic() + self.max_seconds
+        return self.errors
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if await self.subscribe() or self._event_count == self.max_events:
+            self._stop()
+            raise StopAsyncIteration
+        while True:
+            timeout = None if self._end is None else self._end - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                self._stop()
+                raise StopAsyncIteration
+            try:
+                event = await asyncio.wait_for(self._events.get(), timeout)
+            except asyncio.TimeoutError:
+                continue
+            if isinstance(event, Exception):
+                self._stop()
+                raise event
+            body = event.read().decode()
+            if not body:
+                continue
+            try:
+                data = json.loads(body)['characteristics']
+            except (JSONDecodeError, KeyError):
+                self._stop()
+                await self.pairing.close()
+                raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
+            self._event_count += 1
+            return _decode_events(data)
+
+    def _stop(self):
+        if self._session is not None and self._events.put_nowait in self._session.event_listeners:
+            self._session.event_listeners.remove(self._events.put_nowait)
+
+
+class AsyncIpPairing(object):
+    """
+    This represents a paired HomeKit IP accessory with an asyncio based API. All methods are coroutines and the
+    session is established on first use.
+    """
+
+    def __init__(self, pairing_data):
+        """
+        Initialize a Pairing by using the data either loaded from file or obtained after calling
+        Controller.perform_pairing().
+
+        :param pairing_data:
+        """
+        self.pairing_data = pairing_data
+        self.session = None
+        self._pairing_keys = None
+        self._attribute_database = None
+        # created on first use, so the pairing can be created outside of the event loop (e.g. by load_data)
+        self._connect_lock = None
+
+    def _get_pairing_data(self):
+        """
+        This method returns the internal pairing data. DO NOT mess around with it.
+
+        :return: a dict containing the data
+        """
+        return self.pairing_data
+
+    @property
+    def pairing_keys(self):
+        """
+        The parsed long term keys of the pairing, created on first use and reused by all following sessions.
+
+        :return: a PairingKeys instance for the pairing data
+        """
+        if self._pairing_keys is None:
+            self._pairing_keys = PairingKeys(self.pairing_data)
+        return self._pairing_keys
+
+    @property
+    def attribute_database(self):
+        """
+        The index over the accessories of the pairing data, rebuilt after the accessories were fetched anew.
+
+        :return: an AttributeDatabase for the accessories in the pairing data
+        """
+        accessories = self.pairing_data.get('accessories', [])
+        if self._attribute_database is None or self._attribute_database.accessories is not accessories:
+            self._attribute_database = AttributeDatabase(accessories)
+        return self._attribute_database
+
+    async def close(self):
+        """
+        Close the pairing's communications. This closes the session.
+        """
+        if self.session:
+            session = self.session
+            self.session = None
+            await session.close()
+
+    def abort(self):
+        """
+        Close the pairing's communications without waiting for the session to be closed (see AsyncIpSession.abort).
+        """
+        if self.session:
+            session = self.session
+            self.session = None
+            session.abort()
+
+    async def connect(self):
+        """
+        Establishes the session now instead of with the first request.
+
+        :raises AccessoryDisconnectedError: if the session could not be established
+        :raises AccessoryNotFoundError: if the device can not be found via zeroconf
+        """
+        await self._get_session()
+
+    async def _get_session(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.session is None or not self.session.connected:
+                session = AsyncIpSession(self.pairing_data, pairing_keys=self.pairing_keys)
+                await session.connect()
+                self.session = session
+            return self.session
+
+    async def _request(self, method, url, body=None, content_type=HttpContentTypes.JSON):
+        session = await self._get_session()
+        try:
+            return await session.request(method, url, body, content_type)
+        except (AccessoryDisconnectedError, EncryptionError):
+            await self.close()
+            raise
+
+    async def _decode_json(self, response, key):
+        try:
+            return json.loads(response.read().decode())[key]
+        except JSONDecodeError:
+            await self.close()
+            raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
+
+    def update_config_number(self, config_number):
+        """
+        Records the configuration number (c#) of the accessory, see IpPairing.update_config_number.
+
+        :param config_number: the c# from the accessory's zeroconf TXT record
+        :return: True if the cached attribute database is outdated
+        """
+        return _set_config_number(self.pairing_data, config_number)
+
+    async def list_accessories_and_characteristics(self, refresh=False):
+        """
+        This retrieves a current set of accessories and characteristics behind this pairing. Like with IpPairing, the
+        attribute database is only fetched if the accessory's configuration number changed or is unknown.
+
+        :param refresh: if True, the attribute database is fetched from the accessory even if it is cached
+        :return: the accessory data as described in the spec on page 73 and following
+        :raises AccessoryNotFoundError: if the device can not be found via zeroconf
+        """
+        if not refresh:
+            accessories = _cached_accessories(self.pairing_data)
+            if accessories is not None:
+                return accessories
+        response = await self._request('GET', '/accessories')
+        accessories = _normalize_accessories(await self._decode_json(response, 'accessories'))
+        _store_accessories(self.pairing_data, accessories)
+        return accessories
+
+    async def get_characteristics(self, characteristics, include_meta=False, include_perms=False, include_type=False,
+                                  include_events=False):
+        """
+        This method is used to get the current readouts of any characteristic of the accessory. See
+        IpPairing.get_characteristics for the parameters.
+
+        :return: a dict mapping 2-tupels of aid and iid to dicts with value or status and description
+        """
+        url = _characteristics_url(characteristics, include_meta, include_perms, include_type, include_events)
+        response = await self._request('GET', url)
+        return _decode_characteristics(await self._decode_json(response, 'characteristics'))
+
+    async def put_characteristics(self, characteristics, do_conversion=False):
+        """
+        Update the values of writable characteristics. See IpPairing.put_characteristics for the parameters.
+
+        :return: a dict from (aid, iid) onto {status, description}
+        :raises FormatError: if the input value could not be converted to the target type and conversion was
+                             requested
+        """
+        if do_conversion and 'accessories' not in self.pairing_data:
+            await self.list_accessories_and_characteristics()
+        response = await self._request('PUT', '/characteristics',
+                                       _characteristics_body(self.attribute_database, characteristics, do_conversion))
+        if response.code != 204:
+            return _decode_errors(await self._decode_json(response, 'characteristics'), include_success=True)
+        return {}
+
+    async def get_resource(self, resource_request):
+        """
+        This method performs a request to read the /resource endpoint of an accessory (e.g. a snapshot of an IP
+        camera, see spec R2, chapter 11.5 page 242).
+
+        :param resource_request: a dict of values to be sent to the accessory as a json dump
+        :return: tuple of the content type and the content of the response body as bytes
+        """
+        response = await self._request('POST', '/resource', _dump_json(resource_request).encode())
+        return response.get_header('Content-Type', 'application/octet-stream'), response.read()
+
+    def get_events(self, characteristics, max_events=-1, max_seconds=-1):
+        """
+        Returns an asynchronous iterator over the events of the characteristics, e.g.
+
+            async for events in pairing.get_events([(1, 10)], max_seconds=60):
+                print(events)
+
+        Requests of other tasks share the session with the events.
+
+        :param characteristics: a list of 2-tupels of accessory id (aid) and instance id (iid)
+        :param max_events: number of reported events, default value -1 means unlimited
+        :param max_seconds: number of seconds to wait for events, default value -1 means unlimited
+        :return: an AsyncEventIterator
+        """
+        return AsyncEventIterator(self, characteristics, max_events, max_seconds)
+
+
+class AsyncController(Controller):
+    """
+    A controller whose IP pairings are AsyncIpPairing instances. Pair setup and the other pairing types work like in
+    Controller. The methods that need a session to an IP accessory have coroutine variants (aprewarm, aremove_pairing
+    and aclose), the blocking methods inherited from Controller raise NotImplementedError for AsyncIpPairing instead
+    of blocking the event loop.
+    """
+
+    def _create_ip_pairing(self, pairing_data):
+        return AsyncIpPairing(pairing_data)
+
+    def shutdown(self):
+        """
+        Shuts down the controller by closing all connections that might be held open by the pairings of the controller.
+        The sessions of AsyncIpPairing instances are closed without waiting for them, use aclose within a coroutine.
+        """
+        for p in self.pairings:
+            pairing = self.pairings[p]
+            if isinstance(pairing, AsyncIpPairing):
+                pairing.abort()
+            else:
+                pairing.close()
+        if self.connection_manager is not None:
+            self.connection_manager.close_all()
+
+    async def aclose(self):
+        """
+        Shuts down the controller like shutdown, but waits until the sessions of the AsyncIpPairing instances were
+        closed.
+        """
+        for p in self.pairings:
+            pairing = self.pairings[p]
+            if isinstance(pairing, AsyncIpPairing):
+                await pairing.close()
+            else:
+                pairing.close()
+        if self.connection_manager is not None:
+            self.connection_manager.close_all()
+
+    def prewarm(self, aliases=None):
+        """
+        Not supported, sessions of AsyncIpPairing instances are established by aprewarm.
+
+        :raises NotImplementedError: always
+        """
+        raise NotImplementedError('Use aprewarm to establish the sessions of an AsyncController')
+
+    async def aprewarm(self, aliases=None):
+        """
+        Establishes the sessions of IP pairings ahead of their first request. The pair verify handshakes of all
+        accessories run concurrently.
+
+        :param aliases: the aliases of the pairings to prewarm, defaults to all IP pairings
+        :return: the number of pairings that have an open session afterwards
+        """
+        if aliases is None:
+            aliases = self.pairings.keys()
+        pairings = [self.pairings[alias] for alias in aliases if isinstance(self.pairings[alias], AsyncIpPairing)]
+        results = await asyncio.gather(*[pairing.connect() for pairing in pairings], return_exceptions=True)
+        connected = 0
+        for pairing, result in zip(pairings, results):
+            if isinstance(result, Exception):
+                self.logger.debug('could not prewarm session to %s: %s', pairing.pairing_data.get('AccessoryPairingID'),
+                                  result)
+            else:
+                connected += 1
+        return connected
+
+    def remove_pairing(self, alias, pairingId=None):
+        """
+        Remove a pairing like Controller.remove_pairing. This is not supported for AsyncIpPairing instances, use
+        aremove_pairing for them.
+
+        :raises NotImplementedError: if the pairing is an AsyncIpPairing
+        """
+        if isinstance(self.pairings[alias], AsyncIpPairing):
+            raise NotImplementedError('Use aremove_pairing to remove the pairing of an AsyncIpPairing')
+        Controller.remove_pairing(self, alias, pairingId)
+
+    async def aremove_pairing(self, alias, pairingId=None):
+        """
+        Remove a pairing between the controller and the accessory like Controller.remove_pairing. The request uses the
+        session of the AsyncIpPairing, which is closed if the controller's own pairing was removed. Other pairings are
+        removed by Controller.remove_pairing in the default executor.
+
+        :param alias: the controller's alias for the accessory
+        :param pairingId: the pairing id to be removed
+        :raises AuthenticationError: if the controller isn't authenticated to the accessory.
+        :raises AccessoryNotFoundError: if the device can not be found via zeroconf
+        :raises UnknownError: on unknown errors
+        """
+        pairing = self.pairings[alias]
+        if not isinstance(pairing, AsyncIpPairing):
+            await asyncio.get_event_loop().run_in_executor(None, Controller.remove_pairing, self, alias, pairingId)
+            return
+        request_tlv = self._remove_pairing_request(pairing._get_pairing_data(), pairingId)
+        response = await pairing._request('POST', '/pairings', request_tlv, HttpContentTypes.TLV)
+        self._handle_remove_pairing_response(alias, pairingId, self._decode_remove_pairing_response(response.read()))
+        if alias not in self.pairings:
+            await pairing.close()
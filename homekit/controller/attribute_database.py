@@ -0,0 +1,131 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from homekit.model.characteristics import CharacteristicsTypes
+from homekit.model.services import ServicesTypes
+
+
+def _type_key(types, type_name):
+    """
+    Normalizes a service or characteristic type to the full upper case UUID, so short UUIDs, full UUIDs and type names
+    all find the same entries.
+
+    :param types: ServicesTypes or CharacteristicsTypes
+    :param type_name: the type as short UUID, full UUID or type name
+    :return: the full UUID or the upper case input for types that cannot be resolved (e.g. vendor specific types)
+    """
+    try:
+        return types.get_uuid(type_name).upper()
+    except KeyError:
+        return type_name.upper()
+
+
+class AttributeDatabase(object):
+    """
+    Index over the accessories of a pairing as returned by list_accessories_and_characteristics (see chapter 6.6.4
+    page 79 for IP). It is built once from the list of accessories and offers lookups in constant time by accessory id
+    and instance id, by characteristic type and by service type. The services and characteristics returned are the
+    dicts of the accessory list, in the order they appear there.
+    """
+
+    def __init__(self, accessories):
+        """
+        :param accessories: the list of accessories with their services and characteristics
+        """
+        self.accessories = accessories
+        self._characteristics = {}
+        self._services = {}
+        self._characteristic_services = {}
+        self._characteristics_by_type = {}
+        self._services_by_type = {}
+        for accessory in accessories:
+            aid = accessory['aid']
+            for service in accessory['services']:
+                self._services[(aid, service['iid'])] = service
+                self._services_by_type.setdefault(_type_key(ServicesTypes, service['type']), []).append(
+                    (aid, service))
+                for characteristic in service['characteristics']:
+                    iid = characteristic['iid']
+                    self._characteristics[(aid, iid)] = characteristic
+                    self._characteristic_services[(aid, iid)] = service
+                    self._characteristics_by_type.setdefault(
+                        _type_key(CharacteristicsTypes, characteristic['type']), []).append((aid, characteristic))
+
+    def __len__(self):
+        """
+        :return: the number of characteristics
+        """
+        return len(self._characteristics)
+
+    def get_characteristic(self, aid, iid):
+        """
+        :param aid: the accessory id
+        :param iid: the instance id of the characteristic
+        :return: the characteristic or None if there is no such characteristic
+        """
+        return self._characteristics.get((int(aid), int(iid)))
+
+    def get_service(self, aid, iid):
+        """
+        :param aid: the accessory id
+        :param iid: the instance id of the service
+        :return: the service or None if there is no such service
+        """
+        return self._services.get((int(aid), int(iid)))
+
+    def get_service_of_characteristic(self, aid, iid):
+        """
+        :param aid: the accessory id
+        :param iid: the instance id of the characteristic
+        :return: the service containing the characteristic or None if there is no such characteristic
+        """
+        return self._characteristic_services.get((int(aid), int(iid)))
+
+    def get_format(self, aid, iid):
+        """
+        :param aid: the accessory id
+        :param iid: the instance id of the characteristic
+        :return: the format of the characteristic or None if the characteristic or its format is unknown
+        """
+        characteristic = self.get_characteristic(aid, iid)
+        if characteristic is None:
+            return None
+        return characteristic.get('format')
+
+    def find_characteristics(self, characteristic_type):
+        """
+        :param characteristic_type: the type as short UUID, full UUID or type name (e.g. CharacteristicsTypes.IDENTIFY)
+        :return: a list of 2-tupels of accessory id and characteristic for all characteristics of the type
+        """
+        return self._characteristics_by_type.get(_type_key(CharacteristicsTypes, characteristic_type), [])
+
+    def find_characteristic(self, characteristic_type):
+        """
+        :param characteristic_type: the type as short UUID, full UUID or type name (e.g. CharacteristicsTypes.IDENTIFY)
+        :return: a 2-tupel of accessory id and characteristic for the first characteristic of the type or (None, None)
+        """
+        found = self.find_characteristics(characteristic_type)
+        if not found:
+            return None, None
+        return found[0]
+
+    def find_services(self, service_type):
+        """
+        :param service_type: the type as short UUID, full UUID or type name (e.g.
+                             ServicesTypes.ACCESSORY_INFORMATION_SERVICE)
+        :return: a list of 2-tupels of accessory id and service for all services of the type
+        """
+        return self._services_by_type.get(_type_key(ServicesTypes, service_type), [])
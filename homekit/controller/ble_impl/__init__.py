@@ -28,14 +28,14 @@ import struct
 from distutils.util import strtobool
 import tlv8
 
-from homekit.controller.tools import AbstractPairing
+from homekit.controller.tools import AbstractPairing, RESUME_CACHE
 from homekit.protocol import Methods, States, TlvTypes
 from homekit.model.characteristics import CharacteristicsTypes
 from homekit.protocol import get_session_keys
 from homekit.protocol.opcodes import HapBleOpCodes
 from homekit.protocol.statuscodes import HapBleStatusCodes
 from homekit.model.services.service_types import ServicesTypes
-from homekit.crypto import chacha20_aead_decrypt, chacha20_aead_encrypt
+from homekit.crypto import SessionCipher
 from homekit.model.characteristics.characteristic_formats import BleCharacteristicFormats, CharacteristicFormats
 from homekit.model.characteristics.characteristic_units import BleCharacteristicUnits
 from homekit.exceptions import FormatError, RequestRejected, AccessoryDisconnectedError
@@ -68,6 +68,7 @@ class BlePairing(AbstractPairing):
         self.adapter = adapter
         self.pairing_data = pairing_data
         self.session = None
+        self._pairing_keys = None
 
         # if necessary, add the accessory list and characteristics to the object
         #   see https://github.com/jlusiardi/homekit_python/issues/223
@@ -94,7 +95,7 @@ class BlePairing(AbstractPairing):
 
     def list_pairings(self):
         if not self.session:
-            self.session = BleSession(self.pairing_data, self.adapter)
+            self.session = BleSession(self.pairing_data, self.adapter, pairing_keys=self.pairing_keys)
         request_tlv = tlv8.encode([
             tlv8.Entry(TlvTypes.State, States.M1),
             tlv8.Entry(TlvTypes.Method, Methods.ListPairings)
@@ -105,12 +106,7 @@ class BlePairing(AbstractPairing):
         ])
         body = len(request_tlv).to_bytes(length=2, byteorder='little') + request_tlv
 
-        cid = -1
-        for a in self.pairing_data['accessories']:
-            for s in a['services']:
-                for c in s['characteristics']:
-                    if CharacteristicsTypes.get_short_uuid(c['type'].upper()) == CharacteristicsTypes.PAIRING_PAIRINGS:
-                        cid = c['iid']
+        cid = self._find_characteristic_iid(CharacteristicsTypes.PAIRING_PAIRINGS)
         fc, _ = self.session.find_characteristic_by_iid(cid)
         response = self.session.request(fc, cid, HapBleOpCodes.CHAR_WRITE, body)
         response = tlv8.decode(response.first_by_id(AdditionalParameterTypes.Value).data)
@@ -147,15 +143,12 @@ class BlePairing(AbstractPairing):
         :return True, if the identification was run, False otherwise
         """
         if not self.session:
-            self.session = BleSession(self.pairing_data, self.adapter)
-        cid = -1
-        aid = -1
-        for a in self.pairing_data['accessories']:
-            for s in a['services']:
-                for c in s['characteristics']:
-                    if CharacteristicsTypes.get_short_uuid(c['type'].upper()) == CharacteristicsTypes.IDENTIFY:
-                        aid = a['aid']
-                        cid = c['iid']
+            self.session = BleSession(self.pairing_data, self.adapter, pairing_keys=self.pairing_keys)
+        aid, characteristic = self.attribute_database.find_characteristic(CharacteristicsTypes.IDENTIFY)
+        if characteristic is None:
+            aid, cid = -1, -1
+        else:
+            cid = characteristic['iid']
         self.put_characteristics([(aid, cid, True)])
         # TODO check for errors
         return True
@@ -179,7 +172,7 @@ class BlePairing(AbstractPairing):
                  }
         """
         if not self.session:
-            self.session = BleSession(self.pairing_data, self.adapter)
+            self.session = BleSession(self.pairing_data, self.adapter, pairing_keys=self.pairing_keys)
 
         results = {}
         for aid, cid in characteristics:
@@ -332,20 +325,25 @@ class BlePairing(AbstractPairing):
 
     def _find_characteristic_in_pairing_data(self, aid, cid):
         """
-        Iterate over the accessories in the pairing data. If a characteristic with the correct accessory id and
-        characteristic id is found, the characteristic is returned. If no characteristic is found, it returns None.
+        Looks up a characteristic of the accessories in the pairing data by accessory id and characteristic id.
 
         :param aid: the accessory id
         :param cid: the characteristic id
         :return: the characteristic or None
         """
-        for a in self.pairing_data['accessories']:
-            if a['aid'] == int(aid):
-                for s in a['services']:
-                    for c in s['characteristics']:
-                        if c['iid'] == int(cid):
-                            return c
-        return None
+        return self.attribute_database.get_characteristic(aid, cid)
+
+    def _find_characteristic_iid(self, characteristic_type):
+        """
+        Looks up the first characteristic of the given type in the accessories of the pairing data.
+
+        :param characteristic_type: the type of the characteristic (e.g. CharacteristicsTypes.PAIRING_PAIRINGS)
+        :return: the characteristic's instance id or -1 if there is no such characteristic
+        """
+        _, characteristic = self.attribute_database.find_characteristic(characteristic_type)
+        if characteristic is None:
+            return -1
+        return characteristic['iid']
 
     def put_characteristics(self, characteristics, do_conversion=False):
         """
@@ -360,7 +358,7 @@ class BlePairing(AbstractPairing):
                              requested
         """
         if not self.session:
-            self.session = BleSession(self.pairing_data, self.adapter)
+            self.session = BleSession(self.pairing_data, self.adapter, pairing_keys=self.pairing_keys)
 
         results = {}
 
@@ -397,7 +395,7 @@ class BlePairing(AbstractPairing):
 
     def add_pairing(self, additional_controller_pairing_identifier, ios_device_ltpk, permissions):
         if not self.session:
-            self.session = BleSession(self.pairing_data, self.adapter)
+            self.session = BleSession(self.pairing_data, self.adapter, pairing_keys=self.pairing_keys)
         if permissions == 'User':
             permissions = TlvTypes.Permission_RegularUser
         elif permissions == 'Admin':
@@ -419,12 +417,7 @@ class BlePairing(AbstractPairing):
         ])
         body = len(request_tlv).to_bytes(length=2, byteorder='little') + request_tlv
 
-        cid = -1
-        for a in self.pairing_data['accessories']:
-            for s in a['services']:
-                for c in s['characteristics']:
-                    if CharacteristicsTypes.get_short_uuid(c['type'].upper()) == CharacteristicsTypes.PAIRING_PAIRINGS:
-                        cid = c['iid']
+        cid = self._find_characteristic_iid(CharacteristicsTypes.PAIRING_PAIRINGS)
         fc, _ = self.session.find_characteristic_by_iid(cid)
         response = self.session.request(fc, cid, HapBleOpCodes.CHAR_WRITE, body)
         # TODO handle response properly
@@ -433,13 +426,15 @@ class BlePairing(AbstractPairing):
 
 class BleSession(object):
 
-    def __init__(self, pairing_data, adapter):
+    def __init__(self, pairing_data, adapter, resume_cache=RESUME_CACHE, pairing_keys=None):
         self.adapter = adapter
         self.pairing_data = pairing_data
-        self.c2a_counter = 0
-        self.a2c_counter = 0
+        self.resume_cache = resume_cache
+        self.pairing_keys = pairing_keys
         self.c2a_key = None
         self.a2c_key = None
+        self.c2a_cipher = None
+        self.a2c_cipher = None
         self.device = None
 
         mac_address = self.pairing_data['AccessoryMAC']
@@ -491,7 +486,7 @@ class BleSession(object):
             sys.exit(-1)
 
         write_fun = create_ble_pair_setup_write(pair_verify_char, pair_verify_char_info['iid'])
-        state_machine = get_session_keys(self.pairing_data)
+        state_machine = get_session_keys(self.pairing_data, self.resume_cache, self.pairing_keys)
 
         request, expected = state_machine.send(None)
         while True:
@@ -504,8 +499,8 @@ class BleSession(object):
 
         logger.debug('pair_verified, keys: \n\t\tc2a: %s\n\t\ta2c: %s', self.c2a_key.hex(), self.a2c_key.hex())
 
-        self.c2a_counter = 0
-        self.a2c_counter = 0
+        self.c2a_cipher = SessionCipher(self.c2a_key)
+        self.a2c_cipher = SessionCipher(self.a2c_key)
 
     def __del__(self):
         self.close()
@@ -529,17 +524,12 @@ class BleSession(object):
 
         logger.debug('data: %s', data)
 
-        cnt_bytes = self.c2a_counter.to_bytes(8, byteorder='little')
-        cipher_and_mac = chacha20_aead_encrypt(bytes(), self.c2a_key, cnt_bytes, bytes([0, 0, 0, 0]), data)
-        cipher_and_mac[0].extend(cipher_and_mac[1])
-        data = cipher_and_mac[0]
-        logger.debug('cipher and mac %s', cipher_and_mac[0].hex())
+        data = bytearray(self.c2a_cipher.seal_frame(data))
+        logger.debug('cipher and mac %s', data.hex())
 
         result = feature_char.write_value(value=data)
         logger.debug('write resulted in: %s', result)
 
-        self.c2a_counter += 1
-
         data = []
         while not data or len(data) == 0:
             time.sleep(1)
@@ -551,8 +541,7 @@ class BleSession(object):
         resp_data = bytearray([b for b in data])
         logger.debug('read: %s', bytearray(resp_data).hex())
 
-        data = chacha20_aead_decrypt(bytes(), self.a2c_key, self.a2c_counter.to_bytes(8, byteorder='little'),
-                                     bytes([0, 0, 0, 0]), resp_data)
+        data = self.a2c_cipher.open_frame(bytes(resp_data))
 
         logger.debug('decrypted: %s', bytearray(data).hex())
 
@@ -575,8 +564,6 @@ class BleSession(object):
         if status != HapBleStatusCodes.SUCCESS:
             raise RequestRejected(status, HapBleStatusCodes[status])
 
-        self.a2c_counter += 1
-
         # get body length
         length = int.from_bytes(data[3:5], byteorder='little')
         logger.debug('expected body length %d (got %d)', length, len(data[5:]))
@@ -0,0 +1,323 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from homekit.exceptions import AccessoryDisconnectedError, ConnectionLimitError
+
+
+def _create_ip_session(pairing):
+    # imported here, the IP transport is optional
+    from homekit.controller.ip_implementation import IpSession
+    return IpSession(pairing.pairing_data, pairing_keys=pairing.pairing_keys,
+                     value_cache=getattr(pairing, 'value_cache', None))
+
+
+class _PoolEntry(object):
+    """
+    An open session of one pairing in the pool.
+    """
+
+    def __init__(self, session, accessory_id):
+        self.session = session
+        self.accessory_id = accessory_id
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class ConnectionManager(object):
+    """
+    Limits and reuses the sessions of the IpPairings of a controller. Each pairing keeps one session, but sessions are
+    only opened through the manager:
+     * at most max_sessions sessions are open (or being opened) at the same time in total and at most
+       max_sessions_per_accessory to the same accessory
+     * at most max_handshakes pair verify handshakes run at the same time
+     * sessions that were not used for idle_timeout seconds are closed
+     * if a limit is reached, the least recently used idle session is closed to make room. If all sessions are in use,
+       the caller waits up to wait_timeout seconds for one to become idle.
+
+    A session is in use while a request of its pairing is running (including a running get_events). Sessions that are
+    in use are never closed by the manager.
+    """
+
+    def __init__(self, max_sessions=64, max_sessions_per_accessory=2, max_handshakes=4, idle_timeout=300,
+                 wait_timeout=30, session_factory=_create_ip_session):
+        """
+        :param max_sessions: the maximum number of open sessions of all pairings
+        :param max_sessions_per_accessory: the maximum number of open sessions to one accessory (identified by the
+                                           AccessoryPairingID of the pairing data)
+        :param max_handshakes: the maximum number of sessions that are established concurrently
+        :param idle_timeout: seconds after which an unused session is closed, None to keep idle sessions open
+        :param wait_timeout: seconds to wait for a free session slot before ConnectionLimitError is raised
+        :param session_factory: function creating the session of a pairing (defaults to an IpSession)
+        """
+        self.max_sessions = max_sessions
+        self.max_sessions_per_accessory = max_sessions_per_accessory
+        self.max_handshakes = max_handshakes
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.session_factory = session_factory
+        self.logger = logging.getLogger('homekit.controller.ConnectionManager')
+        self._handshakes = threading.BoundedSemaphore(max_handshakes)
+        self._condition = threading.Condition()
+        # maps pairings to their _PoolEntry, the least recently used entry comes first
+        self._entries = OrderedDict()
+        # maps pairings whose session is currently established to their accessory id
+        self._connecting = {}
+        self._statistics = {'handshakes': 0, 'reused': 0, 'failed': 0, 'evicted': 0, 'closed_idle': 0, 'waits': 0}
+
+    @contextmanager
+    def use(self, pairing):
+        """
+        Marks the session of the pairing as in use for the duration of the with block. If the pairing has no open
+        session, a new one is established within the limits of the manager. The session is also set as the pairing's
+        session attribute. Nested use of the same pairing reuses the session.
+
+        :param pairing: the IpPairing
+        :return: a context manager yielding the session
+        :raises ConnectionLimitError: if no session slot became available within wait_timeout seconds
+        :raises AccessoryDisconnectedError: if the session could not be established
+        """
+        session = self.acquire(pairing)
+        try:
+            yield session
+        finally:
+            self.release(pairing)
+
+    def acquire(self, pairing):
+        """
+        Returns the open session of the pairing or establishes a new one and marks it as in use. Each call must be
+        followed by a call to release.
+
+        :param pairing: the IpPairing
+        :return: the session
+        :raises ConnectionLimitError: if no session slot became available within wait_timeout seconds
+        :raises AccessoryDisconnectedError: if the session could not be established
+        """
+        accessory_id = pairing.pairing_data['AccessoryPairingID']
+        deadline = time.monotonic() + self.wait_timeout
+        with self._condition:
+            self._close_idle_sessions()
+            while True:
+                entry = self._entries.get(pairing)
+                if entry is not None and not self._is_alive(pairing, entry):
+                    # the pairing closed its session after an error
+                    self._remove(pairing, entry)
+                    entry = None
+                if entry is not None:
+                    entry.in_use += 1
+                    self._entries.move_to_end(pairing)
+                    self._statistics['reused'] += 1
+                    return entry.session
+                if pairing not in self._connecting and self._make_room(accessory_id):
+                    self._connecting[pairing] = accessory_id
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConnectionLimitError('No session to {a} available'.format(a=accessory_id))
+                self._statistics['waits'] += 1
+                self._condition.wait(remaining)
+
+        session = None
+        try:
+            session = self._establish(pairing, deadline)
+        finally:
+            with self._condition:
+                del self._connecting[pairing]
+                if session is not None:
+                    entry = _PoolEntry(session, accessory_id)
+                    entry.in_use = 1
+                    self._entries[pairing] = entry
+                    pairing.session = session
+                    self._statistics['handshakes'] += 1
+                else:
+                    self._statistics['failed'] += 1
+                self._condition.notify_all()
+        return session
+
+    def release(self, pairing):
+        """
+        Marks the session of the pairing as no longer in use by one caller.
+
+        :param pairing: the IpPairing
+        """
+        with self._condition:
+            entry = self._entries.get(pairing)
+            if entry is None:
+                return
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            if entry.in_use == 0 and not self._is_alive(pairing, entry):
+                self._remove(pairing, entry)
+            self._condition.notify_all()
+
+    def discard(self, pairing):
+        """
+        Closes the session of the pairing (if any) and removes it from the pool.
+
+        :param pairing: the IpPairing
+        """
+        with self._condition:
+            entry = self._entries.pop(pairing, None)
+            if entry is not None:
+                self._close(pairing, entry)
+                self._condition.notify_all()
+
+    def close_idle(self, max_idle=None):
+        """
+        Closes the sessions that are not in use and were not used for the given time.
+
+        :param max_idle: the idle time in seconds, defaults to idle_timeout
+        :return: the number of closed sessions
+        """
+        with self._condition:
+            return self._close_idle_sessions(max_idle)
+
+    def close_all(self):
+        """
+        Closes all sessions of the pool, including the ones in use.
+        """
+        with self._condition:
+            for pairing, entry in list(self._entries.items()):
+                self._close(pairing, entry)
+            self._entries.clear()
+            self._condition.notify_all()
+
+    def prewarm(self, pairings):
+        """
+        Establishes the sessions of the given pairings ahead of their first request. Up to max_handshakes sessions are
+        established in parallel. Pairings beyond max_sessions are skipped, so prewarming never evicts the sessions it
+        just opened.
+
+        :param pairings: an iterable of IpPairings
+        :return: the number of pairings that have an open session afterwards
+        """
+        pairings = list(pairings)[:self.max_sessions]
+        if not pairings:
+            return 0
+
+        def warm(pairing):
+            try:
+                with self.use(pairing):
+                    return True
+            except Exception as e:
+                self.logger.debug('could not prewarm session to %s: %s', pairing.pairing_data.get('AccessoryPairingID'),
+                                  e)
+                return False
+
+        workers = min(len(pairings), self.max_handshakes)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(executor.map(warm, pairings))
+
+    def statistics(self):
+        """
+        Returns statistics about the pool. The keys of the resulting dict are:
+         * sessions: the number of open sessions
+         * in_use: the number of open sessions used by a request right now
+         * idle: the number of open sessions not in use
+         * connecting: the number of sessions being established
+         * accessories: a dict mapping accessory ids to the number of open sessions
+         * handshakes: the number of sessions established so far
+         * reused: the number of times an open session was reused
+         * failed: the number of sessions that could not be established
+         * evicted: the number of idle sessions closed to stay within the limits
+         * closed_idle: the number of sessions closed after idle_timeout
+         * waits: the number of times a caller had to wait for a session slot
+
+        :return: a dict with the statistics
+        """
+        with self._condition:
+            in_use = sum(1 for entry in self._entries.values() if entry.in_use > 0)
+            accessories = {}
+            for entry in self._entries.values():
+                accessories[entry.accessory_id] = accessories.get(entry.accessory_id, 0) + 1
+            result = {
+                'sessions': len(self._entries),
+                'in_use': in_use,
+                'idle': len(self._entries) - in_use,
+                'connecting': len(self._connecting),
+                'accessories': accessories,
+            }
+            result.update(self._statistics)
+            return result
+
+    def _establish(self, pairing, deadline):
+        if not self._handshakes.acquire(timeout=max(0, deadline - time.monotonic())):
+            raise ConnectionLimitError(
+                'No handshake slot for {a} available'.format(a=pairing.pairing_data['AccessoryPairingID']))
+        try:
+            session = self.session_factory(pairing)
+        finally:
+            self._handshakes.release()
+        if getattr(session, 'sock', None) is None:
+            raise AccessoryDisconnectedError(
+                'Could not connect to {a}'.format(a=pairing.pairing_data['AccessoryPairingID']))
+        return session
+
+    @staticmethod
+    def _is_alive(pairing, entry):
+        return pairing.session is entry.session and getattr(entry.session, 'sock', None) is not None
+
+    def _count(self, accessory_id):
+        count = sum(1 for entry in self._entries.values() if entry.accessory_id == accessory_id)
+        return count + sum(1 for a in self._connecting.values() if a == accessory_id)
+
+    def _has_room(self, accessory_id):
+        return len(self._entries) + len(self._connecting) < self.max_sessions and \
+            self._count(accessory_id) < self.max_sessions_per_accessory
+
+    def _make_room(self, accessory_id):
+        # closes the least recently used idle sessions until a new session to the accessory fits into the limits
+        while not self._has_room(accessory_id):
+            per_accessory = self._count(accessory_id) >= self.max_sessions_per_accessory
+            for pairing, entry in self._entries.items():
+                if entry.in_use == 0 and (not per_accessory or entry.accessory_id == accessory_id):
+                    break
+            else:
+                return False
+            self._remove(pairing, entry)
+            self._statistics['evicted'] += 1
+        return True
+
+    def _close_idle_sessions(self, max_idle=None):
+        if max_idle is None:
+            max_idle = self.idle_timeout
+        if max_idle is None:
+            return 0
+        limit = time.monotonic() - max_idle
+        idle = [(p, e) for p, e in self._entries.items() if e.in_use == 0 and e.last_used <= limit]
+        for pairing, entry in idle:
+            self._remove(pairing, entry)
+        self._statistics['closed_idle'] += len(idle)
+        if idle:
+            self._condition.notify_all()
+        return len(idle)
+
+    def _remove(self, pairing, entry):
+        del self._entries[pairing]
+        self._close(pairing, entry)
+
+    @staticmethod
+    def _close(pairing, entry):
+        if getattr(entry.session, 'sock', None) is not None:
+            entry.session.close()
+        if pairing.session is entry.session:
+            pairing.session = None
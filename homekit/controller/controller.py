@@ -46,7 +46,7 @@ if BLE_TRANSPORT_SUPPORTED:
 
 if IP_TRANSPORT_SUPPORTED:
     from homekit.zeroconf_impl import discover_homekit_devices, find_device_ip_port_props
-    from homekit.controller.ip_implementation import IpPairing, IpSession
+    from homekit.controller.ip_implementation import IpPairing, IpSession, _set_config_number
 
 
 class PairingAuth(IntEnum):
@@ -73,14 +73,19 @@ class Controller(object):
     This class represents a HomeKit controller (normally your iPhone or iPad).
     """
 
-    def __init__(self, ble_adapter='hci0'):
+    def __init__(self, ble_adapter='hci0', connection_manager=None, retry_policy=None):
         """
         Initialize an empty controller. Use 'load_data()' to load the pairing data.
 
         :param ble_adapter: the bluetooth adapter to be used (defaults to hci0)
+        :param connection_manager: the ConnectionManager limiting the sessions of the IP pairings or None (the
+                                   default) to let each IP pairing keep its own session
+        :param retry_policy: the RetryPolicy of the IP pairings or None (the default) to raise all errors to the caller
         """
         self.pairings = {}
         self.ble_adapter = ble_adapter
+        self.connection_manager = connection_manager
+        self.retry_policy = retry_policy
         self.logger = logging.getLogger('homekit.controller.Controller')
 
     @staticmethod
@@ -114,6 +119,28 @@ class Controller(object):
             raise TransportNotSupportedError('IP')
         return discover_homekit_devices(max_seconds)
 
+    def update_config_numbers(self, max_seconds=10):
+        """
+        Performs one Bonjour discovery and records the configuration numbers (c#) of the discovered accessories in the
+        IP pairings. The cached attribute database of a pairing whose configuration number changed is fetched again
+        on the next call of list_accessories_and_characteristics.
+
+        :param max_seconds: how long should the Bonjour service browser do the discovery (default 10s)
+        :return: a list of the aliases of the pairings with outdated attribute databases
+        """
+        config_numbers = {}
+        for device in self.discover(max_seconds):
+            if 'id' in device:
+                config_numbers[device['id']] = device['c#']
+        outdated = []
+        for alias, pairing in self.pairings.items():
+            if not hasattr(pairing, 'update_config_number'):
+                continue
+            config_number = config_numbers.get(pairing._get_pairing_data()['AccessoryPairingID'])
+            if pairing.update_config_number(config_number):
+                outdated.append(alias)
+        return outdated
+
     @staticmethod
     def discover_ble(max_seconds=10, adapter='hci0'):
         """
@@ -259,6 +286,43 @@ class Controller(object):
         """
         for p in self.pairings:
             self.pairings[p].close()
+        if self.connection_manager is not None:
+            self.connection_manager.close_all()
+
+    def prewarm(self, aliases=None):
+        """
+        Establishes the sessions of IP pairings ahead of their first request, so the pair verify handshakes of many
+        accessories run in parallel (within the limits of the connection manager) instead of delaying the first
+        requests. Without a connection manager, the sessions are established one after the other.
+
+        :param aliases: the aliases of the pairings to prewarm, defaults to all IP pairings
+        :return: the number of pairings that have an open session afterwards
+        """
+        if aliases is None:
+            aliases = self.pairings.keys()
+        pairings = [self.pairings[alias] for alias in aliases
+                    if IP_TRANSPORT_SUPPORTED and isinstance(self.pairings[alias], IpPairing)]
+        if self.connection_manager is not None:
+            return self.connection_manager.prewarm(pairings)
+        connected = 0
+        for pairing in pairings:
+            try:
+                pairing.connect()
+                connected += 1
+            except Exception as e:
+                self.logger.debug('could not prewarm session to %s: %s', pairing.pairing_data.get('AccessoryPairingID'),
+                                  e)
+        return connected
+
+    def _create_ip_pairing(self, pairing_data):
+        """
+        Creates the pairing object for the data of an IP pairing. Subclasses (e.g. AsyncController) override this to
+        use another implementation.
+
+        :param pairing_data: the pairing data
+        :return: an IpPairing
+        """
+        return IpPairing(pairing_data, self.connection_manager, self.retry_policy)
 
     def get_pairings(self):
         """
@@ -296,7 +360,7 @@ class Controller(object):
                                 'setting pairing "%s" to dummy implementation because IP is not supported', pairing_id)
                             self.pairings[pairing_id] = NotSupportedPairing(data[pairing_id], 'IP')
                         else:
-                            self.pairings[pairing_id] = IpPairing(data[pairing_id])
+                            self.pairings[pairing_id] = self._create_ip_pairing(data[pairing_id])
                     elif data[pairing_id]['Connection'] == 'BLE':
                         if not BLE_TRANSPORT_SUPPORTED:
                             self.logger.debug(
@@ -478,8 +542,9 @@ class Controller(object):
 
             pairing['AccessoryIP'] = connection_data['ip']
             pairing['AccessoryPort'] = connection_data['port']
+            _set_config_number(pairing, connection_data['properties'].get('c#'))
             pairing['Connection'] = 'IP'
-            self.pairings[alias] = IpPairing(pairing)
+            self.pairings[alias] = self._create_ip_pairing(pairing)
 
         return finish_pairing
 
@@ -647,17 +712,9 @@ class Controller(object):
         # package visibility like in java would be nice here
         pairing_data = self.pairings[alias]._get_pairing_data()
         connection_type = pairing_data['Connection']
-        if not pairingId:
-            pairingIdToDelete = pairing_data['iOSPairingId']
-        else:
-            pairingIdToDelete = pairingId
 
         # Prepare the common (for IP and BLE) request data
-        request_tlv = tlv8.encode([
-            tlv8.Entry(TlvTypes.State, States.M1),
-            tlv8.Entry(TlvTypes.Method, Methods.RemovePairing),
-            tlv8.Entry(TlvTypes.Identifier, pairingIdToDelete.encode())
-        ])
+        request_tlv = self._remove_pairing_request(pairing_data, pairingId)
 
         if connection_type == 'IP':
             if not IP_TRANSPORT_SUPPORTED:
@@ -665,12 +722,7 @@ class Controller(object):
             session = IpSession(pairing_data)
             response = session.post('/pairings', request_tlv, content_type='application/pairing+tlv8')
             session.close()
-            data = response.read()
-            data = tlv8.decode(data, {
-                TlvTypes.State: tlv8.DataType.INTEGER,
-                TlvTypes.Error: tlv8.DataType.INTEGER
-
-            })
+            data = self._decode_remove_pairing_response(response.read())
         elif connection_type == 'BLE':
             if not BLE_TRANSPORT_SUPPORTED:
                 raise TransportNotSupportedError('BLE')
@@ -693,14 +745,50 @@ class Controller(object):
 
             session = BleSession(pairing_data, self.ble_adapter)
             response = session.request(pair_remove_char, pair_remove_char_id, HapBleOpCodes.CHAR_WRITE, body)
-            data = tlv8.decode(response.first_by_id(AdditionalParameterTypes.Value).data, {
-                TlvTypes.State: tlv8.DataType.INTEGER,
-                TlvTypes.Error: tlv8.DataType.INTEGER
-
-            })
+            data = self._decode_remove_pairing_response(response.first_by_id(AdditionalParameterTypes.Value).data)
         else:
             raise Exception('not implemented (neither IP nor BLE)')
 
+        self._handle_remove_pairing_response(alias, pairingId, data)
+
+    @staticmethod
+    def _remove_pairing_request(pairing_data, pairingId):
+        """
+        :param pairing_data: the pairing data of the accessory
+        :param pairingId: the pairing id to be removed or None to remove the controller's own pairing
+        :return: the TLV encoded remove pairing request (M1)
+        """
+        if not pairingId:
+            pairingIdToDelete = pairing_data['iOSPairingId']
+        else:
+            pairingIdToDelete = pairingId
+        return tlv8.encode([
+            tlv8.Entry(TlvTypes.State, States.M1),
+            tlv8.Entry(TlvTypes.Method, Methods.RemovePairing),
+            tlv8.Entry(TlvTypes.Identifier, pairingIdToDelete.encode())
+        ])
+
+    @staticmethod
+    def _decode_remove_pairing_response(data):
+        """
+        :param data: the TLV encoded remove pairing response (M2)
+        :return: the decoded TLV entries
+        """
+        return tlv8.decode(data, {
+            TlvTypes.State: tlv8.DataType.INTEGER,
+            TlvTypes.Error: tlv8.DataType.INTEGER
+        })
+
+    def _handle_remove_pairing_response(self, alias, pairingId, data):
+        """
+        Removes the pairing from the controller if the accessory removed the controller's own pairing.
+
+        :param alias: the controller's alias for the accessory
+        :param pairingId: the pairing id that was removed or None for the controller's own pairing
+        :param data: the decoded remove pairing response
+        :raises AuthenticationError: if the controller isn't authenticated to the accessory.
+        :raises UnknownError: on unknown errors
+        """
         # act upon the response (the same is returned for IP and BLE accessories)
         # handle the result, spec says, if it has only one entry with state == M2 we unpaired, else its an error.
         logging.debug('response data: %s', tlv8.format_string(data))
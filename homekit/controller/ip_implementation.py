@@ -14,14 +14,20 @@
 # limitations under the License.
 #
 
-from functools import partial
+from concurrent.futures import Future
+from functools import partial, wraps
 import json
 from json.decoder import JSONDecodeError
+import queue
+import threading
 import time
 import logging
 import tlv8
 
-from homekit.controller.tools import AbstractPairing, check_convert_value
+from homekit.controller.tools import AbstractPairing, check_convert_value, RESUME_CACHE
+from homekit.controller.read_deduplicator import ReadDeduplicator
+from homekit.controller.value_cache import ValueCache
+from homekit.controller.write_coalescer import WriteCoalescer
 from homekit.protocol.statuscodes import HapStatusCodes
 from homekit.exceptions import AccessoryNotFoundError, UnknownError, UnpairedError, \
     AccessoryDisconnectedError, EncryptionError
@@ -47,28 +53,273 @@ from homekit.model.services import ServicesTypes
 _dump_json = partial(json.dumps, separators=(',', ':'))
 
 
+def _normalize_accessories(accessories):
+    """
+    Replaces the types of services and characteristics in the accessory data by their upper case UUIDs.
+
+    :param accessories: the list of accessories as returned by the accessory
+    :return: the same list
+    """
+    for accessory in accessories:
+        for service in accessory['services']:
+            service['type'] = service['type'].upper()
+            try:
+                service['type'] = ServicesTypes.get_uuid(service['type'])
+            except KeyError:
+                pass
+
+            for characteristic in service['characteristics']:
+                characteristic['type'] = characteristic['type'].upper()
+                try:
+                    characteristic['type'] = CharacteristicsTypes.get_uuid(characteristic['type'])
+                except KeyError:
+                    pass
+    return accessories
+
+
+def _set_config_number(pairing_data, config_number):
+    """
+    Records the configuration number (c# of the zeroconf TXT record, see table 5-7 page 69) last seen for the
+    accessory. The accessory increments it whenever its attribute database changes.
+
+    :param pairing_data: the pairing data
+    :param config_number: the configuration number as str or int, None if unknown
+    :return: True if the cached attribute database of the pairing belongs to another configuration number
+    """
+    if config_number is None:
+        return False
+    pairing_data['AccessoryConfigNumber'] = int(config_number)
+    return 'accessories' in pairing_data and \
+        pairing_data.get('accessories_config_number') != pairing_data['AccessoryConfigNumber']
+
+
+def _cached_accessories(pairing_data):
+    """
+    Returns the cached attribute database of the pairing if it was fetched for the configuration number last seen
+    for the accessory.
+
+    :param pairing_data: the pairing data
+    :return: the accessories or None if they have to be fetched from the accessory
+    """
+    config_number = pairing_data.get('AccessoryConfigNumber')
+    if config_number is None or pairing_data.get('accessories_config_number') != config_number:
+        return None
+    return pairing_data.get('accessories')
+
+
+def _store_accessories(pairing_data, accessories):
+    """
+    Stores the attribute database fetched from the accessory in the pairing data, tagged with the configuration
+    number last seen for the accessory.
+
+    :param pairing_data: the pairing data
+    :param accessories: the normalized accessories
+    """
+    pairing_data['accessories'] = accessories
+    if 'AccessoryConfigNumber' in pairing_data:
+        pairing_data['accessories_config_number'] = pairing_data['AccessoryConfigNumber']
+    else:
+        pairing_data.pop('accessories_config_number', None)
+
+
+def _characteristics_url(characteristics, include_meta=False, include_perms=False, include_type=False,
+                         include_events=False):
+    """
+    :return: the target of the GET request reading the characteristics (see IpPairing.get_characteristics)
+    """
+    url = '/characteristics?id=' + ','.join([str(x[0]) + '.' + str(x[1]) for x in characteristics])
+    if include_meta:
+        url += '&meta=1'
+    if include_perms:
+        url += '&perms=1'
+    if include_type:
+        url += '&type=1'
+    if include_events:
+        url += '&ev=1'
+    return url
+
+
+def _decode_characteristics(data):
+    """
+    Converts the characteristics read from an accessory into the result of IpPairing.get_characteristics.
+
+    :param data: the list of characteristics from the response body
+    :return: a dict mapping 2-tupels of aid and iid to dicts with value or status and description
+    """
+    tmp = {}
+    for c in data:
+        key = (c['aid'], c['iid'])
+        del c['aid']
+        del c['iid']
+
+        if 'status' in c and c['status'] == 0:
+            del c['status']
+        if 'status' in c and c['status'] != 0:
+            c['description'] = HapStatusCodes[c['status']]
+        tmp[key] = c
+    return tmp
+
+
+def _characteristics_body(database, characteristics, do_conversion=False):
+    """
+    Creates the body of the PUT request writing characteristics (see IpPairing.put_characteristics).
+
+    :param database: the AttributeDatabase of the pairing (required only for do_conversion)
+    :param characteristics: a list of 3-tupels of accessory id, instance id and the value
+    :param do_conversion: select if conversion is done
+    :return: the body as str
+    :raises FormatError: if the input value could not be converted to the target type
+    """
+    data = []
+    for characteristic in characteristics:
+        aid = characteristic[0]
+        iid = characteristic[1]
+        value = characteristic[2]
+        if do_conversion:
+            value = check_convert_value(value, database.get_format(aid, iid))
+        data.append({'aid': aid, 'iid': iid, 'value': value})
+    return _dump_json({'characteristics': data})
+
+
+def _events_body(characteristics):
+    """
+    :param characteristics: a list of 2-tupels of accessory id (aid) and instance id (iid)
+    :return: the body of the PUT request registering for events on the characteristics
+    """
+    return _dump_json({'characteristics': [{'aid': aid, 'iid': iid, 'ev': True} for (aid, iid) in characteristics]})
+
+
+def _decode_events(data):
+    """
+    :param data: the list of characteristics from the body of an event
+    :return: a list of 3-tupels of aid, iid and the value
+    """
+    return [(c['aid'], c['iid'], c['value']) for c in data]
+
+
+def _decode_errors(data, include_success=False):
+    """
+    Collects the status of the characteristics from a multi status response.
+
+    :param data: the list of characteristics from the response body
+    :param include_success: if True, characteristics with status 0 are included
+    :return: a dict from (aid, iid) onto {status, description}
+    """
+    return {(d['aid'], d['iid']): {'status': d['status'], 'description': HapStatusCodes[d['status']]} for d in data
+            if include_success or d['status'] != 0}
+
+
+def _uses_session(idempotent):
+    """
+    Decorates the methods of IpPairing that talk to the accessory. The session is created before the method runs. If
+    the pairing has a ConnectionManager, the session is obtained from it and is marked as in use while the method runs.
+    If the pairing has a RetryPolicy, failed calls are retried according to it.
+
+    :param idempotent: True if the method may be repeated after its request reached the accessory (e.g. reads)
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            def attempt(state=None):
+                if self.connection_manager is not None:
+                    with self.connection_manager.use(self):
+                        if state is not None:
+                            state.request_sent = True
+                        return method(self, *args, **kwargs)
+                self._open_session()
+                if state is not None:
+                    state.request_sent = True
+                return method(self, *args, **kwargs)
+
+            # methods calling other methods (e.g. identify) are retried as a whole
+            if self.retry_policy is None or getattr(self._calls, 'running', False):
+                return attempt()
+            self._calls.running = True
+            try:
+                return self.retry_policy.call(self.pairing_data['AccessoryPairingID'], attempt, idempotent)
+            finally:
+                self._calls.running = False
+        return wrapper
+    return decorator
+
+
 class IpPairing(AbstractPairing):
     """
     This represents a paired HomeKit IP accessory.
     """
 
-    def __init__(self, pairing_data):
+    def __init__(self, pairing_data, connection_manager=None, retry_policy=None):
         """
         Initialize a Pairing by using the data either loaded from file or obtained after calling
         Controller.perform_pairing().
 
         :param pairing_data:
+        :param connection_manager: the ConnectionManager that limits the sessions of this pairing (e.g. the one of the
+                                   controller) or None to let the pairing open its session on its own
+        :param retry_policy: the RetryPolicy used to retry failed calls (e.g. the one of the controller) or None to
+                             raise all errors to the caller
         """
         self.pairing_data = pairing_data
+        self.connection_manager = connection_manager
+        self.retry_policy = retry_policy
+        self.read_deduplicator = ReadDeduplicator(self._get_characteristics)
+        self.value_cache = ValueCache()
+        self.write_coalescer = None
+        self._calls = threading.local()
         self.session = None
+        self._pairing_keys = None
+
+    def _open_session(self):
+        """
+        Opens the pairing's own session unless it is still connected. This is used if the pairing has no
+        ConnectionManager.
+
+        :raises AccessoryDisconnectedError: if the session could not be established
+        """
+        if not self.session or getattr(self.session, 'sock', None) is None:
+            self.session = IpSession(self.pairing_data, pairing_keys=self.pairing_keys, value_cache=self.value_cache)
+            if getattr(self.session, 'sock', None) is None:
+                self.session = None
+                raise AccessoryDisconnectedError(
+                    'Could not connect to {a}'.format(a=self.pairing_data['AccessoryPairingID']))
+
+    def connect(self):
+        """
+        Establishes the session now instead of with the first request. If the pairing has a ConnectionManager, the
+        session is added to its pool.
+
+        :raises AccessoryDisconnectedError: if the session could not be established
+        """
+        if self.connection_manager is not None:
+            with self.connection_manager.use(self):
+                return
+        self._open_session()
 
     def close(self):
         """
-        Close the pairing's communications. This closes the session.
+        Close the pairing's communications. This writes the characteristics waiting for write coalescing and closes the
+        session.
         """
+        if self.write_coalescer is not None:
+            self.write_coalescer.flush()
+        if self.connection_manager is not None:
+            self.connection_manager.discard(self)
         if self.session:
             self.session.close()
 
+    def set_pipelining(self, enabled):
+        """
+        Enables or disables HTTP pipelining for this pairing. In pipelined mode, requests issued concurrently (e.g. from
+        several threads or via IpSession.submit) are sent back to back without waiting for the earlier responses. Some
+        accessories cannot handle this, so it is disabled by default. The setting is stored in the pairing data and
+        takes effect with the next session.
+
+        :param enabled: True to enable pipelining
+        """
+        self.pairing_data['Pipelining'] = bool(enabled)
+        self.close()
+        self.session = None
+
     def _get_pairing_data(self):
         """
         This method returns the internal pairing data. DO NOT mess around with it.
@@ -77,15 +328,40 @@ class IpPairing(AbstractPairing):
         """
         return self.pairing_data
 
-    def list_accessories_and_characteristics(self):
+    def update_config_number(self, config_number):
+        """
+        Records the configuration number (c#) of the accessory, e.g. from a zeroconf browser of the application. If it
+        differs from the configuration number of the cached attribute database, the next call of
+        list_accessories_and_characteristics fetches the database again.
+
+        :param config_number: the c# from the accessory's zeroconf TXT record
+        :return: True if the cached attribute database is outdated
+        """
+        outdated = _set_config_number(self.pairing_data, config_number)
+        if outdated:
+            self.value_cache.clear()
+        return outdated
+
+    def list_accessories_and_characteristics(self, refresh=False):
         """
-        This retrieves a current set of accessories and characteristics behind this pairing.
+        This retrieves a current set of accessories and characteristics behind this pairing. The attribute database is
+        cached in the pairing data together with the accessory's configuration number (c#). It is only fetched from the
+        accessory again if the configuration number changed or is unknown. The configuration number is only learned
+        when the accessory is looked up via zeroconf or via update_config_number, so use refresh to fetch the database
+        if it might have changed otherwise.
 
+        :param refresh: if True, the attribute database is fetched from the accessory even if it is cached
         :return: the accessory data as described in the spec on page 73 and following
         :raises AccessoryNotFoundError: if the device can not be found via zeroconf
         """
-        if not self.session:
-            self.session = IpSession(self.pairing_data)
+        if not refresh:
+            accessories = _cached_accessories(self.pairing_data)
+            if accessories is not None:
+                return accessories
+        return self._fetch_accessories()
+
+    @_uses_session(idempotent=True)
+    def _fetch_accessories(self):
         try:
             response = self.session.get('/accessories')
         except (AccessoryDisconnectedError, EncryptionError):
@@ -93,26 +369,12 @@ class IpPairing(AbstractPairing):
             self.session = None
             raise
         tmp = response.read().decode()
-        accessories = json.loads(tmp)['accessories']
-
-        for accessory in accessories:
-            for service in accessory['services']:
-                service['type'] = service['type'].upper()
-                try:
-                    service['type'] = ServicesTypes.get_uuid(service['type'])
-                except KeyError:
-                    pass
+        accessories = _normalize_accessories(json.loads(tmp)['accessories'])
 
-                for characteristic in service['characteristics']:
-                    characteristic['type'] = characteristic['type'].upper()
-                    try:
-                        characteristic['type'] = CharacteristicsTypes.get_uuid(characteristic['type'])
-                    except KeyError:
-                        pass
-
-        self.pairing_data['accessories'] = accessories
+        _store_accessories(self.pairing_data, accessories)
         return accessories
 
+    @_uses_session(idempotent=True)
     def list_pairings(self):
         """
         This method returns all pairings of a HomeKit accessory. This always includes the local controller and can only
@@ -128,8 +390,6 @@ class IpPairing(AbstractPairing):
         :raises: UnknownError: if it receives unexpected data
         :raises: UnpairedError: if the polled accessory is not paired
         """
-        if not self.session:
-            self.session = IpSession(self.pairing_data)
         request_tlv = tlv8.encode([
             tlv8.Entry(TlvTypes.State, States.M1),
             tlv8.Entry(TlvTypes.Method, Methods.ListPairings)
@@ -174,9 +434,14 @@ class IpPairing(AbstractPairing):
             return tmp
 
     def get_characteristics(self, characteristics, include_meta=False, include_perms=False, include_type=False,
-                            include_events=False):
+                            include_events=False, max_age=None):
         """
-        This method is used to get the current readouts of any characteristic of the accessory.
+        This method is used to get the current readouts of any characteristic of the accessory. Concurrent reads with
+        the same options are merged unless read deduplication was disabled (see set_read_deduplication).
+
+        The values read and the values received via get_events are kept in the pairing's value cache. If max_age is
+        given, values that are not older than max_age seconds are taken from the cache and only the other
+        characteristics are read from the accessory. Writing a characteristic drops its value from the cache.
 
         :param characteristics: a list of 2-tupels of accessory id and instance id
         :param include_meta: if True, include meta information about the characteristics. This contains the format and
@@ -186,23 +451,37 @@ class IpPairing(AbstractPairing):
                              for translations.
         :param include_events: if True on a characteristics that supports events, the result will contain information if
                                the controller currently is receiving events for that characteristic. Key is 'ev'.
+        :param max_age: the maximum age in seconds of values taken from the value cache or None to read all
+                        characteristics from the accessory. The cache is not used if any of the include_* parameters
+                        is True.
         :return: a dict mapping 2-tupels of aid and iid to dicts with value or status and description, e.g.
                  {(1, 8): {'value': 23.42}
                   (1, 37): {'description': 'Resource does not exist.', 'status': -70409}
                  }
         """
-        if not self.session:
-            self.session = IpSession(self.pairing_data)
-        url = '/characteristics?id=' + ','.join([str(x[0]) + '.' + str(x[1]) for x in characteristics])
-        if include_meta:
-            url += '&meta=1'
-        if include_perms:
-            url += '&perms=1'
-        if include_type:
-            url += '&type=1'
-        if include_events:
-            url += '&ev=1'
-
+        result = {}
+        if max_age is not None and not (include_meta or include_perms or include_type or include_events):
+            result = self.value_cache.lookup(characteristics, max_age)
+            characteristics = [(aid, iid) for aid, iid in characteristics if (int(aid), int(iid)) not in result]
+            if not characteristics:
+                return result
+
+        if self.read_deduplicator is None:
+            values = self._get_characteristics(characteristics, include_meta, include_perms, include_type,
+                                               include_events)
+        else:
+            values = self.read_deduplicator.read(characteristics, include_meta, include_perms, include_type,
+                                                 include_events)
+        result.update(values)
+        return result
+
+    @_uses_session(idempotent=True)
+    def _get_characteristics(self, characteristics, include_meta=False, include_perms=False, include_type=False,
+                             include_events=False):
+        url = _characteristics_url(characteristics, include_meta, include_perms, include_type, include_events)
+
+        # the values are stored in the value cache unless the characteristics were written while the request ran
+        sequence = self.value_cache.sequence()
         try:
             response = self.session.get(url)
         except (AccessoryDisconnectedError, EncryptionError):
@@ -217,19 +496,11 @@ class IpPairing(AbstractPairing):
             self.session = None
             raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
 
-        tmp = {}
-        for c in data:
-            key = (c['aid'], c['iid'])
-            del c['aid']
-            del c['iid']
-
-            if 'status' in c and c['status'] == 0:
-                del c['status']
-            if 'status' in c and c['status'] != 0:
-                c['description'] = HapStatusCodes[c['status']]
-            tmp[key] = c
-        return tmp
+        result = _decode_characteristics(data)
+        self.value_cache.store(result, sequence)
+        return result
 
+    @_uses_session(idempotent=True)
     def get_resource(self, resource_request):
         """
         This method performs a request to read the /resource endpoint of an accessory. What it does is dependend on the
@@ -238,23 +509,94 @@ class IpPairing(AbstractPairing):
         :param resource_request: a dict of values to be sent to the accessory as a json dump
         :return: the content of the response body as bytes
         """
-        if not self.session:
-            self.session = IpSession(self.pairing_data)
         url = '/resource'
         body = _dump_json(resource_request).encode()
 
         try:
             response = self.session.post(url, body)
-            content_type = 'application/octet-stream'
-            for header in response.headers:
-                if header[0] == 'Content-Type':
-                    content_type = header[1]
+            content_type = response.get_header('Content-Type', 'application/octet-stream')
             return (content_type, response.read())
         except (AccessoryDisconnectedError, EncryptionError):
             self.session.close()
             self.session = None
             raise
 
+    def set_read_deduplication(self, enabled):
+        """
+        Enables or disables read deduplication for this pairing. It is enabled by default. With read deduplication,
+        get_characteristics calls from several threads share their requests: characteristics that are read by a
+        running request are not requested again and all characteristics requested while a request is running are read
+        together in the next request.
+
+        :param enabled: True to enable read deduplication
+        """
+        if not enabled:
+            self.read_deduplicator = None
+        elif self.read_deduplicator is None:
+            self.read_deduplicator = ReadDeduplicator(self._get_characteristics)
+
+    def read_statistics(self):
+        """
+        :return: a dict with the number of get_characteristics 'calls' that were not answered from the value cache
+                 alone, the number of 'reads' sent to the accessory and the number of reads 'saved' by read
+                 deduplication since it was enabled, the number of characteristics that were looked up in the value
+                 cache with a 'hit' or a 'miss' and the number of values 'cached'
+        """
+        if self.read_deduplicator is None:
+            statistics = {'calls': 0, 'reads': 0, 'saved': 0}
+        else:
+            statistics = self.read_deduplicator.statistics()
+        statistics.update(self.value_cache.statistics())
+        return statistics
+
+    def set_write_coalescing(self, window):
+        """
+        Enables or disables write coalescing for this pairing. With write coalescing, the writes issued via
+        put_characteristics or submit_characteristics within window seconds are sent as one request. If a
+        characteristic is written several times within the window, only the last value is sent. This saves round trips
+        if writes to an accessory come in bursts (e.g. hue, saturation and brightness of a light bulb), at the cost of
+        delaying each write by up to window seconds.
+
+        :param window: the seconds to collect writes or None to disable write coalescing
+        """
+        if self.write_coalescer is not None:
+            self.write_coalescer.flush()
+        if window is None:
+            self.write_coalescer = None
+        else:
+            self.write_coalescer = WriteCoalescer(self._put_characteristics, window)
+
+    def submit_characteristics(self, characteristics, do_conversion=False):
+        """
+        Update the values of writable characteristics like put_characteristics without waiting for the result. If write
+        coalescing is enabled, the characteristics are written together with the other writes of the current window.
+
+        :param characteristics: a list of 3-tupels of accessory id, instance id and the value
+        :param do_conversion: select if conversion is done (False is default)
+        :return: a concurrent.futures.Future of the dict from (aid, iid) onto {status, description} of the given
+                 characteristics
+        :raises FormatError: if the input value could not be converted to the target type and conversion was
+                             requested
+        """
+        coalescer = self.write_coalescer
+        if coalescer is None:
+            future = Future()
+            try:
+                future.set_result(self._put_characteristics(characteristics, do_conversion))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if do_conversion:
+            # values are converted now, so invalid values are reported to the caller and not to the whole batch
+            if 'accessories' not in self.pairing_data:
+                self.list_accessories_and_characteristics()
+            database = self.attribute_database
+            characteristics = [(aid, iid, check_convert_value(value, database.get_format(aid, iid)))
+                               for aid, iid, value in characteristics]
+        # reads with max_age must not return the old values while the write waits for the window to end
+        self.value_cache.invalidate([(aid, iid) for aid, iid, _ in characteristics])
+        return coalescer.submit(characteristics)
+
     def put_characteristics(self, characteristics, do_conversion=False):
         """
         Update the values of writable characteristics. The characteristics have to be identified by accessory id (aid),
@@ -267,30 +609,15 @@ class IpPairing(AbstractPairing):
         :raises FormatError: if the input value could not be converted to the target type and conversion was
                              requested
         """
-        if not self.session:
-            self.session = IpSession(self.pairing_data)
+        if self.write_coalescer is None:
+            return self._put_characteristics(characteristics, do_conversion)
+        return self.submit_characteristics(characteristics, do_conversion).result()
+
+    @_uses_session(idempotent=False)
+    def _put_characteristics(self, characteristics, do_conversion=False):
         if 'accessories' not in self.pairing_data:
             self.list_accessories_and_characteristics()
-        data = []
-        characteristics_set = set()
-        for characteristic in characteristics:
-            aid = characteristic[0]
-            iid = characteristic[1]
-            value = characteristic[2]
-            if do_conversion:
-                # evaluate proper format
-                c_format = None
-                for d in self.pairing_data['accessories']:
-                    if 'aid' in d and d['aid'] == aid:
-                        for s in d['services']:
-                            for c in s['characteristics']:
-                                if 'iid' in c and c['iid'] == iid:
-                                    c_format = c['format']
-
-                value = check_convert_value(value, c_format)
-            characteristics_set.add('{a}.{i}'.format(a=aid, i=iid))
-            data.append({'aid': aid, 'iid': iid, 'value': value})
-        data = _dump_json({'characteristics': data})
+        data = _characteristics_body(self.attribute_database, characteristics, do_conversion)
 
         try:
             response = self.session.put('/characteristics', data)
@@ -298,6 +625,12 @@ class IpPairing(AbstractPairing):
             self.session.close()
             self.session = None
             raise
+        finally:
+            # even failed writes may have changed the values
+            written = [(aid, iid) for aid, iid, _ in characteristics]
+            self.value_cache.invalidate(written)
+            if self.read_deduplicator is not None:
+                self.read_deduplicator.written(written)
 
         if response.code != 204:
             data = response.read().decode()
@@ -308,11 +641,10 @@ class IpPairing(AbstractPairing):
                 self.session = None
                 raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
 
-            data = {(d['aid'], d['iid']): {'status': d['status'], 'description': HapStatusCodes[d['status']]} for d in
-                    data}
-            return data
+            return _decode_errors(data, include_success=True)
         return {}
 
+    @_uses_session(idempotent=False)
     def get_events(self, characteristics, callback_fun, max_events=-1, max_seconds=-1):
         """
         This function is called to register for events on characteristics and receive them. Each time events are
@@ -323,6 +655,9 @@ class IpPairing(AbstractPairing):
         The call back function takes a list of 3-tupels of aid, iid and the value, e.g.:
           [(1, 9, 26.1), (1, 10, 30.5)]
 
+        The values received are also stored in the pairing's value cache, so get_characteristics with max_age can serve
+        them without asking the accessory.
+
         If the input contains characteristics without the event permission or any other error, the function will return
         a dict containing tupels of aid and iid for each requested characteristic with error. Those who would have
         worked are not in the result.
@@ -334,69 +669,66 @@ class IpPairing(AbstractPairing):
         :return: a dict mapping 2-tupels of aid and iid to dicts with status and description, e.g.
                  {(1, 37): {'description': 'Notification is not supported for characteristic.', 'status': -70406}}
         """
-        if not self.session:
-            self.session = IpSession(self.pairing_data)
-        data = []
-        characteristics_set = set()
-        for characteristic in characteristics:
-            aid = characteristic[0]
-            iid = characteristic[1]
-            characteristics_set.add('{a}.{i}'.format(a=aid, i=iid))
-            data.append({'aid': aid, 'iid': iid, 'ev': True})
-        data = _dump_json({'characteristics': data})
+        data = _events_body(characteristics)
 
+        # the background reader separates the events from the responses, so other requests can use the session meanwhile
+        sec_http = self.session.sec_http
+        events = queue.Queue()
+        sec_http.add_event_listener(events.put)
         try:
-            response = self.session.put('/characteristics', data)
-        except (AccessoryDisconnectedError, EncryptionError):
-            self.session.close()
-            self.session = None
-            raise
-
-        # handle error responses
-        if response.code != 204:
-            tmp = {}
+            sec_http.start_reader()
             try:
-                data = json.loads(response.read().decode())
-            except JSONDecodeError:
-                self.session.close()
-                self.session = None
-                raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
-
-            for characteristic in data['characteristics']:
-                status = characteristic['status']
-                if status == 0:
-                    continue
-                aid = characteristic['aid']
-                iid = characteristic['iid']
-                tmp[(aid, iid)] = {'status': status, 'description': HapStatusCodes[status]}
-            return tmp
-
-        # wait for incoming events
-        event_count = 0
-        s = time.time()
-        while (max_events == -1 or event_count < max_events) and (max_seconds == -1 or s + max_seconds >= time.time()):
-            try:
-                r = self.session.sec_http.handle_event_response()
-                body = r.read().decode()
+                response = self.session.put('/characteristics', data)
             except (AccessoryDisconnectedError, EncryptionError):
                 self.session.close()
                 self.session = None
                 raise
 
-            if len(body) > 0:
+            # handle error responses
+            if response.code != 204:
                 try:
-                    r = json.loads(body)
+                    data = json.loads(response.read().decode())
                 except JSONDecodeError:
                     self.session.close()
                     self.session = None
                     raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
-                tmp = []
-                for c in r['characteristics']:
-                    tmp.append((c['aid'], c['iid'], c['value']))
-                callback_fun(tmp)
-                event_count += 1
-        return {}
+                return _decode_errors(data['characteristics'])
 
+            # wait for incoming events
+            event_count = 0
+            s = time.time()
+            while (max_events == -1 or event_count < max_events) and \
+                    (max_seconds == -1 or s + max_seconds >= time.time()):
+                try:
+                    r = events.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if isinstance(r, Exception):
+                    # the reader stopped because the connection broke
+                    if self.session:
+                        self.session.close()
+                        self.session = None
+                    raise r
+                body = r.read().decode()
+
+                if len(body) > 0:
+                    try:
+                        r = json.loads(body)
+                    except JSONDecodeError:
+                        self.session.close()
+                        self.session = None
+                        raise AccessoryDisconnectedError(
+                            "Session closed after receiving malformed response from device")
+                    events_received = _decode_events(r['characteristics'])
+                    self.value_cache.store_events(events_received)
+                    callback_fun(events_received)
+                    event_count += 1
+            return {}
+        finally:
+            # without listeners, the background reader stops and the session reads responses directly again
+            sec_http.remove_event_listener(events.put)
+
+    @_uses_session(idempotent=False)
     def identify(self):
         """
         This call can be used to trigger the identification of a paired accessory. A successful call should
@@ -407,30 +739,19 @@ class IpPairing(AbstractPairing):
 
         :return True, if the identification was run, False otherwise
         """
-        if not self.session:
-            self.session = IpSession(self.pairing_data)
         if 'accessories' not in self.pairing_data:
             self.list_accessories_and_characteristics()
 
         # we are looking for a characteristic of the identify type
-        identify_type = CharacteristicsTypes.get_uuid(CharacteristicsTypes.IDENTIFY)
-
-        # search all accessories, all services and all characteristics
-        for accessory in self.pairing_data['accessories']:
-            aid = accessory['aid']
-            for service in accessory['services']:
-                for characteristic in service['characteristics']:
-                    iid = characteristic['iid']
-                    c_type = CharacteristicsTypes.get_uuid(characteristic['type'])
-                    if identify_type == c_type:
-                        # found the identify characteristic, so let's put a value there
-                        self.put_characteristics([(aid, iid, True)])
-                        return True
-        return False
-
+        aid, characteristic = self.attribute_database.find_characteristic(CharacteristicsTypes.IDENTIFY)
+        if characteristic is None:
+            return False
+        # found the identify characteristic, so let's put a value there
+        self.put_characteristics([(aid, characteristic['iid'], True)])
+        return True
+
+    @_uses_session(idempotent=False)
     def add_pairing(self, additional_controller_pairing_identifier, ios_device_ltpk, permissions):
-        if not self.session:
-            self.session = IpSession(self.pairing_data)
         if permissions == 'User':
             permissions = TlvTypes.Permission_RegularUser
         elif permissions == 'Admin':
@@ -454,18 +775,26 @@ class IpPairing(AbstractPairing):
         })
         # TODO handle the response properly
         self.session.close()
+        self.session = None
 
 
 class IpSession(object):
-    def __init__(self, pairing_data):
+    def __init__(self, pairing_data, resume_cache=RESUME_CACHE, pairing_keys=None, value_cache=None):
         """
 
         :param pairing_data:
+        :param resume_cache: the ResumeCache to resume earlier sessions from or None to always perform a full pair
+                             verify
+        :param pairing_keys: the PairingKeys of the pairing or None to parse the keys from the pairing data
+        :param value_cache: the ValueCache of the pairing, it is cleared if the configuration number of the accessory
+                            changed
         :raises AccessoryNotFoundError: if the device can not be found via zeroconf
         """
         logging.debug('init session')
         connected = False
         self.pairing_data = pairing_data
+        self.resume_cache = resume_cache
+        self.pairing_keys = pairing_keys
 
         if 'AccessoryIP' in pairing_data and 'AccessoryPort' in pairing_data:
             # if it is known, try it
@@ -478,20 +807,25 @@ class IpSession(object):
             device_id = pairing_data['AccessoryPairingID']
             connection_data = find_device_ip_port_props(device_id)
 
-            # update pairing data with the IP/port we elaborated above, perhaps next time they are valid
-            pairing_data['AccessoryIP'] = connection_data['ip']
-            pairing_data['AccessoryPort'] = connection_data['port']
-
             if connection_data is None:
                 raise AccessoryNotFoundError(
                     'Device {id} not found'.format(id=pairing_data['AccessoryPairingID']))
 
+            # update pairing data with the IP/port we elaborated above, perhaps next time they are valid
+            pairing_data['AccessoryIP'] = connection_data['ip']
+            pairing_data['AccessoryPort'] = connection_data['port']
+            previous_config_number = pairing_data.get('AccessoryConfigNumber')
+            outdated = _set_config_number(pairing_data, connection_data['properties'].get('c#'))
+            if value_cache is not None and \
+                    (outdated or previous_config_number != pairing_data.get('AccessoryConfigNumber')):
+                value_cache.clear()
+
             if not self._connect(connection_data['ip'], connection_data['port']):
                 return
 
         logging.debug('session established')
 
-        self.sec_http = SecureHttp(self)
+        self.sec_http = SecureHttp(self, pipelining=pairing_data.get('Pipelining', False))
 
     def _connect(self, accessory_ip, accessory_port):
         conn = HomeKitHTTPConnection(accessory_ip, port=accessory_port)
@@ -499,7 +833,7 @@ class IpSession(object):
             conn.connect()
             write_fun = create_ip_pair_verify_write(conn)
 
-            state_machine = get_session_keys(self.pairing_data)
+            state_machine = get_session_keys(self.pairing_data, self.resume_cache, self.pairing_keys)
 
             request, expected = state_machine.send(None)
             while True:
@@ -563,3 +897,16 @@ class IpSession(object):
         :return: a homekit.http_impl.HttpResponse object
         """
         return self.sec_http.post(url, body, content_type)
+
+    def submit(self, method, url, body=None, content_type=HttpContentTypes.JSON, callback=None):
+        """
+        Send a HTTP request via the encrypted session without waiting for the response if pipelining is enabled for
+        the pairing.
+        :param method: the HTTP method
+        :param url: The url to request
+        :param body: the body of the request or None
+        :param content_type: the content of the content-type header
+        :param callback: optional function called with the future once the response was read
+        :return: a concurrent.futures.Future of the homekit.http_impl.HttpResponse object
+        """
+        return self.sec_http.submit(method, url, body, content_type, callback)
@@ -0,0 +1,161 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+
+
+class _Flight(object):
+    """
+    One read of a set of characteristics that other callers can wait for.
+    """
+
+    def __init__(self):
+        self.keys = OrderedDict()
+        # keys that were written since the read was sent, its result is outdated for them
+        self.written = set()
+        self.future = Future()
+
+    def covers(self, key):
+        """
+        :param key: a 2-tupel of accessory id and instance id
+        :return: True if the result of this read is current for the characteristic
+        """
+        return key in self.keys and key not in self.written
+
+
+class ReadDeduplicator(object):
+    """
+    Merges concurrent reads of characteristics into as few reads as possible (single flight). For each set of read
+    options, there is at most one read running and one read waiting for it to finish:
+
+     * characteristics that are part of the running read are not read again, the caller gets the result of the
+       running read. This does not apply to characteristics written since the running read was sent (see written).
+     * all other characteristics are added to the waiting read, so all callers that queue up behind the running read
+       are served by one read once it finished
+
+    The first caller of a read performs it in its own thread, the other callers wait for its result. Each caller gets
+    the part of the result that belongs to the characteristics it asked for. If the read fails, all callers waiting for
+    it get the exception.
+    """
+
+    def __init__(self, read_function):
+        """
+        :param read_function: function that reads a list of 2-tupels of aid and iid with the given options and returns
+                              a dict from (aid, iid) onto the result of the characteristic
+        """
+        self.read_function = read_function
+        self._lock = threading.Lock()
+        # maps the options to 2-tupels of the running and the waiting _Flight
+        self._flights = {}
+        self._calls = 0
+        self._reads = 0
+
+    def statistics(self):
+        """
+        :return: a dict with the number of 'calls' to read, the number of 'reads' that were performed and the number of
+                 reads that were 'saved' by merging calls
+        """
+        with self._lock:
+            return {
+                'calls': self._calls,
+                'reads': self._reads,
+                'saved': self._calls - self._reads,
+            }
+
+    def written(self, characteristics):
+        """
+        Records that characteristics were written. Callers reading them afterwards do not get the result of a read that
+        is already running, since it may return the values from before the write.
+
+        :param characteristics: a list of 2-tupels of accessory id and instance id
+        """
+        keys = [(int(aid), int(iid)) for aid, iid in characteristics]
+        with self._lock:
+            for running, _ in self._flights.values():
+                if running is not None:
+                    running.written.update(keys)
+
+    def read(self, characteristics, *options):
+        """
+        Reads the characteristics, sharing the reads with concurrent callers using the same options.
+
+        :param characteristics: a list of 2-tupels of accessory id and instance id
+        :param options: further arguments of the read function, only reads with equal options are merged
+        :return: a dict from (aid, iid) onto the result of the characteristic
+        """
+        keys = [(int(aid), int(iid)) for aid, iid in characteristics]
+        wanted = set(keys)
+        with self._lock:
+            self._calls += 1
+            running, waiting = self._flights.get(options, (None, None))
+            flights = []
+            lead = None
+            missing = [key for key in OrderedDict.fromkeys(keys) if running is None or not running.covers(key)]
+            if len(missing) < len(wanted):
+                flights.append(running)
+            if missing:
+                if running is None:
+                    # nothing to wait for, read at once
+                    lead = running = flight = _Flight()
+                else:
+                    if waiting is None:
+                        lead = waiting = _Flight()
+                    flight = waiting
+                flight.keys.update((key, True) for key in missing)
+                flights.append(flight)
+                self._flights[options] = (running, waiting)
+
+        if lead is not None:
+            self._perform(lead, options)
+
+        result = {}
+        for flight in flights:
+            result.update((key, value) for key, value in flight.future.result().items() if key in wanted)
+        return result
+
+    def _perform(self, flight, options):
+        """
+        Performs the read of the flight once the running read of the options finished. When a read finished, the
+        waiting read becomes the running read before the callers get the result, so no characteristics can be added to
+        a read after it started.
+        """
+        with self._lock:
+            running, _ = self._flights[options]
+        if running is not flight:
+            # errors of the running read are reported to its callers
+            running.future.exception()
+
+        with self._lock:
+            self._reads += 1
+            keys = list(flight.keys)
+        result = exception = None
+        try:
+            result = self.read_function(keys, *options)
+        except Exception as e:
+            exception = e
+
+        with self._lock:
+            _, waiting = self._flights[options]
+            if waiting is None:
+                del self._flights[options]
+            else:
+                self._flights[options] = (waiting, None)
+        if exception is not None:
+            flight.future.set_exception(exception)
+        else:
+            flight.future.set_result(result)
@@ -0,0 +1,226 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+import threading
+import time
+
+from homekit.exceptions import AccessoryDisconnectedError, AccessoryNotFoundError, CircuitOpenError, EncryptionError
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the failed calls of one accessory. After failure_threshold consecutive failures the circuit opens and calls
+    fail fast with a CircuitOpenError instead of waiting for connection attempts that most likely fail as well. After
+    reset_timeout seconds one trial call is let through (half open): if it succeeds the circuit closes again, otherwise
+    it stays open for another reset_timeout seconds.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30, clock=time.monotonic):
+        """
+        :param name: the name of the circuit used in error messages (e.g. the accessory's pairing id)
+        :param failure_threshold: the number of consecutive failed calls that open the circuit
+        :param reset_timeout: the seconds the circuit stays open before a trial call is allowed
+        :param clock: function returning the current time in seconds
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        :return: one of CLOSED, OPEN or HALF_OPEN
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return CircuitBreaker.CLOSED
+        if self.clock() - self._opened_at >= self.reset_timeout:
+            return CircuitBreaker.HALF_OPEN
+        return CircuitBreaker.OPEN
+
+    def before_call(self):
+        """
+        Checks if a call may be performed. In the half open state only one trial call is allowed at a time.
+
+        :raises CircuitOpenError: if the circuit is open
+        """
+        with self._lock:
+            state = self._state()
+            if state == CircuitBreaker.CLOSED:
+                return
+            if state == CircuitBreaker.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            raise CircuitOpenError(
+                'Accessory {n} is unavailable after {f} failed calls'.format(n=self.name, f=self.failures))
+
+    def record_success(self):
+        """
+        Closes the circuit after a successful call.
+        """
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        """
+        Counts a failed call and opens the circuit if the threshold is reached or a trial call failed.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+            self._trial_running = False
+
+    def end_trial(self):
+        """
+        Ends a trial call without result, so the next call in the half open state becomes the trial call.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def reset(self):
+        """
+        Closes the circuit, e.g. after the accessory was found again.
+        """
+        self.record_success()
+
+
+class Attempt(object):
+    """
+    The state of one attempt of a call performed by RetryPolicy.call.
+    """
+
+    def __init__(self, number):
+        # the number of the attempt, starting at 1
+        self.number = number
+        # set to True once the request may have reached the accessory. From then on calls that are not idempotent are
+        # not retried.
+        self.request_sent = False
+
+
+class RetryPolicy(object):
+    """
+    Transparently retries calls to accessories that failed because the connection broke, with exponential backoff
+    between the attempts. Calls that are not idempotent (like writing characteristics) are only retried if they failed
+    before the request was sent (e.g. while the session was established), so an accessory never executes a request
+    twice.
+
+    The policy also keeps one CircuitBreaker per accessory, so calls to an accessory that is down fail fast. A call
+    counts as one failure of the accessory once it failed after all its attempts.
+    """
+
+    def __init__(self, max_attempts=3, initial_backoff=0.1, max_backoff=2.0, multiplier=2.0,
+                 retry_on=(AccessoryDisconnectedError, EncryptionError),
+                 failure_on=(AccessoryDisconnectedError, AccessoryNotFoundError, EncryptionError),
+                 failure_threshold=3, reset_timeout=30, sleep=time.sleep, clock=time.monotonic):
+        """
+        :param max_attempts: the maximum number of attempts of a call, 1 disables retries
+        :param initial_backoff: the seconds to wait before the second attempt
+        :param max_backoff: the maximum seconds to wait between two attempts
+        :param multiplier: the factor the backoff grows by after each attempt
+        :param retry_on: the exceptions that cause a retry
+        :param failure_on: the exceptions that count as failure of the accessory for its circuit breaker
+        :param failure_threshold: the consecutive failed calls that open the circuit breaker of an accessory
+        :param reset_timeout: the seconds the circuit breaker of an accessory stays open
+        :param sleep: function used to wait between attempts
+        :param clock: function returning the current time in seconds (used by the circuit breakers)
+        """
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+        self.retry_on = retry_on
+        self.failure_on = failure_on
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+        self.clock = clock
+        self.logger = logging.getLogger('homekit.controller.RetryPolicy')
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, accessory_id):
+        """
+        :param accessory_id: the accessory's pairing id
+        :return: the CircuitBreaker of the accessory
+        """
+        with self._lock:
+            if accessory_id not in self._breakers:
+                self._breakers[accessory_id] = CircuitBreaker(accessory_id, self.failure_threshold, self.reset_timeout,
+                                                              self.clock)
+            return self._breakers[accessory_id]
+
+    def backoff(self, attempt):
+        """
+        :param attempt: the number of the failed attempt, starting at 1
+        :return: the seconds to wait before the next attempt
+        """
+        return min(self.max_backoff, self.initial_backoff * self.multiplier ** (attempt - 1))
+
+    def call(self, accessory_id, function, idempotent):
+        """
+        Calls the function until it succeeds, fails with an exception that is not retried or max_attempts is reached.
+
+        :param accessory_id: the accessory's pairing id
+        :param function: the function to call, it gets the current Attempt as only parameter and must set its
+                         request_sent attribute before sending the request
+        :param idempotent: True if the function may safely be repeated after its request was sent
+        :return: the result of the function
+        :raises CircuitOpenError: if the circuit breaker of the accessory is open
+        """
+        breaker = self.breaker(accessory_id)
+        breaker.before_call()
+        number = 1
+        while True:
+            attempt = Attempt(number)
+            try:
+                result = function(attempt)
+            except CircuitOpenError:
+                # raised by a nested call that shares the circuit, which already decided
+                breaker.end_trial()
+                raise
+            except self.failure_on as e:
+                retry = isinstance(e, self.retry_on) and (idempotent or not attempt.request_sent)
+                if not retry or number >= self.max_attempts:
+                    # the whole call failed, so it counts once
+                    breaker.record_failure()
+                    raise
+                delay = self.backoff(number)
+                self.logger.debug('attempt %d for %s failed (%s), retrying in %.2fs', number, accessory_id, e, delay)
+                self.sleep(delay)
+                number += 1
+            except BaseException:
+                # other errors (e.g. invalid values) say nothing about the accessory's availability
+                breaker.end_trial()
+                raise
+            else:
+                breaker.record_success()
+                return result
@@ -20,12 +20,20 @@ import binascii
 import tlv8
 from distutils.util import strtobool
 
+from homekit.controller.attribute_database import AttributeDatabase
 from homekit.exceptions import FormatError
 from homekit.model.characteristics import CharacteristicFormats
+from homekit.protocol.pairing_keys import PairingKeys
+from homekit.protocol.session_resume import ResumeCache
+
+# resumable pair verify sessions of all pairings, this is shared by the IP and the BLE sessions
+RESUME_CACHE = ResumeCache(max_entries=1024)
 
 
 class AbstractPairing(abc.ABC):
 
+    _attribute_database = None
+
     def _get_pairing_data(self):
         """
         This method returns the internal pairing data. DO NOT mess around with it.
@@ -34,6 +42,31 @@ class AbstractPairing(abc.ABC):
         """
         return self.pairing_data
 
+    @property
+    def pairing_keys(self):
+        """
+        The parsed long term keys of the pairing. These are created on first use and reused by all following sessions
+        of the pairing.
+
+        :return: a PairingKeys instance for the pairing data
+        """
+        if self._pairing_keys is None:
+            self._pairing_keys = PairingKeys(self.pairing_data)
+        return self._pairing_keys
+
+    @property
+    def attribute_database(self):
+        """
+        The index over the accessories of the pairing data. It is built on first use and again after the accessories
+        were fetched anew.
+
+        :return: an AttributeDatabase for the accessories in the pairing data (empty if they were not fetched yet)
+        """
+        accessories = self.pairing_data.get('accessories', [])
+        if self._attribute_database is None or self._attribute_database.accessories is not accessories:
+            self._attribute_database = AttributeDatabase(accessories)
+        return self._attribute_database
+
     @abc.abstractmethod
     def close(self):
         """
@@ -0,0 +1,133 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+
+
+class ValueCache(object):
+    """
+    Keeps the last known values of the characteristics of a pairing together with the time they were received. Values
+    are stored from reads and from events and are dropped when the characteristic is written, so a read after a write
+    always goes to the accessory.
+
+    To keep a read that was running during a write or an event from storing an outdated value, reads are stored with
+    the sequence number obtained before they were sent (see sequence). Characteristics that were written or received
+    an event since then are not updated.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """
+        :param clock: function returning the current time in seconds
+        """
+        self.clock = clock
+        self._lock = threading.Lock()
+        # maps (aid, iid) to 2-tupels of the value and the time it was received
+        self._values = {}
+        # maps (aid, iid) to the sequence number of the last write or event
+        self._changes = {}
+        self._sequence = 0
+        self._hits = 0
+        self._misses = 0
+
+    def statistics(self):
+        """
+        :return: a dict with the number of 'hits' and 'misses' of lookups and the number of 'cached' values
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'cached': len(self._values),
+            }
+
+    def sequence(self):
+        """
+        :return: the sequence number to pass to store for a read that is about to be sent
+        """
+        with self._lock:
+            return self._sequence
+
+    def lookup(self, characteristics, max_age):
+        """
+        :param characteristics: a list of 2-tupels of accessory id and instance id
+        :param max_age: the maximum age in seconds of the values to return
+        :return: a dict from (aid, iid) onto {'value': value} for all characteristics with a value that is not older
+                 than max_age
+        """
+        now = self.clock()
+        result = {}
+        with self._lock:
+            for aid, iid in characteristics:
+                key = (int(aid), int(iid))
+                entry = self._values.get(key)
+                if entry is not None and now - entry[1] <= max_age:
+                    result[key] = {'value': entry[0]}
+                    self._hits += 1
+                else:
+                    self._misses += 1
+        return result
+
+    def store(self, results, sequence):
+        """
+        Stores the values of a read.
+
+        :param results: the dict from (aid, iid) onto the result of the characteristic as returned by
+                        IpPairing.get_characteristics, results without value (e.g. errors) are ignored
+        :param sequence: the sequence number obtained before the read was sent
+        """
+        now = self.clock()
+        with self._lock:
+            for key, result in results.items():
+                if 'value' in result and self._changes.get(key, -1) <= sequence:
+                    self._values[key] = (result['value'], now)
+
+    def store_events(self, events):
+        """
+        Stores the values received by events.
+
+        :param events: a list of 3-tupels of accessory id, instance id and the value
+        """
+        now = self.clock()
+        with self._lock:
+            self._sequence += 1
+            for aid, iid, value in events:
+                key = (int(aid), int(iid))
+                self._values[key] = (value, now)
+                self._changes[key] = self._sequence
+
+    def invalidate(self, characteristics):
+        """
+        Drops the values of written characteristics.
+
+        :param characteristics: a list of 2-tupels of accessory id and instance id
+        """
+        with self._lock:
+            self._sequence += 1
+            for aid, iid in characteristics:
+                key = (int(aid), int(iid))
+                self._values.pop(key, None)
+                self._changes[key] = self._sequence
+
+    def clear(self):
+        """
+        Drops all values, e.g. after the accessory's configuration changed.
+        """
+        with self._lock:
+            self._sequence += 1
+            for key in self._values:
+                self._changes[key] = self._sequence
+            self._values.clear()
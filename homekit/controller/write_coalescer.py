@@ -0,0 +1,107 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+
+
+class WriteCoalescer(object):
+    """
+    Merges writes of characteristics that are submitted within a short window into one write. The window starts with
+    the first write submitted after the previous batch was written. If the same characteristic is written several
+    times within a window, only the last value is written.
+
+    Each submit returns a Future. Once the batch was written, the future's result is the part of the multi status
+    response (a dict from (aid, iid) onto {status, description}) that belongs to the characteristics of this submit,
+    so callers that wrote a characteristic with a superseded value get the status of the value that was written. If the
+    write fails, all futures of the batch get the exception.
+    """
+
+    def __init__(self, write_function, window=0.05):
+        """
+        :param write_function: function that writes a list of 3-tupels of aid, iid and value in one request and returns
+                               a dict from (aid, iid) onto {status, description}
+        :param window: the seconds to collect writes before they are written
+        """
+        self.write_function = write_function
+        self.window = window
+        self._lock = threading.Lock()
+        # held while a batch is written, so batches reach the accessory in the order they were collected
+        self._write_lock = threading.Lock()
+        # maps (aid, iid) to the latest value
+        self._values = OrderedDict()
+        # list of tupels of future and the (aid, iid) keys written by the submit
+        self._waiting = []
+        self._timer = None
+
+    @property
+    def pending(self):
+        """
+        :return: the number of characteristics waiting to be written
+        """
+        with self._lock:
+            return len(self._values)
+
+    def submit(self, characteristics):
+        """
+        Queues the characteristics for the next write.
+
+        :param characteristics: a list of 3-tupels of accessory id, instance id and the (already converted) value
+        :return: a concurrent.futures.Future of the dict from (aid, iid) onto {status, description}
+        """
+        future = Future()
+        keys = []
+        with self._lock:
+            for aid, iid, value in characteristics:
+                key = (aid, iid)
+                # a newer value moves the characteristic to the end, like the write was issued now
+                self._values.pop(key, None)
+                self._values[key] = value
+                keys.append(key)
+            self._waiting.append((future, keys))
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def flush(self):
+        """
+        Writes the queued characteristics now and resolves the futures of their submits. This is called by the timer
+        once the window ended, but can also be called directly (e.g. before closing the pairing). If another flush is
+        writing, this waits for it to finish first.
+        """
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                values = self._values
+                waiting = self._waiting
+                self._values = OrderedDict()
+                self._waiting = []
+            if not waiting:
+                return
+
+            try:
+                result = self.write_function([(aid, iid, value) for (aid, iid), value in values.items()])
+            except Exception as e:
+                for future, _ in waiting:
+                    future.set_exception(e)
+                return
+            for future, keys in waiting:
+                future.set_result({key: result[key] for key in keys if key in result})
@@ -15,8 +15,12 @@
 #
 
 __all__ = [
-    'chacha20_aead_decrypt', 'chacha20_aead_encrypt', 'SrpClient', 'SrpServer'
+    'chacha20_aead_decrypt', 'chacha20_aead_encrypt', 'create_cipher', 'get_backend_name', 'set_backend', 'SrpClient',
+    'SrpServer', 'SessionCipher', 'HkdfSha512', 'derive_keys'
 ]
 
-from homekit.crypto.chacha20poly1305 import chacha20_aead_decrypt, chacha20_aead_encrypt
+from homekit.crypto.chacha20poly1305 import chacha20_aead_decrypt, chacha20_aead_encrypt, create_cipher, \
+    get_backend_name, set_backend
 from homekit.crypto.srp import SrpClient, SrpServer
+from homekit.crypto.session_cipher import SessionCipher
+from homekit.crypto.key_derivation import HkdfSha512, derive_keys
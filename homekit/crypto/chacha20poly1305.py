@@ -19,8 +19,34 @@
 """
 Implements the ChaCha20 stream cipher and the Poly1350 authenticator. More information can be found on
 https://tools.ietf.org/html/rfc7539. See HomeKit spec page 51.
+
+The AEAD construction is available through multiple backends. If the `cryptography` package offers a native
+implementation of ChaCha20-Poly1305, it is used after a self test confirmed that it yields exactly the same results as
+the pure python implementation in this module. Otherwise the pure python implementation is used as fallback.
 """
-from math import ceil
+from array import array
+import hmac
+import logging
+import os
+import struct
+import sys
+
+from homekit.tools import NUMPY_SUPPORTED
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305 as _CryptographyChaCha20Poly1305
+    from cryptography.exceptions import InvalidTag as _InvalidTag
+except ImportError:
+    _CryptographyChaCha20Poly1305 = None
+
+# encrypt_into and decrypt_into were added in later versions of the cryptography package
+_NATIVE_INTO = hasattr(_CryptographyChaCha20Poly1305, 'encrypt_into')
+
+if NUMPY_SUPPORTED:
+    import numpy
+
+# key streams of at least this many bytes are computed with numpy (if available) for all blocks at once
+NUMPY_THRESHOLD = 4096
 
 
 def rotate_left(num: int, num_size: int, shift_bits: int) -> int:
@@ -80,6 +106,284 @@ def extract_nth_word(num: bytes, w: int) -> int:
     return int.from_bytes(bs, byteorder='big')
 
 
+_CHACHA20_CONSTANTS = (0x61707865, 0x3320646e, 0x79622d32, 0x6b206574)
+_WORD_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+
+def _xor(data, stream) -> bytes:
+    """
+    Xors the data with the beginning of the key stream. Large buffers are handled as numpy arrays if available, else
+    both are converted to ints.
+
+    :param data: the data as bytes, bytearray or memoryview
+    :param stream: the key stream with at least len(data) bytes
+    :return: the result as bytes
+    """
+    length = len(data)
+    if NUMPY_SUPPORTED and length >= NUMPY_THRESHOLD:
+        stream = numpy.frombuffer(stream, dtype=numpy.uint8, count=length)
+        return numpy.bitwise_xor(numpy.frombuffer(data, dtype=numpy.uint8), stream).tobytes()
+    stream = int.from_bytes(memoryview(stream)[:length], byteorder='little')
+    return (int.from_bytes(data, byteorder='little') ^ stream).to_bytes(length, byteorder='little')
+
+
+def _numpy_chacha20_blocks(key_words: tuple, nonces_words: list, counter: int, blocks: int) -> bytes:
+    """
+    Computes the chacha20 blocks counter to counter + blocks - 1 for each of the given nonces using numpy. Row i of the
+    state matrix holds word i of all blocks, so each step of a quarter round is one array operation across all block
+    counters and nonces.
+
+    :param key_words: the key as tuple of 8 words
+    :param nonces_words: list of nonces, each as tuple of 3 words
+    :param counter: the 32bit block counter of the first block
+    :param blocks: the number of blocks per nonce
+    :return: the key streams of all nonces concatenated as bytes
+    """
+    columns = len(nonces_words) * blocks
+    state = numpy.empty((16, columns), dtype=numpy.uint32)
+    state[0:4] = numpy.array(_CHACHA20_CONSTANTS, dtype=numpy.uint32)[:, None]
+    state[4:12] = numpy.array(key_words, dtype=numpy.uint32)[:, None]
+    state[12] = numpy.tile((numpy.arange(blocks, dtype=numpy.uint64) + counter) & 0xffffffff, len(nonces_words))
+    state[13:16] = numpy.repeat(numpy.array(nonces_words, dtype=numpy.uint32).T, blocks, axis=1)
+    x = state.copy()
+    tmp = numpy.empty(columns, dtype=numpy.uint32)
+
+    def quarter_round(a, b, c, d):
+        for (s, t, u, r) in ((a, b, d, 16), (c, d, b, 12), (a, b, d, 8), (c, d, b, 7)):
+            numpy.add(x[s], x[t], out=x[s])
+            numpy.bitwise_xor(x[u], x[s], out=x[u])
+            numpy.right_shift(x[u], 32 - r, out=tmp)
+            numpy.left_shift(x[u], r, out=x[u])
+            numpy.bitwise_or(x[u], tmp, out=x[u])
+
+    for _ in range(10):
+        quarter_round(0, 4, 8, 12)
+        quarter_round(1, 5, 9, 13)
+        quarter_round(2, 6, 10, 14)
+        quarter_round(3, 7, 11, 15)
+        quarter_round(0, 5, 10, 15)
+        quarter_round(1, 6, 11, 12)
+        quarter_round(2, 7, 8, 13)
+        quarter_round(3, 4, 9, 14)
+    x += state
+    return x.T.astype('<u4').tobytes()
+
+
+def chacha20_keystreams(key: bytes, nonces: list, length: int) -> list:
+    """
+    Computes the key streams for several nonces starting at block counter 0. This is used to encrypt or decrypt a
+    batch of frames of one session at once. If numpy is available and the key streams have at least NUMPY_THRESHOLD
+    bytes in total, the blocks of all nonces are computed together.
+
+    :param key: the 256 bit key to use as bytes
+    :param nonces: list of 96 bit nonces as bytes
+    :param length: the number of bytes of each key stream
+    :return: list with one key stream (as bytes) per nonce
+    """
+    blocks = (length + 63) // 64
+    if NUMPY_SUPPORTED and len(nonces) * blocks * 64 >= NUMPY_THRESHOLD:
+        nonces_words = [struct.unpack('<3I', nonce) for nonce in nonces]
+        data = _numpy_chacha20_blocks(struct.unpack('<8I', key), nonces_words, 0, blocks)
+        size = blocks * 64
+        return [data[i * size:i * size + length] for i in range(len(nonces))]
+    return [ChaCha20Keystream(key, nonce).keystream(0, length) for nonce in nonces]
+
+
+class ChaCha20Keystream:
+    """
+    Generates the chacha20 key stream for a fixed key and nonce. The key and nonce words of the initial state are
+    unpacked once on creation, afterwards an arbitrary number of consecutive blocks can be computed in one call. The
+    quarter rounds are inlined and operate on local variables, the result is returned as array of 32 bit words.
+
+    If numpy is installed, key streams of at least NUMPY_THRESHOLD bytes are computed by running the quarter rounds on
+    uint32 arrays holding the state of all blocks at once.
+    """
+
+    def __init__(self, key: bytes, nonce: bytes):
+        """
+        :param key: the 256 bit key to use as bytes
+        :param nonce: the 96 bit nonce as bytes
+        """
+        assert type(key) is bytes, 'key is no instance of bytes'
+        assert len(key) == 32
+        assert type(nonce) is bytes, 'nonce is no instance of bytes'
+        assert len(nonce) == 12
+        self._key_words = struct.unpack('<8I', key)
+        self._nonce_words = struct.unpack('<3I', nonce)
+
+    def initial_state(self, counter: int) -> list:
+        """
+        Returns the initial chacha20 state for the given block counter as described in RFC7539 chapter 2.3.
+
+        :param counter: the 32bit block counter
+        :return: the initial state as list of ints
+        """
+        return list(_CHACHA20_CONSTANTS + self._key_words + (counter & 0xffffffff,) + self._nonce_words)
+
+    def words(self, counter: int, blocks: int) -> array:
+        """
+        Computes consecutive key stream blocks starting at the given block counter.
+
+        :param counter: the 32bit block counter of the first block
+        :param blocks: the number of 64 byte blocks to compute
+        :return: array with 16 words per block
+        """
+        c0, c1, c2, c3 = _CHACHA20_CONSTANTS
+        k0, k1, k2, k3, k4, k5, k6, k7 = self._key_words
+        n0, n1, n2 = self._nonce_words
+        result = array(_WORD_TYPECODE)
+        for block in range(blocks):
+            b = (counter + block) & 0xffffffff
+            x0, x1, x2, x3 = c0, c1, c2, c3
+            x4, x5, x6, x7, x8, x9, x10, x11 = k0, k1, k2, k3, k4, k5, k6, k7
+            x12, x13, x14, x15 = b, n0, n1, n2
+            for _ in range(10):
+                x0 = (x0 + x4) & 0xffffffff
+                x12 ^= x0
+                x12 = ((x12 << 16) & 0xffffffff) | (x12 >> 16)
+                x8 = (x8 + x12) & 0xffffffff
+                x4 ^= x8
+                x4 = ((x4 << 12) & 0xffffffff) | (x4 >> 20)
+                x0 = (x0 + x4) & 0xffffffff
+                x12 ^= x0
+                x12 = ((x12 << 8) & 0xffffffff) | (x12 >> 24)
+                x8 = (x8 + x12) & 0xffffffff
+                x4 ^= x8
+                x4 = ((x4 << 7) & 0xffffffff) | (x4 >> 25)
+                x1 = (x1 + x5) & 0xffffffff
+                x13 ^= x1
+                x13 = ((x13 << 16) & 0xffffffff) | (x13 >> 16)
+                x9 = (x9 + x13) & 0xffffffff
+                x5 ^= x9
+                x5 = ((x5 << 12) & 0xffffffff) | (x5 >> 20)
+                x1 = (x1 + x5) & 0xffffffff
+                x13 ^= x1
+                x13 = ((x13 << 8) & 0xffffffff) | (x13 >> 24)
+                x9 = (x9 + x13) & 0xffffffff
+                x5 ^= x9
+                x5 = ((x5 << 7) & 0xffffffff) | (x5 >> 25)
+                x2 = (x2 + x6) & 0xffffffff
+                x14 ^= x2
+                x14 = ((x14 << 16) & 0xffffffff) | (x14 >> 16)
+                x10 = (x10 + x14) & 0xffffffff
+                x6 ^= x10
+                x6 = ((x6 << 12) & 0xffffffff) | (x6 >> 20)
+                x2 = (x2 + x6) & 0xffffffff
+                x14 ^= x2
+                x14 = ((x14 << 8) & 0xffffffff) | (x14 >> 24)
+                x10 = (x10 + x14) & 0xffffffff
+                x6 ^= x10
+                x6 = ((x6 << 7) & 0xffffffff) | (x6 >> 25)
+                x3 = (x3 + x7) & 0xffffffff
+                x15 ^= x3
+                x15 = ((x15 << 16) & 0xffffffff) | (x15 >> 16)
+                x11 = (x11 + x15) & 0xffffffff
+                x7 ^= x11
+                x7 = ((x7 << 12) & 0xffffffff) | (x7 >> 20)
+                x3 = (x3 + x7) & 0xffffffff
+                x15 ^= x3
+                x15 = ((x15 << 8) & 0xffffffff) | (x15 >> 24)
+                x11 = (x11 + x15) & 0xffffffff
+                x7 ^= x11
+                x7 = ((x7 << 7) & 0xffffffff) | (x7 >> 25)
+                x0 = (x0 + x5) & 0xffffffff
+                x15 ^= x0
+                x15 = ((x15 << 16) & 0xffffffff) | (x15 >> 16)
+                x10 = (x10 + x15) & 0xffffffff
+                x5 ^= x10
+                x5 = ((x5 << 12) & 0xffffffff) | (x5 >> 20)
+                x0 = (x0 + x5) & 0xffffffff
+                x15 ^= x0
+                x15 = ((x15 << 8) & 0xffffffff) | (x15 >> 24)
+                x10 = (x10 + x15) & 0xffffffff
+                x5 ^= x10
+                x5 = ((x5 << 7) & 0xffffffff) | (x5 >> 25)
+                x1 = (x1 + x6) & 0xffffffff
+                x12 ^= x1
+                x12 = ((x12 << 16) & 0xffffffff) | (x12 >> 16)
+                x11 = (x11 + x12) & 0xffffffff
+                x6 ^= x11
+                x6 = ((x6 << 12) & 0xffffffff) | (x6 >> 20)
+                x1 = (x1 + x6) & 0xffffffff
+                x12 ^= x1
+                x12 = ((x12 << 8) & 0xffffffff) | (x12 >> 24)
+                x11 = (x11 + x12) & 0xffffffff
+                x6 ^= x11
+                x6 = ((x6 << 7) & 0xffffffff) | (x6 >> 25)
+                x2 = (x2 + x7) & 0xffffffff
+                x13 ^= x2
+                x13 = ((x13 << 16) & 0xffffffff) | (x13 >> 16)
+                x8 = (x8 + x13) & 0xffffffff
+                x7 ^= x8
+                x7 = ((x7 << 12) & 0xffffffff) | (x7 >> 20)
+                x2 = (x2 + x7) & 0xffffffff
+                x13 ^= x2
+                x13 = ((x13 << 8) & 0xffffffff) | (x13 >> 24)
+                x8 = (x8 + x13) & 0xffffffff
+                x7 ^= x8
+                x7 = ((x7 << 7) & 0xffffffff) | (x7 >> 25)
+                x3 = (x3 + x4) & 0xffffffff
+                x14 ^= x3
+                x14 = ((x14 << 16) & 0xffffffff) | (x14 >> 16)
+                x9 = (x9 + x14) & 0xffffffff
+                x4 ^= x9
+                x4 = ((x4 << 12) & 0xffffffff) | (x4 >> 20)
+                x3 = (x3 + x4) & 0xffffffff
+                x14 ^= x3
+                x14 = ((x14 << 8) & 0xffffffff) | (x14 >> 24)
+                x9 = (x9 + x14) & 0xffffffff
+                x4 ^= x9
+                x4 = ((x4 << 7) & 0xffffffff) | (x4 >> 25)
+            result.extend(((x0 + c0) & 0xffffffff, (x1 + c1) & 0xffffffff,
+                           (x2 + c2) & 0xffffffff, (x3 + c3) & 0xffffffff,
+                           (x4 + k0) & 0xffffffff, (x5 + k1) & 0xffffffff,
+                           (x6 + k2) & 0xffffffff, (x7 + k3) & 0xffffffff,
+                           (x8 + k4) & 0xffffffff, (x9 + k5) & 0xffffffff,
+                           (x10 + k6) & 0xffffffff, (x11 + k7) & 0xffffffff,
+                           (x12 + b) & 0xffffffff, (x13 + n0) & 0xffffffff,
+                           (x14 + n1) & 0xffffffff, (x15 + n2) & 0xffffffff))
+        return result
+
+    def numpy_keystream(self, counter: int, length: int) -> bytes:
+        """
+        Computes length bytes of key stream starting at the given block counter using numpy.
+
+        :param counter: the 32bit block counter of the first block
+        :param length: the number of bytes
+        :return: the key stream as bytes
+        """
+        return _numpy_chacha20_blocks(self._key_words, [self._nonce_words], counter, (length + 63) // 64)[:length]
+
+    def keystream(self, counter: int, length: int) -> bytes:
+        """
+        Computes length bytes of key stream starting at the given block counter.
+
+        :param counter: the 32bit block counter of the first block
+        :param length: the number of bytes
+        :return: the key stream as bytes
+        """
+        if NUMPY_SUPPORTED and length >= NUMPY_THRESHOLD:
+            return self.numpy_keystream(counter, length)
+        words = self.words(counter, (length + 63) // 64)
+        if sys.byteorder != 'little':
+            words.byteswap()
+        return words.tobytes()[:length]
+
+    def xor(self, counter: int, data: bytes) -> bytes:
+        """
+        Encrypts (or decrypts) the data by xor-ing it with the key stream starting at the given block counter. The xor
+        is performed on the whole buffer at once.
+
+        :param counter: the 32bit block counter of the first block
+        :param data: the data as bytes, bytearray or memoryview
+        :return: the result as bytes
+        """
+        length = len(data)
+        if length == 0:
+            return b''
+        return _xor(data, self.keystream(counter, length))
+
+
 def chacha20_create_initial_state(key: bytes, nonce: bytes, counter: int) -> list:
     """
     Creates the initial chacha20 state for the block function as described in RFC7539 chapter 2.3.
@@ -93,17 +397,7 @@ def chacha20_create_initial_state(key: bytes, nonce: bytes, counter: int) -> lis
     assert len(key) == 32
     assert type(nonce) is bytes, 'nonce is no instance of bytes'
     assert len(nonce) == 3 * 32 / 8
-    state = [0x61707865, 0x3320646e, 0x79622d32, 0x6b206574,
-             0, 0, 0, 0,
-             0, 0, 0, 0,
-             0, 0, 0, 0]
-    for i in range(0, 8):
-        state[4 + i] = convert(extract_nth_word(key, 7 - i))
-    state[12] = counter & (2 ** 32 - 1)
-    state[13] = convert(extract_nth_word(nonce, 2))
-    state[14] = convert(extract_nth_word(nonce, 1))
-    state[15] = convert(extract_nth_word(nonce, 0))
-    return state
+    return ChaCha20Keystream(key, nonce).initial_state(counter)
 
 
 def chacha20_inner_block(state: list):
@@ -138,38 +432,20 @@ def chacha20_block(key: bytes, nonce: bytes, counter: int) -> int:
     assert len(key) == 32
     assert type(nonce) is bytes, 'nonce is no instance of bytes'
     assert len(nonce) == 3 * 32 / 8
-    state = chacha20_create_initial_state(key, nonce, counter)
-    w_state = state.copy()
-    for i in range(0, 10):
-        chacha20_inner_block(w_state)
-    result = 0
-    for i in range(0, 16):
-        state[i] = (state[i] + w_state[i]) & (2 ** 32 - 1)
-        result <<= 32
-        result += convert(state[i])
-    return result
-
-
-def chacha20_encrypt(key: bytes, counter: int, nonce: int, plaintext: bytes) -> bytes:
-    assert type(key) is bytes, 'key is no instance of bytes'
-    assert len(key) == 32
-    assert type(nonce) is bytes, 'nonce is no instance of bytes'
-    assert len(nonce) == 12
-    encrypted = bytearray()
-    for i in range(0, int(len(plaintext) / 64)):
-        key_stream = chacha20_block(key, nonce, counter + i)
-        key_stream = key_stream.to_bytes(64, byteorder='big')
-        block = plaintext[i * 64:i * 64 + 64]
-        encrypted += bytes([a ^ b for (a, b) in zip(block, key_stream)])
-
-    if (len(plaintext) % 64) != 0:
-        j = int(len(plaintext) / 64)
-        key_stream = chacha20_block(key, nonce, counter + j)
-        block = plaintext[(j * 64):len(plaintext)]
-        key_stream = key_stream.to_bytes(64, byteorder='big')
-        key_stream = key_stream[:len(block)]
-        encrypted += bytes([a ^ b for (a, b) in zip(block, key_stream)])
-    return encrypted
+    return int.from_bytes(ChaCha20Keystream(key, nonce).keystream(counter, 64), byteorder='big')
+
+
+def chacha20_encrypt(key: bytes, counter: int, nonce: bytes, plaintext: bytes) -> bytes:
+    """
+    Encrypts (or decrypts) the plaintext with the chacha20 stream cipher as described in RFC7539 chapter 2.4.
+
+    :param key: the 256 bit key to use as bytes
+    :param counter: the 32bit block counter of the first block
+    :param nonce: the 96 bit nonce as bytes
+    :param plaintext: arbitrary length plaintext
+    :return: the cipher text as bytearray
+    """
+    return bytearray(ChaCha20Keystream(key, nonce).xor(counter, plaintext))
 
 
 def clamp(r: int) -> int:
@@ -195,24 +471,87 @@ def calc_s(k: bytes) -> int:
     return int.from_bytes(tmp, byteorder='little')
 
 
+class Poly1305:
+    """
+    Incremental Poly1305 authenticator as described in RFC7539 chapter 2.5. The message can be passed in pieces to
+    `update` (bytes, bytearray or memoryview), only incomplete 16 byte blocks are buffered internally. Complete blocks
+    are read from the given buffer in place.
+    """
+    _P = (1 << 130) - 5
+
+    def __init__(self, key: bytes):
+        """
+        :param key: the 256 bit one time key as bytes
+        """
+        assert len(key) == 32
+        self._r = int.from_bytes(key[0:16], byteorder='little') & 0x0ffffffc0ffffffc0ffffffc0fffffff
+        self._s = int.from_bytes(key[16:32], byteorder='little')
+        self._accumulator = 0
+        self._buffer = bytearray()
+
+    def _process_blocks(self, data: memoryview):
+        """
+        Adds all complete 16 byte blocks of data to the accumulator.
+
+        :param data: a memoryview whose length is a multiple of 16
+        """
+        a = self._accumulator
+        r = self._r
+        p = self._P
+        one = 1 << 128
+        for i in range(0, len(data), 16):
+            a = ((a + int.from_bytes(data[i:i + 16], byteorder='little') + one) * r) % p
+        self._accumulator = a
+
+    def update(self, data):
+        """
+        Feeds more of the message into the authenticator.
+
+        :param data: the next part of the message as bytes, bytearray or memoryview
+        """
+        data = memoryview(data).cast('B')
+        if self._buffer:
+            missing = 16 - len(self._buffer)
+            self._buffer += data[:missing]
+            data = data[missing:]
+            if len(self._buffer) < 16:
+                return
+            self._process_blocks(memoryview(self._buffer))
+            self._buffer = bytearray()
+        complete = len(data) - len(data) % 16
+        if complete:
+            self._process_blocks(data[:complete])
+        if complete < len(data):
+            self._buffer += data[complete:]
+
+    def pad16(self):
+        """
+        Pads the message fed so far with zeros to a multiple of 16 bytes as required by the AEAD construction of
+        RFC7539 chapter 2.8.
+        """
+        if self._buffer:
+            self.update(bytes(16 - len(self._buffer)))
+
+    def finalize(self) -> bytes:
+        """
+        Computes the tag of the whole message.
+
+        :return: the 16 byte tag
+        """
+        a = self._accumulator
+        if self._buffer:
+            block = self._buffer + b'\x01'
+            a = ((a + int.from_bytes(block, byteorder='little')) * self._r) % self._P
+        a = (a + self._s) & ((1 << 128) - 1)
+        return a.to_bytes(length=16, byteorder='little')
+
+
 def poly1305_mac(msg: bytes, key: bytes) -> bytes:
     assert type(key) is bytes, 'key is no instance of bytes'
     assert len(key) == 32
-    r = calc_r(key)
-    r = clamp(r)
-    s = calc_s(key)
-    a = 0
-    p = (1 << 130) - 5
-    for i in range(0, ceil(len(msg) / 16)):
-        block = bytearray(msg[i * 16:i * 16 + 16])
-        block.append(0x01)
-        n = int.from_bytes(block, byteorder='little')
-        a += n
-        a = (r * a)
-        a %= p
-    a += s
-    a &= (2 ** (16 * 8) - 1)
-    return a.to_bytes(length=16, byteorder='little')
+    mac = Poly1305(key)
+    mac.update(msg)
+    return mac.finalize()
 
 
 def poly1305_key_gen(key: bytes, nonce: bytes) -> bytes:
@@ -220,13 +559,7 @@ def poly1305_key_gen(key: bytes, nonce: bytes) -> bytes:
     assert len(key) == 32
     assert type(nonce) is bytes, 'nonce is no instance of bytes'
     assert len(nonce) == 12
-    counter = 0
-    block = chacha20_block(key, nonce, counter)
-    mask = (2 ** (32 * 8) - 1) << (32 * 8)
-    block &= mask
-    block >>= (32 * 8)
-    block = block.to_bytes(length=32, byteorder='big')
-    return block
+    return ChaCha20Keystream(key, nonce).keystream(0, 32)
 
 
 def pad16(x: bytes) -> bytes:
@@ -237,21 +570,386 @@ def pad16(x: bytes) -> bytes:
     return bytearray([0 for i in range(0, tmp)])
 
 
+def _aead_tag(otk: bytes, aad, ciphertext) -> bytes:
+    """
+    Computes the Poly1305 tag over aad and cipher text as described in RFC7539 chapter 2.8 without concatenating the
+    parts.
+
+    :param otk: the 256 bit one time key as bytes
+    :param aad: arbitrary length additional authenticated data
+    :param ciphertext: the cipher text (without tag) as bytes, bytearray or memoryview
+    :return: the 16 byte tag
+    """
+    mac = Poly1305(otk)
+    mac.update(aad)
+    mac.pad16()
+    mac.update(ciphertext)
+    mac.pad16()
+    mac.update(len(aad).to_bytes(length=8, byteorder='little') + len(ciphertext).to_bytes(length=8, byteorder='little'))
+    return mac.finalize()
+
+
 def chacha20_aead_verify_tag(aad: bytes, key: bytes, iv: bytes, constant: bytes, ciphertext: bytes):
-    digest = ciphertext[-16:]
-    ciphertext = ciphertext[:-16]
+    data = memoryview(ciphertext)
+    digest = data[-16:]
+    tag = _aead_tag(poly1305_key_gen(key, constant + iv), aad, data[:-16])
+    return hmac.compare_digest(digest, tag)
+
+
+def _python_aead_encrypt(aad: bytes, key: bytes, nonce: bytes, plaintext: bytes):
+    """
+    Pure python implementation of the chacha20 aead encryption as described in RFC7539 chapter 2.8.
+
+    :param aad: arbitrary length additional authenticated data
+    :param key: 256-bit (32-byte) key of type bytes
+    :param nonce: the 96-bit nonce
+    :param plaintext: arbitrary length plaintext of type bytes or bytearray
+    :return: the cipher text and tag
+    """
+    stream = ChaCha20Keystream(key, nonce)
+    otk = stream.keystream(0, 32)
+    ciphertext = bytearray(stream.xor(1, plaintext))
+    assert len(plaintext) == len(ciphertext)
+    return ciphertext, _aead_tag(otk, aad, ciphertext)
+
+
+class PythonChaCha20Poly1305:
+    """
+    ChaCha20-Poly1305 AEAD cipher implemented in pure python. The interface follows the one of `ChaCha20Poly1305` from
+    the `cryptography` package, so both can be used interchangeably as backend.
+    """
+    name = 'python'
+
+    def __init__(self, key: bytes):
+        """
+        :param key: 256-bit (32-byte) key of type bytes
+        """
+        assert type(key) is bytes, 'key is no instance of bytes'
+        assert len(key) == 32
+        self.key = key
+
+    def encrypt(self, nonce: bytes, plaintext: bytes, aad: bytes) -> bytes:
+        """
+        Encrypts and authenticates the plaintext.
+
+        :param nonce: the 96-bit nonce
+        :param plaintext: arbitrary length plaintext of type bytes or bytearray
+        :param aad: arbitrary length additional authenticated data
+        :return: the cipher text with the 16 byte tag appended
+        """
+        ciphertext, tag = _python_aead_encrypt(aad, self.key, nonce, plaintext)
+        ciphertext += tag
+        return bytes(ciphertext)
+
+    def decrypt(self, nonce: bytes, data: bytes, aad: bytes):
+        """
+        Verifies the tag and decrypts the cipher text.
+
+        :param nonce: the 96-bit nonce
+        :param data: the cipher text with the 16 byte tag appended
+        :param aad: arbitrary length additional authenticated data
+        :return: False if the tag could not be verified or the plaintext as bytes
+        """
+        stream = ChaCha20Keystream(self.key, bytes(nonce))
+        data = memoryview(data)
+        if not hmac.compare_digest(data[-16:], _aead_tag(stream.keystream(0, 32), aad, data[:-16])):
+            return False
+        return stream.xor(1, data[:-16])
+
+    def encrypt_into(self, nonce: bytes, plaintext: bytes, aad: bytes, buf) -> int:
+        """
+        Encrypts and authenticates the plaintext and writes cipher text and tag into buf.
+
+        :param nonce: the 96-bit nonce
+        :param plaintext: arbitrary length plaintext of type bytes, bytearray or memoryview
+        :param aad: arbitrary length additional authenticated data
+        :param buf: writable buffer of exactly len(plaintext) + 16 bytes
+        :return: the number of bytes written
+        :raises ValueError: if the buffer has the wrong size
+        """
+        length = len(plaintext)
+        if len(buf) != length + 16:
+            raise ValueError('buffer must be {} bytes'.format(length + 16))
+        ciphertext, tag = _python_aead_encrypt(aad, self.key, nonce, plaintext)
+        buf[:length] = ciphertext
+        buf[length:] = tag
+        return length + 16
+
+    def decrypt_into(self, nonce: bytes, data: bytes, aad: bytes, buf) -> bool:
+        """
+        Verifies the tag and decrypts the cipher text into buf.
+
+        :param nonce: the 96-bit nonce
+        :param data: the cipher text with the 16 byte tag appended
+        :param aad: arbitrary length additional authenticated data
+        :param buf: writable buffer of exactly len(data) - 16 bytes
+        :return: False if the tag could not be verified, True otherwise
+        :raises ValueError: if the buffer has the wrong size
+        """
+        if len(buf) != len(data) - 16:
+            raise ValueError('buffer must be {} bytes'.format(len(data) - 16))
+        plaintext = self.decrypt(nonce, data, aad)
+        if plaintext is False:
+            return False
+        buf[:] = plaintext
+        return True
+
+    def encrypt_batch_into(self, nonces: list, plaintexts: list, aads: list, bufs: list):
+        """
+        Encrypts and authenticates several messages (e.g. the frames of one HAP message) at once. The key streams of
+        all messages are computed together, see chacha20_keystreams.
+
+        :param nonces: the 96-bit nonce of each message
+        :param plaintexts: the plain text of each message as bytes, bytearray or memoryview
+        :param aads: the additional authenticated data of each message
+        :param bufs: writable buffers of exactly len(plaintext) + 16 bytes for cipher text and tag of each message
+        :raises ValueError: if a buffer has the wrong size
+        """
+        if not nonces:
+            return
+        streams = chacha20_keystreams(self.key, nonces, 64 + max(len(plaintext) for plaintext in plaintexts))
+        for stream, plaintext, aad, buf in zip(streams, plaintexts, aads, bufs):
+            length = len(plaintext)
+            if len(buf) != length + 16:
+                raise ValueError('buffer must be {} bytes'.format(length + 16))
+            stream = memoryview(stream)
+            ciphertext = _xor(plaintext, stream[64:])
+            buf[:length] = ciphertext
+            buf[length:] = _aead_tag(stream[:32], aad, ciphertext)
+
+    def decrypt_batch(self, nonces: list, datas: list, aads: list) -> list:
+        """
+        Verifies and decrypts several messages (e.g. the received frames of one HAP session) at once. The key streams of
+        all messages are computed together, see chacha20_keystreams.
+
+        :param nonces: the 96-bit nonce of each message
+        :param datas: the cipher text with the 16 byte tag appended of each message
+        :param aads: the additional authenticated data of each message
+        :return: list with the plaintext as bytes of each message or False if its tag could not be verified
+        """
+        if not nonces:
+            return []
+        streams = chacha20_keystreams(self.key, nonces, 48 + max(len(data) for data in datas))
+        result = []
+        for stream, data, aad in zip(streams, datas, aads):
+            stream = memoryview(stream)
+            data = memoryview(data)
+            if hmac.compare_digest(data[-16:], _aead_tag(stream[:32], aad, data[:-16])):
+                result.append(_xor(data[:-16], stream[64:]))
+            else:
+                result.append(False)
+        return result
+
+
+class CryptographyChaCha20Poly1305:
+    """
+    ChaCha20-Poly1305 AEAD cipher backed by the native implementation of the `cryptography` package.
+    """
+    name = 'cryptography'
+
+    def __init__(self, key: bytes):
+        """
+        :param key: 256-bit (32-byte) key of type bytes
+        """
+        assert type(key) is bytes, 'key is no instance of bytes'
+        assert len(key) == 32
+        self._aead = _CryptographyChaCha20Poly1305(key)
+
+    def encrypt(self, nonce: bytes, plaintext: bytes, aad: bytes) -> bytes:
+        """
+        Encrypts and authenticates the plaintext.
+
+        :param nonce: the 96-bit nonce
+        :param plaintext: arbitrary length plaintext of type bytes or bytearray
+        :param aad: arbitrary length additional authenticated data
+        :return: the cipher text with the 16 byte tag appended
+        """
+        return self._aead.encrypt(nonce, plaintext, aad)
+
+    def decrypt(self, nonce: bytes, data: bytes, aad: bytes):
+        """
+        Verifies the tag and decrypts the cipher text.
+
+        :param nonce: the 96-bit nonce
+        :param data: the cipher text with the 16 byte tag appended
+        :param aad: arbitrary length additional authenticated data
+        :return: False if the tag could not be verified or the plaintext as bytes
+        """
+        try:
+            return self._aead.decrypt(nonce, data, aad)
+        except _InvalidTag:
+            return False
+
+    def encrypt_into(self, nonce: bytes, plaintext: bytes, aad: bytes, buf) -> int:
+        """
+        Encrypts and authenticates the plaintext and writes cipher text and tag into buf. Older versions of the
+        `cryptography` package do not offer `encrypt_into`, then the result is copied into buf.
+
+        :param nonce: the 96-bit nonce
+        :param plaintext: arbitrary length plaintext of type bytes, bytearray or memoryview
+        :param aad: arbitrary length additional authenticated data
+        :param buf: writable buffer of exactly len(plaintext) + 16 bytes
+        :return: the number of bytes written
+        :raises ValueError: if the buffer has the wrong size
+        """
+        if _NATIVE_INTO:
+            return self._aead.encrypt_into(nonce, plaintext, aad, buf)
+        if len(buf) != len(plaintext) + 16:
+            raise ValueError('buffer must be {} bytes'.format(len(plaintext) + 16))
+        buf[:] = self._aead.encrypt(nonce, plaintext, aad)
+        return len(buf)
+
+    def decrypt_into(self, nonce: bytes, data: bytes, aad: bytes, buf) -> bool:
+        """
+        Verifies the tag and decrypts the cipher text into buf.
+
+        :param nonce: the 96-bit nonce
+        :param data: the cipher text with the 16 byte tag appended
+        :param aad: arbitrary length additional authenticated data
+        :param buf: writable buffer of exactly len(data) - 16 bytes
+        :return: False if the tag could not be verified, True otherwise
+        :raises ValueError: if the buffer has the wrong size
+        """
+        if len(buf) != len(data) - 16:
+            raise ValueError('buffer must be {} bytes'.format(len(data) - 16))
+        try:
+            if _NATIVE_INTO:
+                self._aead.decrypt_into(nonce, data, aad, buf)
+            else:
+                buf[:] = self._aead.decrypt(nonce, data, aad)
+        except _InvalidTag:
+            return False
+        return True
+
+    def encrypt_batch_into(self, nonces: list, plaintexts: list, aads: list, bufs: list):
+        """
+        Encrypts and authenticates several messages, see PythonChaCha20Poly1305.encrypt_batch_into.
+
+        :param nonces: the 96-bit nonce of each message
+        :param plaintexts: the plain text of each message as bytes, bytearray or memoryview
+        :param aads: the additional authenticated data of each message
+        :param bufs: writable buffers of exactly len(plaintext) + 16 bytes for cipher text and tag of each message
+        :raises ValueError: if a buffer has the wrong size
+        """
+        for nonce, plaintext, aad, buf in zip(nonces, plaintexts, aads, bufs):
+            self.encrypt_into(nonce, plaintext, aad, buf)
+
+    def decrypt_batch(self, nonces: list, datas: list, aads: list) -> list:
+        """
+        Verifies and decrypts several messages, see PythonChaCha20Poly1305.decrypt_batch.
+
+        :param nonces: the 96-bit nonce of each message
+        :param datas: the cipher text with the 16 byte tag appended of each message
+        :param aads: the additional authenticated data of each message
+        :return: list with the plaintext as bytes of each message or False if its tag could not be verified
+        """
+        return [self.decrypt(nonce, data, aad) for nonce, data, aad in zip(nonces, datas, aads)]
+
+
+# the available backends ordered by preference
+AEAD_BACKENDS = [PythonChaCha20Poly1305]
+if _CryptographyChaCha20Poly1305 is not None:
+    AEAD_BACKENDS.insert(0, CryptographyChaCha20Poly1305)
+
+# test vector from RFC7539 chapter 2.8.2 as (key, nonce, aad, plaintext, ciphertext with tag)
+_SELF_TEST_VECTOR = (
+    bytes(range(0x80, 0xa0)),
+    bytes.fromhex('070000004041424344454647'),
+    bytes.fromhex('50515253c0c1c2c3c4c5c6c7'),
+    b"Ladies and Gentlemen of the class of '99: If I could offer you only one tip for the future, sunscreen would "
+    b"be it.",
+    bytes.fromhex('d31a8d34648e60db7b86afbc53ef7ec2a4aded51296e08fea9e2b5a736ee62d63dbea45e8ca9671282fafb69da92728b1a71'
+                  'de0a9e060b2905d6a5b67ecd3b3692ddbd7f2d778b8c9803aee328091b58fab324e4fad675945585808b4831d7bc3ff4def0'
+                  '8e4b7a9de576d26586cec64b61161ae10b594f09e26a7e902ecbd0600691')
+)
+
+
+def verify_backend(backend) -> bool:
+    """
+    Checks that the given backend computes exactly the same results as the pure python implementation. This uses the
+    test vector from RFC7539 chapter 2.8.2 and a random message of the size of a typical HAP frame.
+
+    :param backend: the backend class to check (e.g. an element of AEAD_BACKENDS)
+    :return: True if the backend is working correctly, False otherwise
+    """
+    key, nonce, aad, plaintext, expected = _SELF_TEST_VECTOR
+    random_key = os.urandom(32)
+    random_nonce = bytes([0, 0, 0, 0]) + os.urandom(8)
+    random_aad = os.urandom(2)
+    random_plaintext = os.urandom(67)
+    try:
+        if backend(key).encrypt(nonce, plaintext, aad) != expected:
+            return False
+        if backend(key).decrypt(nonce, expected, aad) != plaintext:
+            return False
+        buf = bytearray(len(expected))
+        if backend(key).encrypt_into(nonce, plaintext, aad, buf) != len(expected) or buf != expected:
+            return False
+        buf = bytearray(len(plaintext))
+        if not backend(key).decrypt_into(nonce, expected, aad, buf) or buf != plaintext:
+            return False
+        buf = bytearray(len(expected))
+        backend(key).encrypt_batch_into([nonce], [plaintext], [aad], [buf])
+        if buf != expected or backend(key).decrypt_batch([nonce], [expected], [aad]) != [plaintext]:
+            return False
+        tampered = bytearray(expected)
+        tampered[0] ^= 0x01
+        if backend(key).decrypt(nonce, bytes(tampered), aad) is not False:
+            return False
+        sealed = backend(random_key).encrypt(random_nonce, random_plaintext, random_aad)
+        if sealed != PythonChaCha20Poly1305(random_key).encrypt(random_nonce, random_plaintext, random_aad):
+            return False
+        return backend(random_key).decrypt(random_nonce, sealed, random_aad) == random_plaintext
+    except Exception:
+        logging.exception('chacha20 poly1305 backend "%s" failed', backend.name)
+        return False
 
-    nonce = constant + iv
-    otk = poly1305_key_gen(key, nonce)
-    mac_data = aad + pad16(aad)
-    assert len(mac_data) % 16 == 0
-    mac_data += ciphertext + pad16(ciphertext)
-    assert len(mac_data) % 16 == 0
-    mac_data += len(aad).to_bytes(length=8, byteorder='little')
-    mac_data += len(ciphertext).to_bytes(length=8, byteorder='little')
-    tag = poly1305_mac(mac_data, otk)
 
-    return digest == tag
+def _select_backend():
+    for backend in AEAD_BACKENDS:
+        if backend is PythonChaCha20Poly1305 or verify_backend(backend):
+            return backend
+        logging.warning('chacha20 poly1305 backend "%s" failed its self test, not using it', backend.name)
+
+
+_backend = _select_backend()
+
+
+def get_backend_name() -> str:
+    """
+    Returns the name of the backend that is currently used for the chacha20 aead functions.
+
+    :return: the name, e.g. 'cryptography' or 'python'
+    """
+    return _backend.name
+
+
+def set_backend(name: str):
+    """
+    Selects the backend for the chacha20 aead functions by its name. The backend must pass the self test.
+
+    :param name: the name of the backend, e.g. 'cryptography' or 'python'
+    :raises ValueError: if there is no working backend with the given name
+    """
+    global _backend
+    for backend in AEAD_BACKENDS:
+        if backend.name == name:
+            if backend is not PythonChaCha20Poly1305 and not verify_backend(backend):
+                raise ValueError('chacha20 poly1305 backend "{n}" failed its self test'.format(n=name))
+            _backend = backend
+            return
+    raise ValueError('chacha20 poly1305 backend "{n}" is not available'.format(n=name))
+
+
+def create_cipher(key: bytes):
+    """
+    Creates a cipher object for the given key using the currently selected backend. The object offers `encrypt(nonce,
+    plaintext, aad)` and `decrypt(nonce, data, aad)` and can be reused for multiple messages.
+
+    :param key: 256-bit (32-byte) key of type bytes
+    :return: the cipher object
+    """
+    return _backend(key)
 
 
 def chacha20_aead_encrypt(aad: bytes, key: bytes, iv: bytes, constant: bytes, plaintext: bytes):
@@ -270,18 +968,8 @@ def chacha20_aead_encrypt(aad: bytes, key: bytes, iv: bytes, constant: bytes, pl
     assert type(key) is bytes, 'key is no instance of bytes'
     assert len(key) == 32
 
-    nonce = constant + iv
-    otk = poly1305_key_gen(key, nonce)
-    ciphertext = chacha20_encrypt(key, 1, nonce, plaintext)
-    assert len(plaintext) == len(ciphertext)
-    mac_data = aad + pad16(aad)
-    assert len(mac_data) % 16 == 0
-    mac_data += ciphertext + pad16(ciphertext)
-    assert len(mac_data) % 16 == 0
-    mac_data += len(aad).to_bytes(length=8, byteorder='little')
-    mac_data += len(ciphertext).to_bytes(length=8, byteorder='little')
-    tag = poly1305_mac(mac_data, otk)
-    return ciphertext, tag
+    sealed = create_cipher(key).encrypt(constant + iv, plaintext, aad)
+    return bytearray(sealed[:-16]), sealed[-16:]
 
 
 def chacha20_aead_decrypt(aad: bytes, key: bytes, iv: bytes, constant: bytes, ciphertext: bytes):
@@ -300,13 +988,4 @@ def chacha20_aead_decrypt(aad: bytes, key: bytes, iv: bytes, constant: bytes, ci
     assert type(key) is bytes, 'key is no instance of bytes'
     assert len(key) == 32
 
-    # break up on difference
-    if not chacha20_aead_verify_tag(aad, key, iv, constant, ciphertext):
-        return False
-
-    # decrypt and return
-    ciphertext = ciphertext[:-16]
-    nonce = constant + iv
-    plaintext = chacha20_encrypt(key, 1, nonce, ciphertext)
-    assert len(plaintext) == len(ciphertext)
-    return plaintext
+    return create_cipher(key).decrypt(constant + iv, ciphertext, aad)
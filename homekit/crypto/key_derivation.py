@@ -0,0 +1,83 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import hmac
+
+
+class HkdfSha512:
+    """
+    HKDF with SHA-512 as described in RFC 5869 and used throughout the HAP specification (see chapter 5.6.1 page 56).
+
+    The pseudo random key is extracted once on creation and the keyed HMAC state is kept, so that several keys (e.g.
+    the read and the write key of a session) can be expanded from the same input key material without repeating the
+    extract step or the HMAC key setup.
+    """
+
+    HASH_LENGTH = 64
+
+    def __init__(self, salt: bytes, ikm: bytes):
+        """
+        :param salt: the salt as bytes
+        :param ikm: the input key material (e.g. a shared secret) as bytes
+        """
+        prk = hmac.new(bytes(salt), bytes(ikm), hashlib.sha512).digest()
+        self._hmac = hmac.new(prk, digestmod=hashlib.sha512)
+
+    def expand(self, info: bytes, length: int = 32) -> bytes:
+        """
+        Expands the pseudo random key for one label.
+
+        :param info: the label as bytes
+        :param length: the number of bytes to derive, at most 255 * 64
+        :return: the derived key as bytes
+        :raises ValueError: if length is too large
+        """
+        if length > 255 * self.HASH_LENGTH:
+            raise ValueError('Cannot expand to more than {} bytes'.format(255 * self.HASH_LENGTH))
+        okm = b''
+        block = b''
+        counter = 1
+        while len(okm) < length:
+            h = self._hmac.copy()
+            h.update(block + info + bytes([counter]))
+            block = h.digest()
+            okm += block
+            counter += 1
+        return okm[:length]
+
+    def expand_all(self, *infos, length: int = 32) -> tuple:
+        """
+        Expands the pseudo random key for several labels.
+
+        :param infos: the labels as bytes
+        :param length: the number of bytes to derive per label
+        :return: tuple of the derived keys in the order of the labels
+        """
+        return tuple(self.expand(info, length) for info in infos)
+
+
+def derive_keys(salt: bytes, ikm: bytes, *infos, length: int = 32) -> tuple:
+    """
+    Derives one key per label from the same salt and input key material with a single HKDF extract step.
+
+    :param salt: the salt as bytes
+    :param ikm: the input key material as bytes
+    :param infos: the labels as bytes
+    :param length: the number of bytes to derive per label
+    :return: tuple of the derived keys in the order of the labels
+    """
+    return HkdfSha512(salt, ikm).expand_all(*infos, length=length)
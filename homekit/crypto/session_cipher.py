@@ -0,0 +1,201 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import struct
+
+from homekit.crypto.chacha20poly1305 import create_cipher
+
+# the nonce of a session frame consists of 4 zero bytes followed by the 64 bit little endian message counter
+_NONCE = struct.Struct('<4xQ')
+
+
+class SessionCipher:
+    """
+    Holds the state to encrypt or decrypt one direction of a secured HAP session (controller to accessory or accessory
+    to controller). This is the session key, the message counter and a cipher object for the key. The counter
+    is increased after each sealed frame and after each frame that could be opened successfully. The cipher object is
+    created on first use and reused for all following frames.
+
+    This is used for the IP transport (see chapter 5.5.2 page 71 of the HAP specification) on the controller and the
+    accessory side and also for the BLE transport (see chapter 7.4.7.2 page 124).
+    """
+
+    # max length of the plain text of one frame of the IP transport (see page 71)
+    MAX_FRAME_LENGTH = 1024
+
+    def __init__(self, key: bytes, counter: int = 0):
+        """
+        :param key: the 256-bit session key as bytes
+        :param counter: the counter to use for the first frame
+        """
+        self.key = key
+        self.counter = counter
+        self._cipher = None
+        self._pack_nonce = _NONCE.pack
+
+    @property
+    def cipher(self):
+        """
+        :return: the cipher object of the selected ChaCha20-Poly1305 backend for the session key
+        """
+        if self._cipher is None:
+            self._cipher = create_cipher(self.key)
+        return self._cipher
+
+    def seal_frame(self, plaintext, aad: bytes = b'') -> bytes:
+        """
+        Encrypts and authenticates one frame using the current counter as nonce. The counter is increased afterwards.
+
+        :param plaintext: the data to encrypt as bytes, bytearray or memoryview
+        :param aad: the additional authenticated data (the 2 length bytes for IP, nothing for BLE)
+        :return: the cipher text with the 16 byte tag appended
+        """
+        sealed = self.cipher.encrypt(self._pack_nonce(self.counter), plaintext, aad)
+        self.counter += 1
+        return sealed
+
+    def open_frame(self, data, aad: bytes = b''):
+        """
+        Verifies and decrypts one frame using the current counter as nonce. The counter is only increased if the frame
+        could be verified.
+
+        :param data: the cipher text with the 16 byte tag appended
+        :param aad: the additional authenticated data (the 2 length bytes for IP, nothing for BLE)
+        :return: False if the tag could not be verified or the plaintext as bytes
+        """
+        plaintext = self.cipher.decrypt(self._pack_nonce(self.counter), data, aad)
+        if plaintext is not False:
+            self.counter += 1
+        return plaintext
+
+    @classmethod
+    def frames_length(cls, length: int) -> int:
+        """
+        Computes the number of bytes required to transmit length bytes of plain text as HAP frames.
+
+        :param length: the length of the plain text
+        :return: the length including all 2 byte length prefixes and 16 byte tags
+        """
+        return length + 18 * ((length + cls.MAX_FRAME_LENGTH - 1) // cls.MAX_FRAME_LENGTH)
+
+    def encrypt_into(self, dst, src) -> int:
+        """
+        Splits src into frames of at most 1024 bytes and seals them as one batch directly into dst. Each frame is
+        prefixed by its 2 byte little endian length which is also used as additional authenticated data (see page 71).
+
+        :param dst: writable buffer (e.g. bytearray or memoryview) with at least frames_length(len(src)) bytes
+        :param src: the data to encrypt as bytes, bytearray or memoryview
+        :return: the number of bytes written to dst
+        """
+        src = memoryview(src)
+        dst = memoryview(dst)
+        nonces = []
+        blocks = []
+        aads = []
+        bufs = []
+        position = 0
+        for start in range(0, len(src), self.MAX_FRAME_LENGTH):
+            block = src[start:start + self.MAX_FRAME_LENGTH]
+            length = len(block)
+            len_bytes = length.to_bytes(2, byteorder='little')
+            dst[position:position + 2] = len_bytes
+            nonces.append(self._pack_nonce(self.counter + len(nonces)))
+            blocks.append(block)
+            aads.append(len_bytes)
+            bufs.append(dst[position + 2:position + 18 + length])
+            position += length + 18
+        self.cipher.encrypt_batch_into(nonces, blocks, aads, bufs)
+        self.counter += len(nonces)
+        return position
+
+    def decrypt_into(self, dst, src):
+        """
+        Verifies and decrypts consecutive HAP frames (each consisting of 2 length bytes, cipher text and tag) from src
+        directly into dst.
+
+        :param dst: writable buffer (e.g. bytearray or memoryview) large enough for the plain text of all frames
+        :param src: complete frames as bytes, bytearray or memoryview
+        :return: False if a frame could not be verified or the number of bytes written to dst
+        :raises ValueError: if src ends with an incomplete frame
+        """
+        src = memoryview(src)
+        dst = memoryview(dst)
+        cipher = self.cipher
+        position = 0
+        written = 0
+        while position < len(src):
+            len_bytes = bytes(src[position:position + 2])
+            length = int.from_bytes(len_bytes, byteorder='little')
+            end = position + 18 + length
+            if len(len_bytes) < 2 or end > len(src):
+                raise ValueError('incomplete frame')
+            if not cipher.decrypt_into(self._pack_nonce(self.counter), src[position + 2:end], len_bytes,
+                                       dst[written:written + length]):
+                return False
+            self.counter += 1
+            written += length
+            position = end
+        return written
+
+    def open_frames(self, data):
+        """
+        Verifies and decrypts all complete HAP frames at the start of data as one batch using consecutive counters. An
+        incomplete frame at the end of data is left untouched, so data can be a receive buffer that contains N complete
+        frames followed by the beginning of the next one.
+
+        :param data: the received bytes as bytes, bytearray or memoryview
+        :return: a tuple of the list of plain text segments (one per frame) and the number of bytes consumed from data.
+                 If a frame could not be verified, False is returned instead of the list.
+        """
+        data = memoryview(data)
+        available = len(data)
+        nonces = []
+        frames = []
+        aads = []
+        ends = []
+        position = 0
+        while position + 2 <= available:
+            len_bytes = bytes(data[position:position + 2])
+            end = position + 18 + int.from_bytes(len_bytes, byteorder='little')
+            if end > available:
+                break
+            nonces.append(self._pack_nonce(self.counter + len(nonces)))
+            frames.append(data[position + 2:end])
+            aads.append(len_bytes)
+            ends.append(end)
+            position = end
+
+        segments = []
+        position = 0
+        for plaintext, end in zip(self.cipher.decrypt_batch(nonces, frames, aads), ends):
+            if plaintext is False:
+                return False, position
+            self.counter += 1
+            segments.append(plaintext)
+            position = end
+        return segments, position
+
+    def seal_frames(self, data) -> bytearray:
+        """
+        Splits the data into frames of at most 1024 bytes and seals each of them into one buffer that is allocated
+        once. See encrypt_into.
+
+        :param data: the data to encrypt as bytes, bytearray or memoryview
+        :return: the concatenated frames ready to be sent
+        """
+        buffer = bytearray(self.frames_length(len(data)))
+        self.encrypt_into(buffer, data)
+        return buffer
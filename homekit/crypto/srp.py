@@ -25,12 +25,11 @@ import hashlib
 import os
 
 
-class Srp:
-    def __init__(self):
-        # generator as defined by 3072bit group of RFC 5054
-        self.g = int(b'5', 16)
-        # modulus as defined by 3072bit group of RFC 5054
-        self.n = int(b'''\
+# generator as defined by 3072bit group of RFC 5054
+SRP_GENERATOR = 5
+
+# modulus as defined by 3072bit group of RFC 5054
+SRP_MODULUS = int(b'''\
 FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E08\
 8A67CC74020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B\
 302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9\
@@ -45,6 +44,21 @@ B3970F85A6E1E4C7ABF5AE8CDB0933D71E8C94E04A25619DCEE3D226\
 1AD2EE6BF12FFA06D98A0864D87602733EC86A64521F2B18177B200C\
 BBE117577A615D6C770988C0BAD946E208E24FA074E5AB3143DB5BFC\
 E0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF''', 16)
+
+_MODULUS_BYTES = SRP_MODULUS.to_bytes(384, 'big')
+
+# k = H(N | PAD(g)) (see https://tools.ietf.org/html/rfc5054#section-2.5.3), HomeKit requires SHA-512 (See page 36)
+_K = int.from_bytes(hashlib.sha512(_MODULUS_BYTES + SRP_GENERATOR.to_bytes(384, 'big')).digest(), 'big')
+
+# H(N) xor H(g) as used in the proof of the client
+_HN_XOR_HG = bytes(a ^ b for (a, b) in zip(hashlib.sha512(_MODULUS_BYTES).digest(),
+                                           hashlib.sha512(bytes([SRP_GENERATOR])).digest()))
+
+
+class Srp:
+    def __init__(self):
+        self.g = SRP_GENERATOR
+        self.n = SRP_MODULUS
         # HomeKit requires SHA-512 (See page 36)
         self.h = hashlib.sha512
         self.A = None
@@ -52,6 +66,7 @@ E0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF''', 16)
         self.salt = None
         self.username = None
         self.password = None
+        self._shared_secret = None
 
     @staticmethod
     def generate_private_key():
@@ -66,14 +81,8 @@ E0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF''', 16)
         return int.from_bytes(os.urandom(16), byteorder="big")
 
     def _calculate_k(self) -> int:
-        # calculate k (see https://tools.ietf.org/html/rfc5054#section-2.5.3)
-        hash_instance = self.h()
-        n = Srp.to_byte_array(self.n)
-        g = bytearray.fromhex((383 * '00' + '05'))  # 383 * b'0' + '5'.encode()
-        hash_instance.update(n)
-        hash_instance.update(g)
-        k = int.from_bytes(hash_instance.digest(), "big")
-        return k
+        # k is computed once on module level (see https://tools.ietf.org/html/rfc5054#section-2.5.3)
+        return _K
 
     def _calculate_u(self) -> int:
         if self.A is None:
@@ -89,8 +98,10 @@ E0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF''', 16)
         return u
 
     def get_session_key(self) -> int:
+        if self._shared_secret is None:
+            self._shared_secret = self.get_shared_secret()
         hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.get_shared_secret()))
+        hash_instance.update(Srp.to_byte_array(self._shared_secret))
         hash_value = int.from_bytes(hash_instance.digest(), "big")
         return hash_value
 
@@ -133,15 +144,17 @@ class SrpClient(Srp):
             self.salt = int.from_bytes(salt, "big")
         else:
             self.salt = salt
+        self._shared_secret = None
 
     def get_public_key(self):
-        return pow(self.g, self.a, self.n)
+        return self.A
 
     def set_server_public_key(self, B):
         if isinstance(B, bytearray) or isinstance(B, bytes):
             self.B = int.from_bytes(B, "big")
         else:
             self.B = B
+        self._shared_secret = None
 
     def get_shared_secret(self):
         if self.B is None:
@@ -158,17 +171,6 @@ class SrpClient(Srp):
         if self.B is None:
             raise RuntimeError('Server\'s public key is missing')
 
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.n))
-        hN = bytearray(hash_instance.digest())
-
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.g))
-        hg = bytearray(hash_instance.digest())
-
-        for index in range(0, len(hN)):
-            hN[index] ^= hg[index]
-
         u = self.username.encode()
         hash_instance = self.h()
         hash_instance.update(u)
@@ -176,7 +178,7 @@ class SrpClient(Srp):
         K = Srp.to_byte_array(self.get_session_key())
 
         hash_instance = self.h()
-        hash_instance.update(hN)
+        hash_instance.update(_HN_XOR_HG)
         hash_instance.update(hu)
         hash_instance.update(Srp.to_byte_array(self.salt))
         hash_instance.update(Srp.to_byte_array(self.A))
@@ -201,16 +203,24 @@ class SrpServer(Srp):
     Implements all functions that are required to simulate an iOS HomeKit accessory
     """
 
-    def __init__(self, username, password):
+    def __init__(self, username, password, salt: int = None, verifier: int = None):
+        """
+        Creates the server side of a SRP session. Salt and verifier only depend on username and password, so they can
+        be stored and passed in again to save the expensive computation of the verifier (see get_salt and
+        get_verifier).
+
+        :param username: the SRP username (always 'Pair-Setup' for HomeKit)
+        :param password: the setup code
+        :param salt: the salt as int, a random salt is created if this is None
+        :param verifier: the verifier belonging to username, password and salt as int, computed if this is None
+        """
         Srp.__init__(self)
         self.username = username
-        self.salt = SrpServer._create_salt()
+        self.salt = SrpServer._create_salt() if salt is None else salt
         self.password = password
-        self.verifier = self._get_verifier()
+        self.verifier = self._get_verifier() if verifier is None else verifier
         self.b = self.generate_private_key()
-        k = self._calculate_k()
-        g_b = pow(self.g, self.b, self.n)
-        self.B = (k * self.verifier + g_b) % self.n
+        self.B = (_K * self.verifier + pow(self.g, self.b, self.n)) % self.n
         self.A = None
 
     @staticmethod
@@ -227,13 +237,16 @@ class SrpServer(Srp):
 
     def set_client_public_key(self, A):
         self.A = A
+        self._shared_secret = None
 
     def get_salt(self):
         return self.salt
 
+    def get_verifier(self):
+        return self.verifier
+
     def get_public_key(self):
-        k = self._calculate_k()
-        return (k * self.verifier + pow(self.g, self.b, self.n)) % self.n
+        return self.B
 
     def get_shared_secret(self):
         if self.A is None:
@@ -246,17 +259,6 @@ class SrpServer(Srp):
         if self.B is None:
             raise RuntimeError('Server\'s public key is missing')
 
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.n))
-        hN = bytearray(hash_instance.digest())
-
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.g))
-        hg = bytearray(hash_instance.digest())
-
-        for index in range(0, len(hN)):
-            hN[index] ^= hg[index]
-
         u = self.username.encode()
         hash_instance = self.h()
         hash_instance.update(u)
@@ -264,7 +266,7 @@ class SrpServer(Srp):
         K = Srp.to_byte_array(self.get_session_key())
 
         hash_instance = self.h()
-        hash_instance.update(hN)
+        hash_instance.update(_HN_XOR_HG)
         hash_instance.update(hu)
         hash_instance.update(Srp.to_byte_array(self.salt))
         hash_instance.update(Srp.to_byte_array(self.A))
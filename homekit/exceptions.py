@@ -205,6 +205,26 @@ class AccessoryDisconnectedError(HomeKitException):
         Exception.__init__(self, message)
 
 
+class ConnectionLimitError(HomeKitException):
+    """
+    Used if no session to an accessory could be opened in time because the connection limits of the controller's
+    ConnectionManager are reached and all open sessions are in use.
+    """
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+class CircuitOpenError(AccessoryDisconnectedError):
+    """
+    Used if calls to an accessory fail fast because its recent connection attempts failed (see RetryPolicy). Calls are
+    attempted again after the reset timeout of the circuit breaker.
+    """
+
+    def __init__(self, message):
+        AccessoryDisconnectedError.__init__(self, message)
+
+
 class ConfigLoadingError(HomeKitException):
     """
     Used on problems loading some config. This includes but may not be limited to:
@@ -15,10 +15,11 @@
 #
 
 __all__ = [
-    'HomeKitHTTPConnection', 'HttpContentTypes', 'HttpStatusCodes'
+    'HomeKitHTTPConnection', 'HttpContentTypes', 'HttpStatusCodes', 'HapFrameDecoder'
 ]
 
 from homekit.http_impl.http_client import HomeKitHTTPConnection
+from homekit.http_impl.frame_decoder import HapFrameDecoder
 
 
 class _HttpContentTypes:
@@ -0,0 +1,154 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from homekit.crypto.session_cipher import SessionCipher
+from homekit import exceptions
+
+# size of the largest frame on the wire: 2 length bytes, 1024 bytes of cipher text and the 16 byte tag
+MAX_FRAME_SIZE = SessionCipher.frames_length(SessionCipher.MAX_FRAME_LENGTH)
+
+
+class HapFrameDecoder:
+    """
+    Reassembles and decrypts the frames of one direction of a secured HAP session (see chapter 5.5.2 page 71).
+
+    Received data is written directly into one preallocated buffer (via recv_into, readinto1 or the get_buffer /
+    buffer_updated pair of asyncio.BufferedProtocol). Read and write offsets track the unprocessed data, so complete
+    frames are decrypted in place. Only the remainder of an incomplete frame is moved to the front of the buffer once
+    the free space at the end runs out.
+    """
+
+    DEFAULT_BUFFER_SIZE = 65536
+
+    def __init__(self, cipher: SessionCipher, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        """
+        :param cipher: the SessionCipher used to open the frames
+        :param buffer_size: the initial size of the receive buffer, at least one frame of maximum size
+        """
+        self.cipher = cipher
+        self._buffer = bytearray(max(buffer_size, MAX_FRAME_SIZE))
+        self._start = 0
+        self._end = 0
+
+    @property
+    def pending(self) -> int:
+        """
+        :return: the number of received bytes that were not yet decoded
+        """
+        return self._end - self._start
+
+    def has_frame(self) -> bool:
+        """
+        :return: True if at least one complete frame is waiting to be decoded
+        """
+        if self._end - self._start < 2:
+            return False
+        length = int.from_bytes(self._buffer[self._start:self._start + 2], byteorder='little')
+        return self._end - self._start >= length + 18
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """
+        Returns the free part of the receive buffer. The receive buffer is compacted or enlarged so at least one frame
+        of maximum size (or sizehint bytes if this is larger) fits. After writing into the buffer, buffer_updated must
+        be called with the number of bytes written.
+
+        :param sizehint: the minimum number of bytes the caller wants to write
+        :return: a writable memoryview of the free space
+        """
+        required = max(sizehint, MAX_FRAME_SIZE)
+        if len(self._buffer) - self._end < required:
+            pending = self._end - self._start
+            if len(self._buffer) < pending + required:
+                # a bytearray cannot be resized while views of it exist, so a new buffer is allocated
+                buffer = bytearray(max(2 * len(self._buffer), pending + required))
+                buffer[:pending] = self._buffer[self._start:self._end]
+                self._buffer = buffer
+            elif pending:
+                self._buffer[:pending] = self._buffer[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        return memoryview(self._buffer)[self._end:]
+
+    def buffer_updated(self, nbytes: int):
+        """
+        Marks nbytes written to the view returned by get_buffer as received.
+
+        :param nbytes: the number of bytes written
+        """
+        self._end += nbytes
+
+    def feed(self, data):
+        """
+        Copies received data (e.g. from an asyncio stream) into the receive buffer.
+
+        :param data: the received bytes as bytes, bytearray or memoryview
+        """
+        length = len(data)
+        if length:
+            self.get_buffer(length)[:length] = data
+            self.buffer_updated(length)
+
+    def receive_from(self, source):
+        """
+        Receives once from a socket (using recv_into) or a buffered binary stream (using readinto1) directly into the
+        receive buffer. This works with blocking and non-blocking sockets.
+
+        :param source: a socket or a binary stream like the one returned by socket.makefile('rb')
+        :return: the number of bytes received, 0 if the peer closed the connection or None if a non-blocking source had
+                 no data available
+        """
+        view = self.get_buffer()
+        try:
+            if hasattr(source, 'recv_into'):
+                received = source.recv_into(view)
+            else:
+                received = source.readinto1(view)
+        except BlockingIOError:
+            received = None
+        if received:
+            self.buffer_updated(received)
+        return received
+
+    async def receive_from_stream(self, reader) -> int:
+        """
+        Receives once from an asyncio.StreamReader into the receive buffer.
+
+        :param reader: the asyncio.StreamReader of the connection
+        :return: the number of bytes received, 0 if the peer closed the connection
+        """
+        data = await reader.read(len(self.get_buffer()))
+        self.feed(data)
+        return len(data)
+
+    def decode(self) -> list:
+        """
+        Verifies and decrypts all complete frames in the receive buffer as one batch. An incomplete frame at the end is
+        kept until the rest of it was received.
+
+        :return: the list of plain text segments, one per frame, in the order they were received
+        :raises EncryptionError: if a frame could not be verified
+        """
+        if self._end - self._start < 2:
+            return []
+        segments, consumed = self.cipher.open_frames(memoryview(self._buffer)[self._start:self._end])
+        if segments is False:
+            raise exceptions.EncryptionError('Error during transmission.')
+        self._start += consumed
+        if self._start == self._end:
+            # everything was consumed, so start over at the beginning of the buffer without moving data
+            self._start = 0
+            self._end = 0
+        return segments
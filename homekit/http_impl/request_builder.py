@@ -0,0 +1,55 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+class RequestBuilder:
+    """
+    Assembles the HTTP requests sent to one accessory. The static parts (the Host header and the content type headers)
+    are only encoded once and the body is appended as it is.
+    """
+
+    def __init__(self, host, port, content_types=()):
+        """
+        :param host: the IP of the accessory as used in the Host header
+        :param port: the port of the accessory as used in the Host header
+        :param content_types: content types to prepare the headers for, others are prepared on first use
+        """
+        self._request_line_end = ' HTTP/1.1\r\nHost: {host}:{port}\r\n'.format(host=host, port=port).encode()
+        self._content_headers = {}
+        for content_type in content_types:
+            self._get_content_headers(content_type)
+
+    def _get_content_headers(self, content_type):
+        content_headers = self._content_headers.get(content_type)
+        if content_headers is None:
+            content_headers = 'Content-Type: {ct}\r\nContent-Length: '.format(ct=content_type).encode()
+            self._content_headers[content_type] = content_headers
+        return content_headers
+
+    def build(self, method, target, body=None, content_type=None):
+        """
+        :param method: the HTTP method as bytes, e.g. b'GET'
+        :param target: the target of the request as str, e.g. /characteristics?id=1.10
+        :param body: the body as str (encoded as UTF-8) or bytes or None for requests without body
+        :param content_type: the content of the content-type header, used only if there is a body
+        :return: the request as bytes
+        """
+        if body is None:
+            return b''.join((method, b' ', target.encode(), self._request_line_end, b'\r\n'))
+        if isinstance(body, str):
+            body = body.encode()
+        return b''.join((method, b' ', target.encode(), self._request_line_end, self._get_content_headers(content_type),
+                         str(len(body)).encode(), b'\r\n\r\n', body))
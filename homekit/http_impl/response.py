@@ -18,6 +18,13 @@ from homekit.exceptions import HttpException
 
 
 class HttpResponse(object):
+    """
+    Incremental parser for HTTP responses (and HAP events, see chapter 6.8 page 87) that are received in parts.
+
+    All received parts are appended to one buffer and a read cursor marks the beginning of the unparsed data, so
+    nothing is copied when a line is consumed. Body data (also of chunked responses) is appended to the body through
+    memoryview slices of that buffer.
+    """
     STATE_PRE_STATUS = 0
     STATE_HEADERS = 1
     STATE_BODY = 2
@@ -26,10 +33,12 @@ class HttpResponse(object):
     def __init__(self):
         self._state = HttpResponse.STATE_PRE_STATUS
         self._raw_response = bytearray()
+        self._position = 0
         self._is_ready = False
         self._is_chunked = False
         self._had_empty_chunk = False
         self._content_length = -1
+        self._header_values = {}
         self.version = None
         self.code = None
         self.reason = None
@@ -37,11 +46,47 @@ class HttpResponse(object):
         self.body = bytearray()
 
     def parse(self, part):
-        self._raw_response += part
-        pos = self._raw_response.find(b'\r\n')
-        while pos != -1:
-            line = self._raw_response[:pos]
-            self._raw_response = self._raw_response[pos + 2:]
+        """
+        Parses the next part of the response.
+
+        :param part: the received data as bytes, bytearray or memoryview
+        :return: the data following the end of the response (e.g. the beginning of an event) once the response was
+                 read completely, else an empty bytearray
+        :raises HttpException: if the status line is malformed
+        """
+        raw = self._raw_response
+        raw += part
+        position = self._position
+        while self._state != HttpResponse.STATE_DONE:
+            if self._state == HttpResponse.STATE_BODY and not self._is_chunked:
+                if self._content_length > 0:
+                    remaining = self._content_length - len(self.body)
+                    end = min(position + remaining, len(raw))
+                    self.body += memoryview(raw)[position:end]
+                    position = end
+                break
+
+            pos = raw.find(b'\r\n', position)
+            if pos == -1:
+                break
+
+            if self._state == HttpResponse.STATE_BODY:
+                # the line is the size of the next chunk (in hex, maybe followed by extensions)
+                length = int(raw[position:pos].split(b';', 1)[0], 16)
+                start = pos + 2
+                if start + length + 2 > len(raw):
+                    # the remaining bytes in raw response are not sufficient. bail out and wait for an other call.
+                    break
+                if length == 0:
+                    self._had_empty_chunk = True
+                    self._state = HttpResponse.STATE_DONE
+                else:
+                    self.body += memoryview(raw)[start:start + length]
+                position = start + length + 2
+                continue
+
+            line = bytes(raw[position:pos])
+            position = pos + 2
             if self._state == HttpResponse.STATE_PRE_STATUS:
                 # parse status line
                 line = line.split(b' ', 2)
@@ -52,56 +97,50 @@ class HttpResponse(object):
                 self.reason = line[2].decode()
                 self._state = HttpResponse.STATE_HEADERS
 
-            elif self._state == HttpResponse.STATE_HEADERS and line == b'':
+            elif line == b'':
                 # this is the empty line after the headers
                 self._state = HttpResponse.STATE_BODY
 
-            elif self._state == HttpResponse.STATE_HEADERS:
+            else:
                 # parse a header line
                 line = line.split(b':', 1)
                 name = line[0].decode()
                 value = line[1].decode().strip()
-                if name == 'Transfer-Encoding':
+                lower_name = name.lower()
+                if lower_name == 'transfer-encoding':
                     if value == 'chunked':
                         self._is_chunked = True
-                elif name == 'Content-Length':
+                elif lower_name == 'content-length':
                     self._content_length = int(value)
                 self.headers.append((name, value))
-
-            elif self._state == HttpResponse.STATE_BODY:
-                if self._is_chunked:
-                    length = int(line, 16)
-                    if length + 2 > len(self._raw_response):
-                        self._raw_response = line + b'\r\n' + self._raw_response
-                        # the remaining bytes in raw response are not sufficient. bail out and wait for an other call.
-                        break
-                    if length == 0:
-                        self._had_empty_chunk = True
-                        self._state = HttpResponse.STATE_DONE
-                        self._raw_response = self._raw_response[length + 2:]
-                    else:
-                        line = self._raw_response[:length]
-                        self.body += line
-                        self._raw_response = self._raw_response[length + 2:]
-                if self._content_length > -1:
-                    self.body += self._raw_response
-                    self._raw_response = bytearray()
-            else:
-                raise HttpException('Unknown parser state')
-
-            pos = self._raw_response.find(b'\r\n')
-
-        if self._state == HttpResponse.STATE_BODY and self._content_length > 0:
-            remaining = self._content_length - len(self.body)
-            self.body += self._raw_response[:remaining]
-            self._raw_response = self._raw_response[remaining:]
+                self._header_values[lower_name] = value
 
         if self.is_read_completely():
             # Whatever is left in the buffer is part of the next request
-            return self._raw_response
-
+            remaining = raw[position:]
+            self._raw_response = bytearray()
+            self._position = 0
+            return remaining
+
+        if position > len(raw) // 2:
+            # drop the parsed data once it makes up the larger part of the buffer, so the buffer does not grow
+            # with the size of the response while each byte is moved only a few times
+            del raw[:position]
+            position = 0
+        self._position = position
         return bytearray()
 
+    def get_header(self, name, default=None):
+        """
+        Returns the value of a header. Header names are case insensitive. If the header was sent more than once, the
+        last value is returned.
+
+        :param name: the name of the header (e.g. 'Content-Type')
+        :param default: the value to return if the header was not sent
+        :return: the value of the header or the default
+        """
+        return self._header_values.get(name.lower(), default)
+
     def read(self):
         """
         Returns the body of the response.
@@ -16,161 +16,495 @@
 
 import threading
 import select
+import socket
 import logging
+import time
+import queue
+from collections import deque
+from concurrent.futures import Future, TimeoutError
 
 from homekit.http_impl.response import HttpResponse
-from homekit.crypto.chacha20poly1305 import chacha20_aead_encrypt, chacha20_aead_decrypt
+from homekit.crypto.session_cipher import SessionCipher
+from homekit.http_impl.frame_decoder import HapFrameDecoder
+from homekit.http_impl.request_builder import RequestBuilder
 from homekit.http_impl import HttpContentTypes
 from homekit import exceptions
 
 
+class PipelinedResponse(Future):
+    """
+    The future response of a request sent by SecureHttp.submit. The accessory answers the requests of a session in the
+    order they were sent, so waiting for this response also reads the responses of all requests sent before it and
+    resolves their futures (calling their done callbacks in the waiting thread).
+    """
+
+    def __init__(self, secure_http):
+        Future.__init__(self)
+        self._secure_http = secure_http
+
+    def result(self, timeout=None):
+        """
+        :param timeout: the overall number of seconds to wait for the response, including the time waiting for another
+                        thread that is currently reading responses, or None to wait as long as the session allows
+        :return: the HttpResponse
+        :raises AccessoryDisconnectedError: if the connection broke before the response was read completely
+        :raises EncryptionError: if a frame of the response could not be verified
+        :raises TimeoutError: if the response was not read within timeout seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._secure_http._receive_responses(self, deadline)
+        return Future.result(self, _remaining(deadline))
+
+    def exception(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._secure_http._receive_responses(self, deadline)
+        return Future.exception(self, _remaining(deadline))
+
+
+def _remaining(deadline):
+    """
+    :param deadline: the time.monotonic() value to wait until or None to wait without limit
+    :return: the number of seconds left until the deadline (at least 0) or None
+    """
+    if deadline is None:
+        return None
+    return max(0, deadline - time.monotonic())
+
+
 class SecureHttp:
     """
     Class to help in the handling of HTTP requests and responses that are performed following chapter 5.5 page 70ff of
     the HAP specification.
+
+    By default each request waits for its response before the next request is sent. In pipelined mode, requests are
+    written back to back and the responses are matched to the requests in FIFO order. Not all accessories can handle
+    this, so it has to be enabled per pairing.
     """
 
-    def __init__(self, session, timeout=10):
+    # size of the receive buffer of the frame decoder
+    RECEIVE_SIZE = 32768
+
+    def __init__(self, session, timeout=10, pipelining=False):
         """
         Initializes the secure HTTP class. The required keys can be obtained with get_session_keys
 
-        :param sock: the socket over which the communication takes place
-        :param a2c_key: the key used for the communication between accessory and controller
-        :param c2a_key: the key used for the communication between controller and accessory
+        :param session: the session providing the socket and the keys for both directions
+        :param timeout: the number of seconds to wait for a response
+        :param pipelining: if True, requests are sent without waiting for the responses of earlier requests
         """
         self.sock = session.sock
         self.host = session.pairing_data['AccessoryIP']
         self.port = session.pairing_data['AccessoryPort']
         self.a2c_key = session.a2c_key
         self.c2a_key = session.c2a_key
-        self.c2a_counter = 0
-        self.a2c_counter = 0
+        self.c2a_cipher = SessionCipher(self.c2a_key)
+        self.a2c_cipher = SessionCipher(self.a2c_key)
         self.timeout = timeout
+        # the static parts of all requests of this session are only encoded once
+        self._requests = RequestBuilder(self.host, self.port, (HttpContentTypes.JSON, HttpContentTypes.TLV))
+        # reads only happen once select reported data, so the timeout just bounds blocking sends
+        self.sock.settimeout(timeout)
+        self.pipelining = pipelining
+        if pipelining:
+            # requests are written back to back, so they must not wait for the acknowledgement of the previous one
+            try:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+        # in pipelined mode, this lock is only held while reading responses and the send lock guards the writes
         self.lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        # notified when a response was dispatched or the lock was released, so waiting threads need not take the lock
+        self._read_condition = threading.Condition()
+        # futures of the pipelined requests that were sent but whose responses were not read yet
+        self._pending = deque()
+        # the background reader started by start_reader and the functions events are passed to
+        self._reader = None
+        self._event_listeners = []
+        self._event_queue = None
+        # collects the received cipher text until complete frames are available
+        self._decoder = HapFrameDecoder(self.a2c_cipher, self.RECEIVE_SIZE)
+        # decrypted data that was received after the end of the last response
+        self._plaintext = bytearray()
+        # the response that was read partially when the deadline of a waiting caller passed or the reader stopped
+        self._partial = None
 
     def get(self, target):
-        data = 'GET {tgt} HTTP/1.1\nHost: {host}:{port}\n\n'.format(tgt=target, host=self.host, port=self.port)
-        data = data.replace("\n", "\r\n")
-        return self._handle_request(data.encode())
+        return self._handle_request(self._build_request(b'GET', target))
 
     def put(self, target, body, content_type=HttpContentTypes.JSON):
-        headers = 'Host: {host}:{port}\n'.format(host=self.host, port=self.port) + \
-                  'Content-Type: {ct}\n'.format(ct=content_type) + \
-                  'Content-Length: {len}\n'.format(len=len(body))
-        data = 'PUT {tgt} HTTP/1.1\n{hdr}\n{body}'.format(tgt=target, hdr=headers, body=body)
-        data = data.replace("\n", "\r\n")
-        return self._handle_request(data.encode())
+        return self._handle_request(self._build_request(b'PUT', target, body, content_type))
 
     def post(self, target, body, content_type=HttpContentTypes.TLV):
-        headers = 'Host: {host}:{port}\n'.format(host=self.host, port=self.port) + \
-                  'Content-Type: {ct}\n'.format(ct=content_type) + \
-                  'Content-Length: {len}\n'.format(len=len(body))
-        data = 'POST {tgt} HTTP/1.1\n{hdr}\n'.format(tgt=target, hdr=headers)
-        data = data.replace("\n", "\r\n")
-        return self._handle_request(data.encode() + body)
+        return self._handle_request(self._build_request(b'POST', target, body, content_type))
+
+    def _build_request(self, method, target, body=None, content_type=HttpContentTypes.JSON):
+        return self._requests.build(method, target, body, content_type)
+
+    def submit(self, method, target, body=None, content_type=HttpContentTypes.JSON, callback=None):
+        """
+        Sends a request and returns the future of its response. In pipelined mode this returns as soon as the request
+        was written, otherwise the response was already read when this returns.
+
+        :param method: the HTTP method, e.g. GET or PUT
+        :param target: the target of the request, e.g. /characteristics?id=1.10
+        :param body: the body as str or bytes or None for requests without body
+        :param content_type: the content of the content-type header, used only if there is a body
+        :param callback: optional function called with the future as soon as the response was read. In pipelined
+                         mode, this runs the background reader (see start_reader) until the response was read, so it
+                         is read even if nobody waits for the future.
+        :return: a concurrent.futures.Future with the HttpResponse as result
+        :raises AccessoryDisconnectedError: if the request could not be sent
+        """
+        data = self._build_request(method.encode(), target, body, content_type)
+
+        if self.pipelining:
+            future = self._send_pipelined(data)
+            if callback:
+                # the request is sent first, so the reader does not stop before it is pending
+                self.start_reader()
+        else:
+            future = Future()
+            future.set_result(self._handle_request(data))
+        if callback:
+            future.add_done_callback(callback)
+        return future
 
     def _handle_request(self, data):
         logging.debug('handle request: %s', data)
-        with self.lock:
-            while len(data) > 0:
-                # split the data to max 1024 bytes (see page 71)
-                len_data = min(len(data), 1024)
-                tmp_data = data[:len_data]
-                data = data[len_data:]
-                len_bytes = len_data.to_bytes(2, byteorder='little')
-                cnt_bytes = self.c2a_counter.to_bytes(8, byteorder='little')
-                self.c2a_counter += 1
-                ciper_and_mac = chacha20_aead_encrypt(len_bytes, self.c2a_key, cnt_bytes, bytes([0, 0, 0, 0]),
-                                                      tmp_data)
+        if self.pipelining:
+            return self._wait(self._send_pipelined(data))
+        self.lock.acquire()
+        try:
+            if self._reader is not None:
+                # the background reader resolves the future, the lock keeps one request in flight
+                return self._wait(self._send_pipelined(data))
+
+            # the data is split into frames of max 1024 bytes (see page 71) which are sent at once
+            try:
+                self.sock.sendall(self.c2a_cipher.seal_frames(data))
+            except OSError as e:
+                raise exceptions.AccessoryDisconnectedError(str(e))
+
+            while True:
+                # the background reader may have stopped in the middle of a message
+                response = self._read_response(self.timeout, self._partial)
+                self._partial = None
+                if response.get_http_name() != 'EVENT' or not response.is_read_completely():
+                    return response
+                # an event that arrived before the response
+                self._dispatch_event(response)
+        finally:
+            self._release_lock()
+
+    def _wait(self, future):
+        """
+        Waits for the response of a request sent with _send_pipelined.
+
+        :param future: the PipelinedResponse of the request
+        :return: the HttpResponse
+        :raises AccessoryDisconnectedError: if the connection broke or the accessory did not answer in time
+        """
+        try:
+            return future.result(self.timeout if self._reader is not None else None)
+        except TimeoutError:
+            # the following responses cannot be matched anymore, so the connection is unusable
+            error = exceptions.AccessoryDisconnectedError('No complete response within {t} seconds'
+                                                          .format(t=self.timeout))
+            self._fail_pending(error)
+            raise error
+
+    def _send_pipelined(self, data):
+        """
+        Sends a request without waiting for the responses of the requests sent before.
 
+        :param data: the plain text request as bytes
+        :return: the PipelinedResponse of the request
+        :raises AccessoryDisconnectedError: if the request could not be sent
+        """
+        future = PipelinedResponse(self)
+        with self._send_lock:
+            # the order of the queue must match the order on the wire and the response may arrive before sendall
+            # returns
+            self._pending.append(future)
+            try:
+                self.sock.sendall(self.c2a_cipher.seal_frames(data))
+            except OSError as e:
+                if future in self._pending:
+                    self._pending.remove(future)
+                raise exceptions.AccessoryDisconnectedError(str(e))
+        return future
+
+    def _receive_responses(self, future, deadline=None):
+        """
+        Reads responses of pipelined requests in the order the requests were sent until the given future is resolved.
+        Only one thread reads at a time, the others wait until the reading thread resolved their futures or released
+        the lock, so a thread returns as soon as its response was read, even if the reading thread waits for a later
+        one. Nothing is read here while the background reader runs.
+
+        If the deadline passes while a response is read, the part read so far is kept for the next reading thread.
+        Only if the accessory does not complete a response within the timeout of the session, the connection is
+        considered broken.
+
+        :param future: the PipelinedResponse to wait for
+        :param deadline: the time.monotonic() value to stop waiting at or None to wait as long as required
+        """
+        with self._read_condition:
+            while True:
+                if future.done() or self._reader is not None:
+                    return
+                if self.lock.acquire(blocking=False):
+                    break
+                remaining = _remaining(deadline)
+                if remaining == 0 or not self._read_condition.wait(remaining):
+                    return
+        try:
+            while not future.done() and self._reader is None:
+                remaining = _remaining(deadline)
+                if remaining == 0:
+                    return
                 try:
-                    self.sock.send(len_bytes + ciper_and_mac[0] + ciper_and_mac[1])
-                except OSError as e:
-                    raise exceptions.AccessoryDisconnectedError(str(e))
+                    if remaining is not None and remaining < self.timeout:
+                        response = self._read_response(remaining, self._partial)
+                        if not response.is_read_completely():
+                            # the caller gives up, the accessory may still complete the response
+                            self._partial = response
+                            return
+                    else:
+                        response = self._read_response(self.timeout, self._partial)
+                    self._partial = None
+                    if not response.is_read_completely():
+                        # the following responses cannot be matched anymore, so the connection is unusable
+                        raise exceptions.AccessoryDisconnectedError('No complete response within {t} seconds'
+                                                                    .format(t=self.timeout))
+                except (exceptions.AccessoryDisconnectedError, exceptions.EncryptionError) as e:
+                    self._fail_pending(e)
+                    return
+                self._dispatch(response)
+        finally:
+            self._release_lock()
+
+    def _release_lock(self):
+        """
+        Releases the lock and wakes up the threads waiting in _receive_responses.
+        """
+        with self._read_condition:
+            self.lock.release()
+            self._read_condition.notify_all()
 
-            return self._read_response(self.timeout)
+    def _dispatch(self, response):
+        """
+        Passes a complete message to the event listeners if it is an event or resolves the future of the oldest
+        outstanding request otherwise.
 
-    def _read_response(self, timeout=10):
-        # following the information from page 71 about HTTP Message splitting:
-        # The blocks start with 2 byte little endian defining the length of the encrypted data (max 1024 bytes)
-        # followed by 16 byte authTag
-        tmp = bytearray()
-        exp_len = 1024
-        response = HttpResponse()
-        while not response.is_read_completely():
-            # make sure we read all blocks but without blocking to long. Was introduced to support chunked transfer mode
-            # from https://github.com/maximkulkin/esp-homekit
-            self.sock.setblocking(0)
+        :param response: the complete HttpResponse
+        """
+        if response.get_http_name() == 'EVENT':
+            self._dispatch_event(response)
+        elif self._pending:
+            self._pending.popleft().set_result(response)
+            with self._read_condition:
+                self._read_condition.notify_all()
+        else:
+            logging.debug('dropping response without request')
 
-            no_data_remaining = (len(tmp) == 0)
+    def _dispatch_event(self, event):
+        """
+        Calls the event listeners with an event or the exception that stopped the background reader.
 
-            # if there is no data use the long timeout so we don't miss anything, else since there is still data go on
-            # much quicker.
-            if no_data_remaining:
-                used_timeout = timeout
-            else:
-                used_timeout = 0.01
-            data_ready = select.select([self.sock], [], [], used_timeout)[0]
+        :param event: the HttpResponse of the event or the exception
+        """
+        listeners = list(self._event_listeners)
+        if not listeners:
+            logging.debug('dropping event without listener')
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception:
+                logging.exception('event listener failed')
 
-            # check if there is anything more to do
-            if not data_ready and no_data_remaining:
-                break
+    def _fail_pending(self, error):
+        """
+        Closes the connection and fails all outstanding pipelined requests.
 
-            self.sock.settimeout(0.1)
+        :param error: the exception set on the futures
+        """
+        with self._send_lock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            while self._pending:
+                self._pending.popleft().set_exception(error)
+        with self._read_condition:
+            self._read_condition.notify_all()
 
-            if len(tmp) == 0:
-                data = self.sock.recv(2)
-                tmp += data
-                continue
+    def add_event_listener(self, listener):
+        """
+        Registers a function that is called with each event (an HttpResponse with the HTTP name EVENT) received on
+        this session. If the background reader stops because the connection broke, the listener is called once with
+        the exception (AccessoryDisconnectedError or EncryptionError). Listeners are called in the reading thread and
+        must not block. While a listener is registered, the background reader keeps running.
 
-            exp_len = int.from_bytes(tmp[0:2], 'little') - len(tmp) + 18
-            data = self.sock.recv(exp_len)
+        :param listener: function taking one parameter
+        """
+        self._event_listeners.append(listener)
 
-            # ready but no data => continue
-            if not data and no_data_remaining:
-                continue
+    def remove_event_listener(self, listener):
+        """
+        Unregisters a function registered with add_event_listener. Once the last listener was removed, the background
+        reader stops after it read the responses of all outstanding requests.
 
-            tmp += data
-            length = int.from_bytes(tmp[0:2], 'little')
-            if length + 18 > len(tmp):
-                # if the the amount of data in tmp is not length + 2 bytes for length + 16 bytes for the tag, the block
-                # is not complete yet
-                continue
-            tmp = tmp[2:]
+        :param listener: the function to unregister
+        """
+        try:
+            self._event_listeners.remove(listener)
+        except ValueError:
+            pass
 
-            block = tmp[0:length]
-            tmp = tmp[length:]
+    def start_reader(self):
+        """
+        Starts a background thread that reads all messages of the session. Events are passed to the event listeners and
+        responses resolve the waiting requests in FIFO order, so requests and event streaming can share one connection.
+        The reader stops when the connection is closed or when there are neither event listeners nor outstanding
+        requests anymore, so the listeners must be registered (or the requests sent) before this is called. Calling
+        this again while the reader runs does nothing.
+        """
+        self.lock.acquire()
+        try:
+            if self._reader is not None:
+                return
+            # the reader continues a response that a waiting caller started to read
+            response = self._partial or HttpResponse()
+            self._partial = None
+            self._reader = threading.Thread(target=self._reader_loop, args=(response,), name='SecureHttp reader')
+            self._reader.daemon = True
+            self._reader.start()
+        finally:
+            # threads waiting to read leave that to the reader now
+            self._release_lock()
 
-            tag = tmp[0:16]
-            tmp = tmp[16:]
+    @property
+    def reader_running(self) -> bool:
+        """
+        :return: True while the background reader started with start_reader runs
+        """
+        return self._reader is not None and self._reader.is_alive()
 
-            decrypted = self.decrypt_block(length, block, tag)
-            if decrypted is not False:
-                response.parse(decrypted)
+    def _reader_loop(self, response):
+        while True:
+            if self._stop_reader(response):
+                return
+            try:
+                # the short timeout only limits how long a closed socket goes unnoticed, incomplete messages are kept
+                response = self._read_response(1, response)
+            except (OSError, ValueError) as e:
+                # the socket was closed locally
+                error = exceptions.AccessoryDisconnectedError(str(e))
+            except (exceptions.AccessoryDisconnectedError, exceptions.EncryptionError) as e:
+                error = e
             else:
+                if response.is_read_completely():
+                    self._dispatch(response)
+                    response = HttpResponse()
+                continue
+            self._fail_pending(error)
+            self._dispatch_event(error)
+            return
+
+    def _stop_reader(self, response):
+        """
+        Ends the background reader if nobody needs it anymore. A thread holding the lock either reads itself or relies
+        on the reader for a request it is about to send, so the reader keeps running in that case.
+
+        :param response: the message the reader has read partially, it is continued by the next reading thread
+        :return: True if the reader must stop
+        """
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            with self._send_lock:
+                if self._event_listeners or self._pending:
+                    return False
+                self._partial = response
+                self._reader = None
+                return True
+        finally:
+            self._release_lock()
+
+    def _read_response(self, timeout=10, response=None):
+        """
+        Reads the next response (or event) from the accessory. The frames are decrypted as soon as they are complete
+        (see page 71 about HTTP message splitting) and reading ends as soon as the response is complete. Only while
+        data is still missing, this waits for the socket to become readable.
+
+        :param timeout: the overall number of seconds to wait for the complete response
+        :param response: an incomplete HttpResponse returned by an earlier call to continue or None
+        :return: the HttpResponse, which is not complete if the accessory did not answer in time
+        :raises EncryptionError: if a frame could not be verified
+        :raises AccessoryDisconnectedError: if the accessory closed the connection
+        """
+        deadline = time.monotonic() + timeout
+        if response is None:
+            response = HttpResponse()
+        if self._plaintext:
+            pending = self._plaintext
+            self._plaintext = bytearray()
+            self._plaintext += response.parse(pending)
+        while not response.is_read_completely():
+            try:
+                segments = self._decoder.decode()
+            except exceptions.EncryptionError:
                 try:
                     self.sock.close()
                 except OSError:
                     pass
-                raise exceptions.EncryptionError('Error during transmission.')
+                raise
+
+            if not segments:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([self.sock], [], [], remaining)[0]:
+                    # the deadline passed, the response is returned as far as it was read
+                    break
+                try:
+                    received = self._decoder.receive_from(self.sock)
+                except OSError as e:
+                    raise exceptions.AccessoryDisconnectedError(str(e))
+                if received == 0:
+                    raise exceptions.AccessoryDisconnectedError('Connection closed by the accessory')
+                continue
+
+            for segment in segments:
+                if response.is_read_completely():
+                    # frames after the end of the response belong to the next one (e.g. an event)
+                    self._plaintext += segment
+                else:
+                    self._plaintext += response.parse(segment)
 
         return response
 
     def decrypt_block(self, length, block, tag):
-        tmp = chacha20_aead_decrypt(length.to_bytes(2, byteorder='little'),
-                                    self.a2c_key,
-                                    self.a2c_counter.to_bytes(8, byteorder='little'),
-                                    bytes([0, 0, 0, 0]), block + tag)
-        if tmp is not False:
-            self.a2c_counter += 1
-
-        return tmp
+        return self.a2c_cipher.open_frame(block + tag, length.to_bytes(2, byteorder='little'))
 
     def handle_event_response(self):
         """
-        This reads the enciphered response from an accessory after registering for events.
+        This reads the enciphered response from an accessory after registering for events. While the background reader
+        runs, the events passed on by it are returned instead.
         :return: the event data as string (not as json object)
         """
+        if self._reader is not None:
+            if self._event_queue is None:
+                self._event_queue = queue.Queue()
+                self.add_event_listener(self._event_queue.put)
+            try:
+                event = self._event_queue.get(timeout=1)
+            except queue.Empty:
+                if not self.reader_running:
+                    raise exceptions.AccessoryDisconnectedError('The background reader stopped')
+                return HttpResponse()
+            if isinstance(event, Exception):
+                raise event
+            return event
         try:
             return self._read_response(1)
         except OSError as e:
@@ -25,14 +25,16 @@ from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives import serialization
 
 from homekit.protocol.states import States
-from homekit.protocol.methods import Methods  # noqa: F401
+from homekit.protocol.methods import Methods
 from homekit.protocol.errors import Errors
 from homekit.protocol.tlv_types import TlvTypes
+from homekit.protocol.pairing_keys import PairingKeys
+from homekit.protocol.session_resume import ResumeCache, derive_resume_key, derive_resume_session_id  # noqa: F401
 from homekit.exceptions import IncorrectPairingIdError, InvalidAuthTagError, InvalidSignatureError, UnavailableError, \
     AuthenticationError, InvalidError, BusyError, MaxTriesError, MaxPeersError, BackoffError
 
 import homekit.exceptions
-from homekit.crypto import chacha20_aead_decrypt, chacha20_aead_encrypt, SrpClient
+from homekit.crypto import chacha20_aead_decrypt, chacha20_aead_encrypt, SrpClient, derive_keys
 
 
 def error_handler(error, stage):
@@ -290,10 +292,29 @@ def perform_pair_setup_part2(pin, ios_pairing_id, salt, server_public_key):
     }
 
 
-def get_session_keys(pairing_data):
+def derive_control_keys(shared_secret):
+    """
+    Derives the keys of the secured session from the shared secret of a pair verify or pair resume (see page 51).
+
+    :param shared_secret: the shared secret as bytes
+    :return: tuple of the session keys (controller_to_accessory_key and accessory_to_controller_key)
+    """
+    return derive_keys('Control-Salt'.encode(), shared_secret, 'Control-Write-Encryption-Key'.encode(),
+                       'Control-Read-Encryption-Key'.encode())
+
+
+def get_session_keys(pairing_data, resume_cache=None, pairing_keys=None):
     """
     HomeKit Controller state machine to perform a pair verify operation as described in chapter 4.8 page 47 ff.
+
+    If a resume cache is given and it contains a session for the pairing, a pair resume (see Table 6-27 page 116) is
+    tried first. This skips the signatures of the full pair verify. If the accessory does not know the session (or does
+    not support pair resume) the full pair verify is performed. After each successful verify or resume, the new
+    resumable session is stored in the cache.
+
     :param pairing_data: the paring data as returned by perform_pair_setup
+    :param resume_cache: an instance of ResumeCache to enable pair resume or None to always perform a full pair verify
+    :param pairing_keys: the PairingKeys of the pairing to reuse them or None to parse them from the pairing data
     :return: tuple of the session keys (controller_to_accessory_key and  accessory_to_controller_key)
     :raises InvalidAuthTagError: if the auth tag could not be verified,
     :raises IncorrectPairingIdError: if the accessory's LTPK could not be found
@@ -301,6 +322,9 @@ def get_session_keys(pairing_data):
     :raises AuthenticationError: if the secured session could not be established
     """
 
+    if pairing_keys is None:
+        pairing_keys = PairingKeys(pairing_data)
+
     #
     # Step #1 ios --> accessory (send verify start Request) (page 47)
     #
@@ -317,16 +341,56 @@ def get_session_keys(pairing_data):
 
     step2_expectations = {
         TlvTypes.State: tlv8.DataType.INTEGER,
+        TlvTypes.Error: tlv8.DataType.INTEGER,
         TlvTypes.PublicKey: tlv8.DataType.BYTES,
-        TlvTypes.EncryptedData: tlv8.DataType.BYTES
+        TlvTypes.EncryptedData: tlv8.DataType.BYTES,
+        TlvTypes.SessionID: tlv8.DataType.BYTES
     }
-    response_tlv = yield (request_tlv, step2_expectations)
+
+    cache_key = (pairing_keys.ios_pairing_id, pairing_keys.accessory_pairing_id)
+    resumable = resume_cache.pop(cache_key) if resume_cache is not None else None
+    if resumable:
+        # the resume request carries the public key of the full pair verify so the accessory can fall back to it
+        session_id, shared_secret, _ = resumable
+        request_key = derive_resume_key(shared_secret, ios_key_pub, session_id, 'Pair-Resume-Request-Info')
+        _, auth_tag = chacha20_aead_encrypt(bytes(), request_key, 'PR-Msg01'.encode(), bytes([0, 0, 0, 0]), bytes())
+        resume_request_tlv = request_tlv + [
+            tlv8.Entry(TlvTypes.Method, Methods.kTLVMethod_Resume),
+            tlv8.Entry(TlvTypes.SessionID, session_id),
+            tlv8.Entry(TlvTypes.EncryptedData, auth_tag)
+        ]
+        response_tlv = yield (resume_request_tlv, step2_expectations)
+
+        if response_tlv.first_by_id(TlvTypes.SessionID) and not response_tlv.first_by_id(TlvTypes.PublicKey):
+            state = response_tlv.first_by_id(TlvTypes.State).data
+            assert state == States.M2, 'get_session_keys: not M2'
+            assert response_tlv.first_by_id(TlvTypes.EncryptedData), 'get_session_keys: no encrypted data'
+            new_session_id = bytes(response_tlv.first_by_id(TlvTypes.SessionID).data)
+            response_key, new_shared_secret = derive_resume_key(shared_secret, ios_key_pub, new_session_id,
+                                                                'Pair-Resume-Response-Info',
+                                                                'Pair-Resume-Shared-Secret-Info')
+            encrypted = response_tlv.first_by_id(TlvTypes.EncryptedData).data
+            decrypted = chacha20_aead_decrypt(bytes(), response_key, 'PR-Msg02'.encode(), bytes([0, 0, 0, 0]),
+                                              encrypted)
+            if decrypted is False:
+                raise InvalidAuthTagError('resume')
+            resume_cache.put(cache_key, new_session_id, new_shared_secret)
+            return derive_control_keys(new_shared_secret)
+
+        if not response_tlv.first_by_id(TlvTypes.PublicKey):
+            # the accessory rejected the resume, so start over with a plain pair verify
+            response_tlv = yield (request_tlv, step2_expectations)
+    else:
+        response_tlv = yield (request_tlv, step2_expectations)
 
     #
     # Step #3 ios --> accessory (send SRP verify request)  (page 49)
     #
     state = response_tlv.first_by_id(TlvTypes.State).data
     assert state == States.M2, 'get_session_keys: not M2'
+    error = response_tlv.first_by_id(TlvTypes.Error)
+    if error:
+        error_handler(error.data, 'step 3')
     assert response_tlv.first_by_id(TlvTypes.PublicKey), 'get_session_keys: no public key'
     assert response_tlv.first_by_id(TlvTypes.EncryptedData), 'get_session_keys: no encrypted data'
 
@@ -338,8 +402,7 @@ def get_session_keys(pairing_data):
     shared_secret = ios_key.exchange(accessorys_session_pub_key)
 
     # 2) derive session key
-    hkdf_inst = hkdf.Hkdf('Pair-Verify-Encrypt-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-    session_key = hkdf_inst.expand('Pair-Verify-Encrypt-Info'.encode(), 32)
+    session_key, = derive_keys('Pair-Verify-Encrypt-Salt'.encode(), shared_secret, 'Pair-Verify-Encrypt-Info'.encode())
 
     # 3) verify auth tag on encrypted data and 4) decrypt
     encrypted = response_tlv.first_by_id(TlvTypes.EncryptedData).data
@@ -354,10 +417,10 @@ def get_session_keys(pairing_data):
     # 5) look up pairing by accessory name
     accessory_name = d1.first_by_id(TlvTypes.Identifier).data.decode()
 
-    if pairing_data['AccessoryPairingID'] != accessory_name:
+    if pairing_keys.accessory_pairing_id != accessory_name:
         raise IncorrectPairingIdError('step 3')
 
-    accessory_ltpk = ed25519.VerifyingKey(bytes.fromhex(pairing_data['AccessoryLTPK']))
+    accessory_ltpk = pairing_keys.accessory_ltpk
 
     # 6) verify accessory's signature
     accessory_sig = d1.first_by_id(TlvTypes.Signature).data
@@ -369,17 +432,14 @@ def get_session_keys(pairing_data):
         raise InvalidSignatureError('step 3')
 
     # 7) create iOSDeviceInfo
-    ios_device_info = ios_key_pub + pairing_data['iOSPairingId'].encode() + accessorys_session_pub_key_bytes
+    ios_device_info = ios_key_pub + pairing_keys.ios_pairing_id_bytes + accessorys_session_pub_key_bytes
 
     # 8) sign iOSDeviceInfo with long term secret key
-    ios_device_ltsk_h = pairing_data['iOSDeviceLTSK']
-    ios_device_ltpk_h = pairing_data['iOSDeviceLTPK']
-    ios_device_ltsk = ed25519.SigningKey(bytes.fromhex(ios_device_ltsk_h) + bytes.fromhex(ios_device_ltpk_h))
-    ios_device_signature = ios_device_ltsk.sign(ios_device_info)
+    ios_device_signature = pairing_keys.ios_device_ltsk.sign(ios_device_info)
 
     # 9) construct sub tlv
     sub_tlv = tlv8.encode([
-        tlv8.Entry(TlvTypes.Identifier, pairing_data['iOSPairingId'].encode()),
+        tlv8.Entry(TlvTypes.Identifier, pairing_keys.ios_pairing_id_bytes),
         tlv8.Entry(TlvTypes.Signature, ios_device_signature)
     ])
 
@@ -410,11 +470,7 @@ def get_session_keys(pairing_data):
     if len(response_tlv) == 2 and error:
         error_handler(error.data, 'verification')
 
-    # calculate session keys
-    hkdf_inst = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-    controller_to_accessory_key = hkdf_inst.expand('Control-Write-Encryption-Key'.encode(), 32)
-
-    hkdf_inst = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-    accessory_to_controller_key = hkdf_inst.expand('Control-Read-Encryption-Key'.encode(), 32)
+    if resume_cache is not None:
+        resume_cache.put(cache_key, derive_resume_session_id(shared_secret), shared_secret)
 
-    return controller_to_accessory_key, accessory_to_controller_key
+    return derive_control_keys(shared_secret)
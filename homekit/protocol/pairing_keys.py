@@ -0,0 +1,36 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import ed25519
+
+
+class PairingKeys(object):
+    """
+    The parsed long term keys and identifiers of a pairing as required by pair verify. Creating this once per pairing
+    avoids decoding the hex strings of the pairing data and setting up the Ed25519 keys with each new session.
+    """
+
+    def __init__(self, pairing_data: dict):
+        """
+        :param pairing_data: the paring data as returned by perform_pair_setup
+        """
+        self.accessory_pairing_id = pairing_data['AccessoryPairingID']
+        self.accessory_pairing_id_bytes = self.accessory_pairing_id.encode()
+        self.accessory_ltpk = ed25519.VerifyingKey(bytes.fromhex(pairing_data['AccessoryLTPK']))
+        self.ios_pairing_id = pairing_data['iOSPairingId']
+        self.ios_pairing_id_bytes = self.ios_pairing_id.encode()
+        self.ios_device_ltsk = ed25519.SigningKey(bytes.fromhex(pairing_data['iOSDeviceLTSK']) +
+                                                  bytes.fromhex(pairing_data['iOSDeviceLTPK']))
@@ -0,0 +1,106 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+from collections import OrderedDict
+
+from homekit.crypto.key_derivation import derive_keys
+
+# length of the session ID of a resumable session (see Table 6-27 page 116)
+SESSION_ID_LENGTH = 8
+
+
+def derive_resume_session_id(shared_secret: bytes) -> bytes:
+    """
+    Derives the ID of the resumable session from the shared secret of a successful pair verify.
+
+    :param shared_secret: the shared secret of the pair verify
+    :return: the session ID as bytes
+    """
+    session_id, = derive_keys('Pair-Verify-ResumeSessionID-Salt'.encode(), shared_secret,
+                              'Pair-Verify-ResumeSessionID-Info'.encode(), length=SESSION_ID_LENGTH)
+    return session_id
+
+
+def derive_resume_key(shared_secret: bytes, ios_device_pub_key: bytes, session_id: bytes, *infos: str):
+    """
+    Derives keys of the pair resume exchange. The salt is the controller's ephemeral public key followed by the
+    session ID.
+
+    :param shared_secret: the shared secret of the session that is resumed
+    :param ios_device_pub_key: the controller's curve25519 public key sent with the resume request
+    :param session_id: the session ID the keys belong to
+    :param infos: one or more of 'Pair-Resume-Request-Info', 'Pair-Resume-Response-Info' or
+                  'Pair-Resume-Shared-Secret-Info'
+    :return: the 256-bit key as bytes for a single label or a tuple of keys in the order of the labels
+    """
+    keys = derive_keys(bytes(ios_device_pub_key) + bytes(session_id), shared_secret, *[i.encode() for i in infos])
+    return keys[0] if len(keys) == 1 else keys
+
+
+class ResumeCache(object):
+    """
+    Thread safe store of resumable pair verify sessions. Each entry holds the session ID and the shared secret of a
+    successful pair verify (or pair resume). The controller keys the entries by pairing, the accessory by session ID.
+    Only the most recently stored entries are kept.
+    """
+
+    def __init__(self, max_entries: int = 8):
+        """
+        :param max_entries: the number of sessions to keep, older sessions are dropped first
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, session_id: bytes, shared_secret: bytes, info=None):
+        """
+        Stores a resumable session. An existing entry for the key is replaced.
+
+        :param key: the key to look up the session later
+        :param session_id: the session ID of the resumable session
+        :param shared_secret: the shared secret of the resumable session
+        :param info: additional data kept with the session (e.g. the controller's pairing id on the accessory side)
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (bytes(session_id), bytes(shared_secret), info)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """
+        Removes a resumable session. Each session can only be resumed once, so this is used to take a session for a
+        resume attempt.
+
+        :param key: the key the session was stored with
+        :return: tuple of session ID, shared secret and additional data or None if no such session is known
+        """
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes all sessions.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
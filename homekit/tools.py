@@ -27,3 +27,9 @@ try:
     IP_TRANSPORT_SUPPORTED = True
 except ImportError:
     IP_TRANSPORT_SUPPORTED = False
+
+try:
+    import numpy  # noqa: F401
+    NUMPY_SUPPORTED = True
+except ImportError:
+    NUMPY_SUPPORTED = False
@@ -22,7 +22,7 @@ with open("README.md", "r") as fh:
 
 setuptools.setup(
     name='homekit',
-    packages=setuptools.find_packages(exclude=['tests']),
+    packages=setuptools.find_packages(exclude=['tests', 'benchmarks']),
     version='0.18.0',
     description='Python code to interface HomeKit Accessories and Controllers',
     author='Joachim Lusiardi',
@@ -44,7 +44,8 @@ setuptools.setup(
     ],
     extras_require={
         'IP': ['zeroconf==0.32.0'],
-        'BLE': ['dbus-python', 'gatt', 'pygobject']
+        'BLE': ['dbus-python', 'gatt', 'pygobject'],
+        'numpy': ['numpy']
     },
     license='Apache License 2.0',
     long_description=long_description,
@@ -19,9 +19,15 @@ __all__ = [
     'TestBLEController', 'TestChacha20poly1305', 'TestCharacteristicsTypes', 'TestController', 'TestControllerIpPaired',
     'TestControllerIpUnpaired', 'TestHttpResponse', 'TestHttpStatusCodes', 'TestMfrData', 'TestSrp',
     'TestZeroconf', 'TestBLEPairing', 'TestServiceTypes', 'TestSecureHttp', 'TestHTTPPairing', 'TestSecureSession',
-    'TestFeatureFlags'
+    'TestFeatureFlags', 'TestSessionCipher', 'TestBenchmarks', 'TestResumeCache', 'TestSessionResume',
+    'TestKeyDerivation', 'TestHapFrameDecoder', 'TestAsyncController', 'TestAsyncIpSession', 'TestConnectionManager',
+    'TestRetryPolicy', 'TestAttributeDatabase', 'TestWriteCoalescer', 'TestReadDeduplicator',
+    'TestValueCache'
 ]
 
+from tests.async_controller_test import TestAsyncController, TestAsyncIpSession
+from tests.attribute_database_test import TestAttributeDatabase
+from tests.benchmarks_test import TestBenchmarks
 from tests.bleCharacteristicFormats_test import BleCharacteristicFormatsTest
 from tests.bleCharacteristicUnits_test import BleCharacteristicUnitsTest
 from tests.ble_controller_test import TestBLEController, TestMfrData
@@ -29,13 +35,22 @@ from tests.ble_pairing_test import TestBLEPairing
 from tests.chacha20poly1305_test import TestChacha20poly1305
 from tests.characteristicTypes_test import CharacteristicTypesTest
 from tests.characteristicsTypes_test import TestCharacteristicsTypes
+from tests.connection_manager_test import TestConnectionManager
 from tests.controller_test import TestControllerIpPaired, TestControllerIpUnpaired, TestController
 from tests.feature_flags_test import TestFeatureFlags
+from tests.frame_decoder_test import TestHapFrameDecoder
 from tests.httpStatusCodes_test import TestHttpStatusCodes
 from tests.http_response_test import TestHttpResponse
+from tests.key_derivation_test import TestKeyDerivation
 from tests.regression_test import TestHTTPPairing, TestSecureSession
+from tests.retry_policy_test import TestRetryPolicy
 from tests.secure_http_test import TestSecureHttp
 from tests.serverdata_test import TestServerData
+from tests.session_cipher_test import TestSessionCipher
+from tests.session_resume_test import TestResumeCache, TestSessionResume
 from tests.serviceTypes_test import TestServiceTypes
 from tests.srp_test import TestSrp
+from tests.write_coalescer_test import TestWriteCoalescer
+from tests.read_deduplicator_test import TestReadDeduplicator
+from tests.value_cache_test import TestValueCache
 from tests.zeroconf_test import TestZeroconf
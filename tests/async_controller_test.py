@@ -0,0 +1,260 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import tlv8
+
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit import AccessoryServer
+    from homekit.controller import AsyncController, AsyncIpPairing
+    from homekit.controller.async_ip_implementation import AsyncIpSession
+    from homekit.http_impl.response import HttpResponse
+    from homekit.protocol import States, TlvTypes
+    from homekit.controller.ip_implementation import IpPairing
+    from homekit.model import Accessory
+    from homekit.model.services import LightBulbService
+    from homekit.model import mixin as model_mixin
+
+PAIRING_DATA = {
+    'Connection': 'IP',
+    'iOSDeviceLTPK': 'd708df2fbf4a8779669f0ccd43f4962d6d49e4274f88b1292f822edc3bcf8ed8',
+    'iOSPairingId': 'decc6fa3-de3e-41c9-adba-ef7409821bfc',
+    'AccessoryLTPK': '7986cf939de8986f428744e36ed72d86189bea46b4dcdc8d9d79a3e4fceb92b9',
+    'AccessoryPairingID': '12:34:56:00:01:0C',
+    'AccessoryIP': '127.0.0.1',
+    'iOSDeviceLTSK': 'fa45f082ef87efc6c8c8d043d74084a3ea923a2253e323a7eb9917b4090c2fcc'
+}
+
+
+@unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+class TestAsyncController(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config_file = tempfile.NamedTemporaryFile(delete=False)
+        cls.config_file.write(json.dumps({
+            'accessory_ltpk': PAIRING_DATA['AccessoryLTPK'],
+            'accessory_ltsk': '3d99f3e959a1f93af4056966f858074b2a1fdec1c5fd84a51ea96f9fa004156a',
+            'accessory_pairing_id': PAIRING_DATA['AccessoryPairingID'],
+            'accessory_pin': '031-45-154',
+            'c#': 1,
+            'category': 'Lightbulb',
+            'host_ip': '127.0.0.1',
+            'host_port': 0,
+            'name': 'asyncUnittestLight',
+            'peers': {
+                PAIRING_DATA['iOSPairingId']: {'admin': True, 'key': PAIRING_DATA['iOSDeviceLTPK']}
+            },
+            'unsuccessful_tries': 0
+        }).encode())
+        cls.config_file.close()
+
+        # Make sure get_id() numbers are stable between tests
+        model_mixin.id_counter = 0
+
+        cls.values = []
+        cls.httpd = AccessoryServer(cls.config_file.name, logger=None)
+        accessory = Accessory('Testlicht', 'lusiardi.de', 'Demoserver', '0001', '0.1')
+        light_bulb_service = LightBulbService()
+        light_bulb_service.set_on_set_callback(cls.values.append)
+        accessory.services.append(light_bulb_service)
+        cls.httpd.add_accessory(accessory)
+        # the server is not published via zeroconf, so it can be used right away
+        threading.Thread(target=cls.httpd.serve_forever).start()
+
+        cls.pairing_data = dict(PAIRING_DATA, AccessoryPort=cls.httpd.server_address[1])
+        cls.controller_file = tempfile.NamedTemporaryFile(delete=False, mode='w')
+        json.dump({'alias': cls.pairing_data}, cls.controller_file)
+        cls.controller_file.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        os.unlink(cls.config_file.name)
+        os.unlink(cls.controller_file.name)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.controller = AsyncController()
+        self.controller.load_data(self.controller_file.name)
+        self.pairing = self.controller.get_pairings()['alias']
+        self.__class__.values.clear()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.controller.aclose())
+        self.loop.close()
+
+    def test_load_data_creates_async_pairings(self):
+        self.assertIsInstance(self.pairing, AsyncIpPairing)
+
+    def test_get_characteristics_concurrently(self):
+        async def read():
+            results = await asyncio.gather(*[self.pairing.get_characteristics([(1, 4)]) for _ in range(5)])
+            return results, self.pairing.session
+
+        results, session = self.loop.run_until_complete(read())
+        self.assertEqual(['lusiardi.de'] * 5, [r[(1, 4)]['value'] for r in results])
+        # all requests shared one session
+        self.assertIs(session, self.pairing.session)
+
+    def test_put_characteristics(self):
+        result = self.loop.run_until_complete(self.pairing.put_characteristics([(1, 10, 'On')], do_conversion=True))
+        self.assertEqual({}, result)
+        self.assertEqual([1], self.__class__.values)
+
+    def test_list_accessories_and_characteristics(self):
+        result = self.loop.run_until_complete(self.pairing.list_accessories_and_characteristics())
+        self.assertEqual(1, len(result))
+        self.assertEqual(1, result[0]['aid'])
+        self.assertIn('accessories', self.pairing.pairing_data)
+
+    def test_list_accessories_cached_by_config_number(self):
+        self.pairing.update_config_number(1)
+        result = self.loop.run_until_complete(self.pairing.list_accessories_and_characteristics())
+        self.assertIs(result, self.loop.run_until_complete(self.pairing.list_accessories_and_characteristics()))
+        self.assertTrue(self.pairing.update_config_number(2))
+        fetched = self.loop.run_until_complete(self.pairing.list_accessories_and_characteristics())
+        self.assertIsNot(result, fetched)
+        self.assertIsNot(fetched, self.loop.run_until_complete(
+            self.pairing.list_accessories_and_characteristics(refresh=True)))
+
+    def test_get_resource(self):
+        content_type, body = self.loop.run_until_complete(self.pairing.get_resource({'resource-type': 'image'}))
+        # the test accessory has no resources
+        self.assertTrue(content_type.startswith('text/html'))
+        self.assertTrue(body)
+
+    def test_events(self):
+        other_pairing = IpPairing(dict(self.pairing_data))
+
+        async def receive():
+            received = []
+            events = self.pairing.get_events([(1, 10)], max_events=2, max_seconds=10)
+            self.assertEqual({}, await events.subscribe())
+            # a blocking controller with its own session changes the value
+            writer = self.loop.run_in_executor(None, other_pairing.put_characteristics, [(1, 10, True)])
+            async for event in events:
+                received.extend(event)
+                if len(received) == 1:
+                    # requests share the session with the events
+                    result = await self.pairing.get_characteristics([(1, 4)])
+                    self.assertEqual('lusiardi.de', result[(1, 4)]['value'])
+                    await writer
+                    writer = self.loop.run_in_executor(None, other_pairing.put_characteristics, [(1, 10, False)])
+            await writer
+            return received
+
+        try:
+            received = self.loop.run_until_complete(receive())
+        finally:
+            other_pairing.close()
+        self.assertEqual([(1, 10, True), (1, 10, False)], received)
+
+    def test_shutdown_closes_sessions_without_event_loop(self):
+        self.loop.run_until_complete(self.pairing.get_characteristics([(1, 4)]))
+        session = self.pairing.session
+        self.controller.shutdown()
+        self.assertIsNone(self.pairing.session)
+        self.assertFalse(session.connected)
+        # let the reader task finish its cancellation
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertIsNone(session._read_task)
+
+    def test_aprewarm(self):
+        self.assertRaises(NotImplementedError, self.controller.prewarm)
+        self.assertEqual(1, self.loop.run_until_complete(self.controller.aprewarm()))
+        self.assertTrue(self.pairing.session.connected)
+
+    def test_aremove_pairing(self):
+        requests = []
+
+        async def request(method, url, body=None, content_type=None):
+            requests.append((method, url, tlv8.decode(body)))
+            return _response(tlv8.encode([tlv8.Entry(TlvTypes.State, States.M2)]).decode())
+
+        self.assertRaises(NotImplementedError, self.controller.remove_pairing, 'alias')
+        self.pairing._request = request
+        self.loop.run_until_complete(self.controller.aremove_pairing('alias'))
+        self.assertEqual(['POST', '/pairings'], list(requests[0][:2]))
+        self.assertEqual(PAIRING_DATA['iOSPairingId'].encode(), requests[0][2].first_by_id(TlvTypes.Identifier).data)
+        self.assertNotIn('alias', self.controller.get_pairings())
+
+
+class FakeWriter(object):
+    """
+    Collects the data written by an AsyncIpSession.
+    """
+
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _response(body):
+    response = HttpResponse()
+    response.parse('HTTP/1.1 200 OK\r\nContent-Length: {l}\r\n\r\n{b}'.format(l=len(body), b=body).encode())
+    return response
+
+
+@unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+class TestAsyncIpSession(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.session = AsyncIpSession(dict(PAIRING_DATA, AccessoryPort=1, Pipelining=True))
+        self.session.writer = FakeWriter()
+        self.session._requests = mock.Mock()
+        self.session._requests.build.side_effect = lambda method, target, body, content_type: target.encode()
+        self.session._c2a_cipher = mock.Mock()
+        self.session._c2a_cipher.seal_frames.side_effect = lambda data: data
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_response_of_cancelled_request_is_dropped(self):
+        async def requests():
+            first = asyncio.ensure_future(self.session.get('/first'))
+            second = asyncio.ensure_future(self.session.get('/second'))
+            while len(self.session.writer.data) < 2:
+                await asyncio.sleep(0)
+            # the first request is on the wire already when its caller gives up
+            first.cancel()
+            await asyncio.sleep(0)
+            self.session._dispatch(_response('first'))
+            self.session._dispatch(_response('second'))
+            return first, await asyncio.wait_for(second, 1)
+
+        first, response = self.loop.run_until_complete(requests())
+        self.assertTrue(first.cancelled())
+        self.assertEqual(b'second', response.read())
+        self.assertEqual(0, len(self.session._pending))
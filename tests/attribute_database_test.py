@@ -0,0 +1,113 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+
+from homekit.controller.attribute_database import AttributeDatabase
+from homekit.controller.ip_implementation import _characteristics_body
+from homekit.controller.tools import NotSupportedPairing
+from homekit.model.characteristics import CharacteristicsTypes
+from homekit.model.services import ServicesTypes
+
+VENDOR_TYPE = 'E863F10A-079E-48FF-8F27-9C2605A29F52'
+
+
+def create_accessories():
+    return [
+        {'aid': 1, 'services': [
+            {'iid': 1, 'type': '0000003E-0000-1000-8000-0026BB765291', 'characteristics': [
+                {'iid': 2, 'type': '00000014-0000-1000-8000-0026BB765291', 'format': 'bool'},
+                {'iid': 3, 'type': '00000023-0000-1000-8000-0026BB765291', 'format': 'string'},
+            ]},
+            {'iid': 4, 'type': '43', 'characteristics': [
+                {'iid': 5, 'type': '25', 'format': 'bool'},
+                {'iid': 6, 'type': VENDOR_TYPE.lower(), 'format': 'uint16'},
+            ]},
+        ]},
+        {'aid': 2, 'services': [
+            {'iid': 1, 'type': '0000003E-0000-1000-8000-0026BB765291', 'characteristics': [
+                {'iid': 2, 'type': '00000014-0000-1000-8000-0026BB765291', 'format': 'bool'},
+            ]},
+            {'iid': 3, 'type': '00000043-0000-1000-8000-0026BB765291', 'characteristics': [
+                {'iid': 4, 'type': '00000025-0000-1000-8000-0026BB765291', 'format': 'bool'},
+                {'iid': 5, 'type': '00000008-0000-1000-8000-0026BB765291', 'format': 'int'},
+            ]},
+        ]},
+    ]
+
+
+class TestAttributeDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.accessories = create_accessories()
+        self.database = AttributeDatabase(self.accessories)
+
+    def test_get_characteristic(self):
+        self.assertIs(self.accessories[1]['services'][1]['characteristics'][1], self.database.get_characteristic(2, 5))
+        self.assertEqual('bool', self.database.get_characteristic('1', '5')['format'])
+        self.assertIsNone(self.database.get_characteristic(1, 7))
+        self.assertIsNone(self.database.get_characteristic(3, 2))
+        self.assertEqual(7, len(self.database))
+
+    def test_get_service(self):
+        self.assertIs(self.accessories[0]['services'][1], self.database.get_service(1, 4))
+        self.assertIs(self.accessories[0]['services'][1], self.database.get_service_of_characteristic(1, 6))
+        self.assertIsNone(self.database.get_service(1, 2))
+        self.assertIsNone(self.database.get_service_of_characteristic(1, 4))
+
+    def test_get_format(self):
+        self.assertEqual('int', self.database.get_format(2, 5))
+        self.assertIsNone(self.database.get_format(2, 6))
+        self.assertIsNone(AttributeDatabase([{'aid': 1, 'services': [
+            {'iid': 1, 'type': '3E', 'characteristics': [{'iid': 2, 'type': '14'}]}]}]).get_format(1, 2))
+
+    def test_find_characteristics_by_type(self):
+        identify = self.database.find_characteristics(CharacteristicsTypes.IDENTIFY)
+        self.assertEqual([(1, 2), (2, 2)], [(aid, c['iid']) for aid, c in identify])
+        # short and full UUIDs find the same characteristics
+        self.assertEqual(identify, self.database.find_characteristics('14'))
+        self.assertEqual(identify, self.database.find_characteristics('00000014-0000-1000-8000-0026BB765291'))
+        self.assertEqual([(1, 5), (2, 4)], [(aid, c['iid']) for aid, c in self.database.find_characteristics(
+            CharacteristicsTypes.ON)])
+        self.assertEqual([(1, 6)], [(aid, c['iid']) for aid, c in self.database.find_characteristics(VENDOR_TYPE)])
+        self.assertEqual([], self.database.find_characteristics(CharacteristicsTypes.PAIRING_PAIRINGS))
+
+    def test_find_characteristic(self):
+        aid, characteristic = self.database.find_characteristic(CharacteristicsTypes.IDENTIFY)
+        self.assertEqual((1, 2), (aid, characteristic['iid']))
+        self.assertEqual((None, None), self.database.find_characteristic(CharacteristicsTypes.PAIRING_PAIRINGS))
+
+    def test_find_services_by_type(self):
+        light_bulbs = self.database.find_services('public.hap.service.lightbulb')
+        self.assertEqual([(1, 4), (2, 3)], [(aid, s['iid']) for aid, s in light_bulbs])
+        self.assertEqual(light_bulbs, self.database.find_services('43'))
+        information = self.database.find_services(ServicesTypes.ACCESSORY_INFORMATION_SERVICE)
+        self.assertEqual([(1, 1), (2, 1)], [(aid, s['iid']) for aid, s in information])
+        self.assertEqual([], self.database.find_services(ServicesTypes.PAIRING_SERVICE))
+
+    def test_characteristics_body_converts_with_database(self):
+        body = _characteristics_body(self.database, [(1, 6, '42'), (2, 4, 'true')], do_conversion=True)
+        self.assertEqual([{'aid': 1, 'iid': 6, 'value': 42}, {'aid': 2, 'iid': 4, 'value': True}],
+                         json.loads(body)['characteristics'])
+
+    def test_pairing_rebuilds_database_after_fetch(self):
+        pairing = NotSupportedPairing({'accessories': self.accessories}, 'IP')
+        database = pairing.attribute_database
+        self.assertIs(database, pairing.attribute_database)
+        pairing.pairing_data['accessories'] = create_accessories()[:1]
+        self.assertIsNot(database, pairing.attribute_database)
+        self.assertIsNone(pairing.attribute_database.get_characteristic(2, 2))
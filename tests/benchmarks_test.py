@@ -0,0 +1,48 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import unittest
+import hashlib
+
+import hkdf
+
+from benchmarks import Benchmark, compare_results, run_benchmarks
+from benchmarks.handshake_benchmarks import SimulatedAccessory, perform_pair_verify
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_compare_results(self):
+        baseline = {'results': {'a': 1.0, 'b': 1.0, 'c': 1.0}}
+        results = {'results': {'a': 1.2, 'b': 1.3, 'd': 5.0}}
+        self.assertEqual([('b', 1.0, 1.3)], compare_results(results, baseline, 0.25))
+        self.assertEqual([('a', 1.0, 1.2), ('b', 1.0, 1.3)], compare_results(results, baseline, 0.1))
+
+    def test_run_benchmarks_with_filter(self):
+        calls = []
+        benchmarks = [Benchmark('first', lambda: lambda: calls.append(1)), Benchmark('second', lambda: None)]
+        results = run_benchmarks(benchmarks, name_filter='fir', min_time=0.001, repeat=1)
+        self.assertEqual(['first'], list(results['results'].keys()))
+        self.assertIn('backend', results)
+        self.assertTrue(len(calls) > 1)
+
+    def test_simulated_pair_verify(self):
+        accessory = SimulatedAccessory()
+        c2a_key, a2c_key = perform_pair_verify(accessory.create_pairing_data(), accessory)
+        hkdf_inst = hkdf.Hkdf('Control-Salt'.encode(), accessory._shared_secret, hash=hashlib.sha512)
+        self.assertEqual(hkdf_inst.expand('Control-Write-Encryption-Key'.encode(), 32), c2a_key)
+        self.assertEqual(hkdf_inst.expand('Control-Read-Encryption-Key'.encode(), 32), a2c_key)
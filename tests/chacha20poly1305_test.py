@@ -15,10 +15,14 @@
 #
 
 import unittest
+from unittest import mock
+import os
 
 from homekit.crypto.chacha20poly1305 import pad16, chacha20_quarter_round, chacha20_create_initial_state, \
     chacha20_aead_decrypt, chacha20_aead_verify_tag, chacha20_aead_encrypt, chacha20_block, chacha20_encrypt, calc_s, \
-    calc_r, clamp, poly1305_key_gen, poly1305_mac
+    calc_r, clamp, poly1305_key_gen, poly1305_mac, AEAD_BACKENDS, PythonChaCha20Poly1305, verify_backend, \
+    get_backend_name, set_backend, ChaCha20Keystream, chacha20_inner_block, Poly1305, chacha20_keystreams
+from homekit.tools import NUMPY_SUPPORTED
 
 
 class TestChacha20poly1305(unittest.TestCase):
@@ -152,3 +156,155 @@ class TestChacha20poly1305(unittest.TestCase):
         self.assertEqual(plain_text, plain_text_)
 
         self.assertFalse(chacha20_aead_decrypt(aad, key, iv, fixed, r[0] + r[1] + bytes([0, 1, 2, 3])))
+
+    def test_all_backends_pass_self_test(self):
+        for backend in AEAD_BACKENDS:
+            self.assertTrue(verify_backend(backend), backend.name)
+
+    def test_backends_give_identical_results(self):
+        key = os.urandom(32)
+        nonce = bytes([0, 0, 0, 0]) + os.urandom(8)
+        reference = PythonChaCha20Poly1305(key)
+        for backend in AEAD_BACKENDS:
+            cipher = backend(key)
+            for length in [0, 1, 63, 64, 65, 1024]:
+                plain_text = os.urandom(length)
+                aad = length.to_bytes(2, byteorder='little')
+                sealed = cipher.encrypt(nonce, plain_text, aad)
+                self.assertEqual(reference.encrypt(nonce, plain_text, aad), sealed, backend.name)
+                self.assertEqual(plain_text, reference.decrypt(nonce, sealed, aad), backend.name)
+                # the AAD of the sealing never has both bytes set, so the tag must not match
+                self.assertIs(False, cipher.decrypt(nonce, sealed, b'\xff\xff'), backend.name)
+
+    def test_aead_functions_with_each_backend(self):
+        original = get_backend_name()
+        key = os.urandom(32)
+        iv = os.urandom(8)
+        try:
+            for backend in AEAD_BACKENDS:
+                set_backend(backend.name)
+                cipher_text, tag = chacha20_aead_encrypt(b'', key, iv, bytes([0, 0, 0, 0]), b'some data')
+                self.assertIsInstance(cipher_text, bytearray)
+                self.assertEqual(b'some data',
+                                 chacha20_aead_decrypt(b'', key, iv, bytes([0, 0, 0, 0]), bytes(cipher_text + tag)))
+        finally:
+            set_backend(original)
+
+    def test_set_unknown_backend(self):
+        self.assertRaises(ValueError, set_backend, 'unknown')
+
+    @staticmethod
+    def _reference_key_stream(key, nonce, counter, blocks):
+        result = b''
+        for block in range(blocks):
+            state = chacha20_create_initial_state(key, nonce, counter + block)
+            working_state = state.copy()
+            for _ in range(10):
+                chacha20_inner_block(working_state)
+            for i in range(16):
+                result += ((state[i] + working_state[i]) & 0xffffffff).to_bytes(4, byteorder='little')
+        return result
+
+    def test_keystream_multiple_blocks(self):
+        key = os.urandom(32)
+        nonce = os.urandom(12)
+        stream = ChaCha20Keystream(key, nonce)
+        self.assertEqual(self._reference_key_stream(key, nonce, 7, 5), stream.keystream(7, 320))
+        self.assertEqual(80, len(stream.words(7, 5)))
+        self.assertEqual(self._reference_key_stream(key, nonce, 1, 1)[:10], stream.keystream(1, 10))
+
+    def test_keystream_xor_partial_blocks(self):
+        key = os.urandom(32)
+        nonce = os.urandom(12)
+        stream = ChaCha20Keystream(key, nonce)
+        for length in [0, 1, 63, 64, 65, 1024, 1040]:
+            plain_text = os.urandom(length)
+            key_stream = self._reference_key_stream(key, nonce, 1, (length + 63) // 64)
+            expected = bytes([a ^ b for (a, b) in zip(plain_text, key_stream)])
+            self.assertEqual(expected, stream.xor(1, plain_text))
+            self.assertEqual(expected, stream.xor(1, memoryview(bytearray(plain_text))))
+            self.assertEqual(plain_text, stream.xor(1, expected))
+
+    def test_poly1305_incremental_updates(self):
+        key = os.urandom(32)
+        message = os.urandom(1100)
+        expected = poly1305_mac(message, key)
+        for chunk_size in [1, 7, 16, 33, 1024]:
+            mac = Poly1305(key)
+            view = memoryview(message)
+            for i in range(0, len(message), chunk_size):
+                mac.update(view[i:i + chunk_size])
+            self.assertEqual(expected, mac.finalize(), chunk_size)
+
+    def test_poly1305_pad16(self):
+        key = os.urandom(32)
+        mac = Poly1305(key)
+        mac.update(b'abc')
+        mac.pad16()
+        mac.update(bytearray(b'defgh'))
+        mac.pad16()
+        self.assertEqual(poly1305_mac(b'abc' + bytes(13) + b'defgh' + bytes(11), key), mac.finalize())
+
+    def test_encrypt_into_and_decrypt_into(self):
+        key = os.urandom(32)
+        nonce = bytes([0, 0, 0, 0]) + os.urandom(8)
+        plain_text = os.urandom(100)
+        for backend in AEAD_BACKENDS:
+            cipher = backend(key)
+            buffer = bytearray(120)
+            self.assertEqual(116, cipher.encrypt_into(nonce, plain_text, b'ad', memoryview(buffer)[4:]))
+            self.assertEqual(cipher.encrypt(nonce, plain_text, b'ad'), buffer[4:], backend.name)
+            result = bytearray(100)
+            self.assertTrue(cipher.decrypt_into(nonce, buffer[4:], b'ad', result))
+            self.assertEqual(plain_text, result)
+            self.assertFalse(cipher.decrypt_into(nonce, buffer[4:], b'xx', result))
+            self.assertRaises(ValueError, cipher.encrypt_into, nonce, plain_text, b'ad', bytearray(10))
+
+    @unittest.skipIf(len(AEAD_BACKENDS) == 1, 'no native backend available')
+    def test_native_backend_without_into_functions(self):
+        with mock.patch('homekit.crypto.chacha20poly1305._NATIVE_INTO', False):
+            self.assertTrue(verify_backend(AEAD_BACKENDS[0]))
+
+    def test_batch_functions(self):
+        key = os.urandom(32)
+        nonces = [bytes([0, 0, 0, 0]) + i.to_bytes(8, byteorder='little') for i in range(6)]
+        plain_texts = [os.urandom(length) for length in [1024, 1024, 1024, 1024, 17, 0]]
+        aads = [len(p).to_bytes(2, byteorder='little') for p in plain_texts]
+        reference = PythonChaCha20Poly1305(key)
+        for backend in AEAD_BACKENDS:
+            cipher = backend(key)
+            bufs = [bytearray(len(p) + 16) for p in plain_texts]
+            cipher.encrypt_batch_into(nonces, plain_texts, aads, bufs)
+            for nonce, plain_text, aad, buf in zip(nonces, plain_texts, aads, bufs):
+                self.assertEqual(reference.encrypt(nonce, plain_text, aad), buf, backend.name)
+            bufs[1][0] ^= 0x01
+            result = cipher.decrypt_batch(nonces, bufs, aads)
+            self.assertEqual(plain_texts[0], result[0])
+            self.assertFalse(result[1])
+            self.assertEqual(plain_texts[2:], result[2:])
+
+    def test_keystreams_with_and_without_numpy(self):
+        key = os.urandom(32)
+        nonces = [os.urandom(12) for _ in range(5)]
+        expected = [ChaCha20Keystream(key, nonce).words(0, 17).tobytes()[:1050] for nonce in nonces]
+        with mock.patch('homekit.crypto.chacha20poly1305.NUMPY_SUPPORTED', False):
+            self.assertEqual(expected, chacha20_keystreams(key, nonces, 1050))
+        self.assertEqual(expected, chacha20_keystreams(key, nonces, 1050))
+
+    @unittest.skipIf(not NUMPY_SUPPORTED, 'numpy is not installed')
+    def test_numpy_keystream(self):
+        key = os.urandom(32)
+        nonce = os.urandom(12)
+        stream = ChaCha20Keystream(key, nonce)
+        for counter, length in [(0, 1), (1, 64), (7, 1000), (2 ** 32 - 2, 300)]:
+            self.assertEqual(stream.words(counter, (length + 63) // 64).tobytes()[:length],
+                             stream.numpy_keystream(counter, length))
+
+    @unittest.skipIf(not NUMPY_SUPPORTED, 'numpy is not installed')
+    def test_numpy_xor_above_threshold(self):
+        key = os.urandom(32)
+        nonce = os.urandom(12)
+        plain_text = os.urandom(10000)
+        with mock.patch('homekit.crypto.chacha20poly1305.NUMPY_SUPPORTED', False):
+            expected = chacha20_encrypt(key, 1, nonce, plain_text)
+        self.assertEqual(expected, chacha20_encrypt(key, 1, nonce, plain_text))
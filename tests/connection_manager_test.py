@@ -0,0 +1,183 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+import unittest
+
+from homekit.controller.connection_manager import ConnectionManager
+from homekit.exceptions import AccessoryDisconnectedError, ConnectionLimitError
+
+
+class FakeSession(object):
+    def __init__(self, connected=True):
+        self.sock = object() if connected else None
+
+    def close(self):
+        self.sock = None
+
+
+class FakePairing(object):
+    def __init__(self, accessory_id):
+        self.pairing_data = {'AccessoryPairingID': accessory_id}
+        self.session = None
+
+
+class TestConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+        self.handshake_delay = 0
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def create_session(self, pairing):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.handshake_delay)
+        with self.lock:
+            self.running -= 1
+        session = FakeSession()
+        self.created.append(session)
+        return session
+
+    def manager(self, **kwargs):
+        kwargs.setdefault('session_factory', self.create_session)
+        return ConnectionManager(**kwargs)
+
+    def test_session_is_reused(self):
+        manager = self.manager()
+        pairing = FakePairing('1')
+        with manager.use(pairing) as session:
+            self.assertIs(session, pairing.session)
+            # nested use of the same pairing does not open another session
+            with manager.use(pairing) as nested:
+                self.assertIs(session, nested)
+        with manager.use(pairing) as session2:
+            self.assertIs(session, session2)
+        self.assertEqual(1, len(self.created))
+        statistics = manager.statistics()
+        self.assertEqual(1, statistics['handshakes'])
+        self.assertEqual(2, statistics['reused'])
+        self.assertEqual(1, statistics['idle'])
+
+    def test_closed_session_is_replaced(self):
+        manager = self.manager()
+        pairing = FakePairing('1')
+        with manager.use(pairing) as session:
+            # like IpPairing does after an error
+            session.close()
+            pairing.session = None
+        self.assertEqual(0, manager.statistics()['sessions'])
+        with manager.use(pairing) as session2:
+            self.assertIsNot(session, session2)
+
+    def test_least_recently_used_idle_session_is_evicted(self):
+        manager = self.manager(max_sessions=2)
+        pairings = [FakePairing(str(i)) for i in range(3)]
+        for pairing in pairings[:2]:
+            with manager.use(pairing):
+                pass
+        # pairing 0 was used last, so pairing 1 is evicted
+        with manager.use(pairings[0]):
+            pass
+        with manager.use(pairings[2]):
+            pass
+        self.assertIsNotNone(pairings[0].session)
+        self.assertIsNone(pairings[1].session)
+        self.assertIsNone(self.created[1].sock)
+        statistics = manager.statistics()
+        self.assertEqual(2, statistics['sessions'])
+        self.assertEqual(1, statistics['evicted'])
+
+    def test_per_accessory_limit_evicts_session_of_same_accessory(self):
+        manager = self.manager(max_sessions_per_accessory=1)
+        other = FakePairing('other')
+        first = FakePairing('a')
+        second = FakePairing('a')
+        for pairing in (first, other, second):
+            with manager.use(pairing):
+                pass
+        self.assertIsNone(first.session)
+        self.assertIsNotNone(other.session)
+        self.assertEqual({'other': 1, 'a': 1}, manager.statistics()['accessories'])
+
+    def test_sessions_in_use_are_not_evicted(self):
+        manager = self.manager(max_sessions=1, wait_timeout=0.2)
+        first = FakePairing('1')
+        with manager.use(first):
+            self.assertRaises(ConnectionLimitError, manager.acquire, FakePairing('2'))
+        self.assertIsNotNone(first.session)
+        self.assertGreater(manager.statistics()['waits'], 0)
+
+    def test_waits_for_session_to_become_idle(self):
+        manager = self.manager(max_sessions=1, wait_timeout=5)
+        first = FakePairing('1')
+        second = FakePairing('2')
+        manager.acquire(first)
+        threading.Timer(0.2, manager.release, args=(first,)).start()
+        with manager.use(second):
+            self.assertIsNone(first.session)
+            self.assertIsNotNone(second.session)
+
+    def test_idle_sessions_are_closed(self):
+        manager = self.manager(idle_timeout=60)
+        pairing = FakePairing('1')
+        with manager.use(pairing):
+            self.assertEqual(0, manager.close_idle(0))
+        self.assertEqual(1, manager.close_idle(0))
+        self.assertIsNone(pairing.session)
+        self.assertEqual(1, manager.statistics()['closed_idle'])
+
+    def test_concurrent_handshakes_are_limited(self):
+        self.handshake_delay = 0.05
+        manager = self.manager(max_handshakes=2)
+        pairings = [FakePairing(str(i)) for i in range(6)]
+        self.assertEqual(6, manager.prewarm(pairings))
+        self.assertEqual(2, self.max_running)
+        self.assertEqual(6, manager.statistics()['sessions'])
+
+    def test_prewarm_respects_max_sessions(self):
+        manager = self.manager(max_sessions=2)
+        pairings = [FakePairing(str(i)) for i in range(3)]
+        self.assertEqual(2, manager.prewarm(pairings))
+        self.assertIsNone(pairings[2].session)
+
+    def test_failed_connect(self):
+        manager = self.manager(session_factory=lambda pairing: FakeSession(connected=False))
+        pairing = FakePairing('1')
+        self.assertRaises(AccessoryDisconnectedError, manager.acquire, pairing)
+        statistics = manager.statistics()
+        self.assertEqual(0, statistics['sessions'])
+        self.assertEqual(0, statistics['connecting'])
+        self.assertEqual(1, statistics['failed'])
+        self.assertEqual(0, manager.prewarm([pairing]))
+
+    def test_discard_and_close_all(self):
+        manager = self.manager()
+        first = FakePairing('1')
+        second = FakePairing('2')
+        for pairing in (first, second):
+            with manager.use(pairing):
+                pass
+        manager.discard(first)
+        self.assertIsNone(first.session)
+        self.assertEqual(1, manager.statistics()['sessions'])
+        manager.close_all()
+        self.assertIsNone(second.session)
+        self.assertEqual(0, manager.statistics()['sessions'])
@@ -14,14 +14,17 @@
 # limitations under the License.
 #
 
+import json
 import unittest
 import tempfile
 import threading
 import time
 import os
+from unittest import mock
 
 from homekit import Controller
 from homekit import AccessoryServer
+from homekit.accessoryserver import AccessoryRequestHandler
 from homekit.exceptions import AccessoryNotFoundError, AlreadyPairedError, UnavailableError, FormatError, \
     ConfigLoadingError, ConfigSavingError, MalformedPinError
 from homekit.model import Accessory
@@ -33,7 +36,8 @@ if BLE_TRANSPORT_SUPPORTED:
     from homekit.controller.ble_impl import BlePairing
 
 if IP_TRANSPORT_SUPPORTED:
-    from homekit.controller.ip_implementation import IpPairing
+    from homekit.controller.connection_manager import ConnectionManager
+    from homekit.controller.ip_implementation import IpPairing, IpSession
 
 
 class T(threading.Thread):
@@ -142,6 +146,8 @@ class TestControllerIpUnpaired(unittest.TestCase):
         pairings = self.controller.get_pairings()
         self.controller.save_data(self.controller_file.name)
         self.assertIn('alias', pairings)
+        # the next pair setup uses a new salt
+        self.assertIsNone(self.httpd.data.srp_verifier)
 
     def test_02_pair_accessory_not_found(self):
         """"""
@@ -345,6 +351,95 @@ class TestControllerIpPaired(unittest.TestCase):
         self.assertEqual(64, result[(1, 4)]['maxLen'])
         self.assertNotIn('Wrong content type', '\n'.join(self.__class__.logger))
 
+    def test_04_6_get_characteristic_with_resumed_session(self):
+        resumed = []
+        pair_resume = AccessoryRequestHandler._pair_resume
+
+        def spy(handler, d_req):
+            resumed.append(pair_resume(handler, d_req))
+            return resumed[-1]
+
+        self.controller.load_data(self.controller_file.name)
+        pairing = self.controller.get_pairings()['alias']
+        pairing.get_characteristics([(1, 4)])
+        pairing.close()
+        pairing.session = None
+        with mock.patch.object(AccessoryRequestHandler, '_pair_resume', spy):
+            result = pairing.get_characteristics([(1, 4)])
+        self.assertEqual([True], resumed)
+        self.assertEqual('lusiardi.de', result[(1, 4)]['value'])
+        self.assertNotIn('Wrong content type', '\n'.join(self.__class__.logger))
+
+    def test_04_7_get_characteristics_pipelined(self):
+        self.controller.load_data(self.controller_file.name)
+        pairing = self.controller.get_pairings()['alias']
+        pairing.set_pipelining(True)
+        self.assertEqual('lusiardi.de', pairing.get_characteristics([(1, 4)])[(1, 4)]['value'])
+        self.assertTrue(pairing.session.sec_http.pipelining)
+        futures = [pairing.session.submit('GET', '/characteristics?id=1.{}'.format(iid)) for iid in [4, 10, 4]]
+        results = [json.loads(f.result().read().decode())['characteristics'][0] for f in futures]
+        self.assertEqual([4, 10, 4], [r['iid'] for r in results])
+        self.assertEqual('lusiardi.de', results[2]['value'])
+        self.assertNotIn('Wrong content type', '\n'.join(self.__class__.logger))
+
+    def test_04_8_get_characteristics_deduplicated(self):
+        """Reads issued while a read is running are merged into one request."""
+        self.controller.load_data(self.controller_file.name)
+        pairing = self.controller.get_pairings()['alias']
+        started = threading.Event()
+        original_get = IpSession.get
+
+        def slow_get(session, url):
+            started.set()
+            time.sleep(0.3)
+            return original_get(session, url)
+
+        results = []
+        with mock.patch.object(IpSession, 'get', autospec=True, side_effect=slow_get) as get:
+            first = threading.Thread(target=lambda: results.append(pairing.get_characteristics([(1, 4)])))
+            first.start()
+            started.wait(5)
+            others = [threading.Thread(target=lambda: results.append(pairing.get_characteristics([(1, 4), (1, 10)])))
+                      for _ in range(3)]
+            for thread in others:
+                thread.start()
+            for thread in [first] + others:
+                thread.join(5)
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(r[(1, 4)]['value'] == 'lusiardi.de' for r in results))
+        self.assertEqual(2, get.call_count)
+        statistics = pairing.read_statistics()
+        self.assertEqual((4, 2, 2), (statistics['calls'], statistics['reads'], statistics['saved']))
+
+    def test_04_9_get_characteristics_cached(self):
+        """Reads with max_age are served from the value cache until the characteristic is written."""
+        self.controller.load_data(self.controller_file.name)
+        pairing = self.controller.get_pairings()['alias']
+        pairing.list_accessories_and_characteristics()
+        with mock.patch.object(IpSession, 'get', autospec=True, side_effect=IpSession.get) as get:
+            self.assertEqual('lusiardi.de', pairing.get_characteristics([(1, 4)], max_age=60)[(1, 4)]['value'])
+            self.assertEqual(1, get.call_count)
+            result = pairing.get_characteristics([(1, 4), (1, 10)], max_age=60)
+            self.assertEqual('lusiardi.de', result[(1, 4)]['value'])
+            self.assertIn('value', result[(1, 10)])
+            # only (1, 10) was read
+            self.assertEqual(2, get.call_count)
+            self.assertTrue(get.call_args[0][1].endswith('id=1.10'))
+            self.assertEqual(result, pairing.get_characteristics([(1, 4), (1, 10)], max_age=60))
+            self.assertEqual(2, get.call_count)
+            # without max_age and with include_* options the accessory is asked
+            pairing.get_characteristics([(1, 4)])
+            pairing.get_characteristics([(1, 4)], include_type=True, max_age=60)
+            self.assertEqual(4, get.call_count)
+
+            pairing.put_characteristics([(1, 10, True)])
+            self.assertEqual({'value': True}, pairing.get_characteristics([(1, 10)], max_age=60)[(1, 10)])
+            self.assertEqual(5, get.call_count)
+        statistics = pairing.read_statistics()
+        self.assertEqual((3, 3), (statistics['hits'], statistics['misses']))
+        self.assertEqual(2, statistics['cached'])
+        pairing.put_characteristics([(1, 10, False)])
+
     def test_05_1_put_characteristic(self):
         """"""
         global value
@@ -378,6 +473,29 @@ class TestControllerIpPaired(unittest.TestCase):
         self.assertRaises(FormatError, pairing.put_characteristics, [(1, 10, 'Hallo Welt')], do_conversion=True)
         self.assertNotIn('Wrong content type', '\n'.join(self.__class__.logger))
 
+    def test_05_3_put_characteristics_coalesced(self):
+        """Writes within the coalescing window are sent as one request with the last value per characteristic."""
+        self.controller.load_data(self.controller_file.name)
+        pairing = self.controller.get_pairings()['alias']
+        pairing.list_accessories_and_characteristics()
+        pairing.set_write_coalescing(0.2)
+        pairing.get_characteristics([(1, 10)])
+        with mock.patch.object(IpSession, 'put', autospec=True, side_effect=IpSession.put) as put:
+            on = pairing.submit_characteristics([(1, 10, 'On')], do_conversion=True)
+            # the cached value is dropped before the write is sent
+            self.assertEqual({}, pairing.value_cache.lookup([(1, 10)], 60))
+            off = pairing.submit_characteristics([(1, 10, False)])
+            # the manufacturer is read only
+            manufacturer = pairing.submit_characteristics([(1, 4, 'test')])
+            self.assertEqual({(1, 10): {'status': 0, 'description': 'This specifies a success for the request.'}},
+                             on.result(5))
+            self.assertEqual(on.result(), off.result())
+            self.assertEqual([(1, 4)], list(manufacturer.result()))
+            self.assertNotEqual(0, manufacturer.result()[(1, 4)]['status'])
+        self.assertEqual(1, put.call_count)
+        self.assertEqual(0, value)
+        self.assertRaises(FormatError, pairing.submit_characteristics, [(1, 10, 'maybe')], do_conversion=True)
+
     def test_06_list_pairings(self):
         """Gets the listing of registered controllers of the device. Count must be 1."""
         self.controller.load_data(self.controller_file.name)
@@ -410,6 +528,100 @@ class TestControllerIpPaired(unittest.TestCase):
         identify = 0
         self.assertNotIn('Wrong content type', '\n'.join(self.__class__.logger))
 
+    def test_08_events_and_requests_share_session(self):
+        """Events are received while requests use the same session."""
+        self.controller.load_data(self.controller_file.name)
+        pairing = self.controller.get_pairings()['alias']
+        pairing.get_characteristics([(1, 10)])
+        session = pairing.session
+        events = []
+        t = threading.Thread(target=pairing.get_events, args=([(1, 10)], events.extend),
+                             kwargs={'max_events': 1, 'max_seconds': 10})
+        t.start()
+        while not session.sec_http.reader_running:
+            time.sleep(0.1)
+        # wait for the subscription to be done
+        time.sleep(1)
+        self.assertEqual('lusiardi.de', pairing.get_characteristics([(1, 4)])[(1, 4)]['value'])
+
+        # a second controller changes the value which causes the event
+        other_controller = Controller()
+        other_controller.load_data(self.controller_file.name)
+        other_pairing = other_controller.get_pairings()['alias']
+        other_pairing.put_characteristics([(1, 10, True)])
+        other_pairing.put_characteristics([(1, 10, False)])
+        other_controller.shutdown()
+        t.join()
+        self.assertIs(session, pairing.session)
+        self.assertEqual((1, 10, True), events[0])
+        # without event listeners the background reader stops and requests read their responses directly
+        deadline = time.monotonic() + 5
+        while session.sec_http.reader_running and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.assertFalse(session.sec_http.reader_running)
+        self.assertEqual('lusiardi.de', pairing.get_characteristics([(1, 4)])[(1, 4)]['value'])
+        # the event refreshed the value cache
+        self.assertEqual({(1, 10): {'value': True}}, pairing.get_characteristics([(1, 10)], max_age=60))
+        self.assertNotIn('Wrong content type', '\n'.join(self.__class__.logger))
+
+    def test_09_prewarm_and_statistics(self):
+        """Prewarmed sessions are reused by the requests of the pairing."""
+        self.controller = Controller(connection_manager=ConnectionManager())
+        self.controller.load_data(self.controller_file.name)
+        self.assertEqual(1, self.controller.prewarm())
+        pairing = self.controller.get_pairings()['alias']
+        session = pairing.session
+        self.assertIsNotNone(session)
+        pairing.get_characteristics([(1, 4)])
+        self.assertIs(session, pairing.session)
+        statistics = self.controller.connection_manager.statistics()
+        self.assertEqual(1, statistics['sessions'])
+        self.assertEqual(1, statistics['idle'])
+        self.assertEqual({'12:34:56:00:01:0A': 1}, statistics['accessories'])
+        self.assertEqual(1, statistics['handshakes'])
+        self.assertEqual(1, statistics['reused'])
+
+    def test_09_prewarm_without_connection_manager(self):
+        """By default each pairing keeps its own session and calls are not retried."""
+        self.controller.load_data(self.controller_file.name)
+        pairing = self.controller.get_pairings()['alias']
+        self.assertIsNone(pairing.connection_manager)
+        self.assertIsNone(pairing.retry_policy)
+        self.assertEqual(1, self.controller.prewarm())
+        session = pairing.session
+        self.assertIsNotNone(session)
+        pairing.get_characteristics([(1, 4)])
+        self.assertIs(session, pairing.session)
+
+    def test_10_accessories_cached_by_config_number(self):
+        """The attribute database is only fetched again if the configuration number changes."""
+        self.controller.load_data(self.controller_file.name)
+        pairing = self.controller.get_pairings()['alias']
+        self.assertFalse(pairing.update_config_number('1'))
+        accessories = pairing.list_accessories_and_characteristics()
+        self.assertEqual(1, pairing.pairing_data['accessories_config_number'])
+        self.assertIs(accessories, pairing.list_accessories_and_characteristics())
+
+        # the cache is kept with the pairing data
+        self.controller.save_data(self.controller_file.name)
+        controller = Controller()
+        controller.load_data(self.controller_file.name)
+        cached = controller.get_pairings()['alias']
+        self.assertEqual(accessories, cached.list_accessories_and_characteristics())
+        self.assertIsNone(cached.session)
+        controller.shutdown()
+
+        self.assertTrue(pairing.update_config_number(2))
+        fetched = pairing.list_accessories_and_characteristics()
+        self.assertIsNot(accessories, fetched)
+        self.assertEqual(accessories, fetched)
+        self.assertEqual(2, pairing.pairing_data['accessories_config_number'])
+
+        # refresh fetches the database although it is cached
+        refreshed = pairing.list_accessories_and_characteristics(refresh=True)
+        self.assertIsNot(fetched, refreshed)
+        self.assertEqual(accessories, refreshed)
+
     def test_99_remove_pairing(self):
         """Tests that a removed pairing is not present in the list of pairings anymore."""
         self.controller.load_data(self.controller_file.name)
@@ -0,0 +1,123 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+import socket
+import unittest
+
+from homekit.crypto import SessionCipher
+from homekit.exceptions import EncryptionError
+from homekit.http_impl import HapFrameDecoder
+
+KEY = bytes(range(32))
+DATA = bytes(range(256)) * 20
+
+
+class TestHapFrameDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = SessionCipher(KEY).seal_frames(DATA)
+        self.decoder = HapFrameDecoder(SessionCipher(KEY))
+
+    def test_decode_byte_by_byte(self):
+        result = bytearray()
+        for position in range(len(self.frames)):
+            self.decoder.feed(self.frames[position:position + 1])
+            for segment in self.decoder.decode():
+                result += segment
+        self.assertEqual(DATA, result)
+        self.assertEqual(0, self.decoder.pending)
+
+    def test_incomplete_frame_is_kept(self):
+        self.decoder.feed(self.frames[:1100])
+        self.assertTrue(self.decoder.has_frame())
+        self.assertEqual([DATA[:1024]], self.decoder.decode())
+        self.assertEqual(1100 - 1042, self.decoder.pending)
+        self.assertFalse(self.decoder.has_frame())
+        self.assertEqual([], self.decoder.decode())
+
+    def test_small_buffer_is_compacted_and_enlarged(self):
+        decoder = HapFrameDecoder(SessionCipher(KEY), buffer_size=0)
+        result = bytearray()
+        for position in range(0, len(self.frames), 700):
+            decoder.feed(self.frames[position:position + 700])
+            for segment in decoder.decode():
+                result += segment
+        self.assertEqual(DATA, result)
+        decoder.feed(bytes(5000))
+        self.assertEqual(5000, decoder.pending)
+
+    def test_get_buffer_and_buffer_updated(self):
+        view = self.decoder.get_buffer(len(self.frames))
+        view[:len(self.frames)] = self.frames
+        self.decoder.buffer_updated(len(self.frames))
+        self.assertEqual(DATA, b''.join(self.decoder.decode()))
+
+    def test_invalid_frame(self):
+        self.frames[10] ^= 1
+        self.decoder.feed(self.frames)
+        self.assertRaises(EncryptionError, self.decoder.decode)
+
+    def test_blocking_socket(self):
+        a, b = socket.socketpair()
+        try:
+            a.sendall(self.frames)
+            a.close()
+            result = bytearray()
+            while True:
+                received = self.decoder.receive_from(b)
+                for segment in self.decoder.decode():
+                    result += segment
+                if received == 0:
+                    break
+            self.assertEqual(DATA, result)
+        finally:
+            b.close()
+
+    def test_non_blocking_socket_and_stream(self):
+        a, b = socket.socketpair()
+        try:
+            b.setblocking(0)
+            self.assertIsNone(self.decoder.receive_from(b))
+            stream = b.makefile('rb')
+            self.assertIsNone(self.decoder.receive_from(stream))
+            a.sendall(self.frames[:100])
+            b.setblocking(1)
+            self.assertEqual(100, self.decoder.receive_from(stream))
+            self.assertEqual([], self.decoder.decode())
+            a.close()
+            self.assertEqual(0, self.decoder.receive_from(stream))
+            stream.close()
+        finally:
+            b.close()
+
+    def test_asyncio_stream(self):
+        loop = asyncio.new_event_loop()
+        try:
+            reader = asyncio.StreamReader(loop=loop)
+            reader.feed_data(self.frames)
+            reader.feed_eof()
+
+            async def read_all():
+                result = bytearray()
+                while await self.decoder.receive_from_stream(reader):
+                    for segment in self.decoder.decode():
+                        result += segment
+                return result
+
+            self.assertEqual(DATA, loop.run_until_complete(read_all()))
+        finally:
+            loop.close()
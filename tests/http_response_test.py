@@ -169,3 +169,44 @@ class TestHttpResponse(unittest.TestCase):
         self.assertEqual(res.code, 200)
         self.assertEqual(res.get_http_name(), 'HTTP')
         json.loads(res.body.decode())
+
+    def test_chunked_response_in_one_part(self):
+        chunk = b'{"value": 1}\r\n' * 10
+        data = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n' + \
+            (b'%x\r\n' % len(chunk) + chunk + b'\r\n') * 1000 + b'0\r\n\r\n'
+        res = HttpResponse()
+        self.assertEqual(bytearray(), res.parse(data))
+        self.assertTrue(res.is_read_completely())
+        self.assertEqual(chunk * 1000, res.body)
+
+    def test_chunk_split_within_size_line(self):
+        res = TestHttpResponse.parse([
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n1', b'0;ext=1\r\n0123456789abcdef\r', b'\n0\r',
+            b'\n\r\n'
+        ])
+        self.assertTrue(res.is_read_completely())
+        self.assertEqual(b'0123456789abcdef', res.body)
+
+    def test_content_length_body_with_line_breaks(self):
+        body = b'line\r\n' * 500
+        data = b'HTTP/1.1 200 OK\r\nContent-Length: 3000\r\n\r\n' + body
+        res = TestHttpResponse.parse([data[i:i + 100] for i in range(0, len(data), 100)])
+        self.assertTrue(res.is_read_completely())
+        self.assertEqual(body, res.body)
+
+    def test_data_after_response_is_returned(self):
+        event = b'EVENT/1.0 200 OK\r\nContent-Length: 2\r\n\r\n{}'
+        res = HttpResponse()
+        remaining = res.parse(b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nabcd' + event)
+        self.assertEqual(b'abcd', res.body)
+        self.assertEqual(event, remaining)
+
+    def test_headers(self):
+        res = TestHttpResponse.parse([
+            b'HTTP/1.1 200 OK\r\nContent-Type: image/jpeg\r\ncontent-length: 0\r\n\r\n'
+        ])
+        self.assertEqual([('Content-Type', 'image/jpeg'), ('content-length', '0')], res.headers)
+        self.assertEqual('image/jpeg', res.get_header('content-type'))
+        self.assertEqual('0', res.get_header('Content-Length'))
+        self.assertIsNone(res.get_header('Transfer-Encoding'))
+        self.assertEqual('x', res.get_header('Transfer-Encoding', 'x'))
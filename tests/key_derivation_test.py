@@ -0,0 +1,55 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import hashlib
+
+import hkdf
+
+from homekit.crypto import HkdfSha512, derive_keys
+
+
+class TestKeyDerivation(unittest.TestCase):
+
+    def test_rfc5869_inputs(self):
+        # the test vectors of RFC 5869 use SHA-256, so the inputs of test case 1 are checked against the hkdf package
+        ikm = bytes.fromhex('0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b')
+        salt = bytes.fromhex('000102030405060708090a0b0c')
+        info = bytes.fromhex('f0f1f2f3f4f5f6f7f8f9')
+        expected = hkdf.Hkdf(salt, ikm, hash=hashlib.sha512).expand(info, 42)
+        self.assertEqual(expected, HkdfSha512(salt, ikm).expand(info, 42))
+
+    def test_expand_matches_hkdf(self):
+        shared_secret = bytes(range(32))
+        reference = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
+        derived = HkdfSha512('Control-Salt'.encode(), shared_secret)
+        for info in ['Control-Write-Encryption-Key', 'Control-Read-Encryption-Key']:
+            self.assertEqual(reference.expand(info.encode(), 32), derived.expand(info.encode()))
+        for length in [1, 8, 64, 65, 200]:
+            self.assertEqual(reference.expand(b'info', length), derived.expand(b'info', length))
+
+    def test_derive_keys(self):
+        shared_secret = bytes(range(32))
+        reference = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
+        write_key, read_key = derive_keys('Control-Salt'.encode(), shared_secret,
+                                          'Control-Write-Encryption-Key'.encode(),
+                                          'Control-Read-Encryption-Key'.encode())
+        self.assertEqual(reference.expand('Control-Write-Encryption-Key'.encode(), 32), write_key)
+        self.assertEqual(reference.expand('Control-Read-Encryption-Key'.encode(), 32), read_key)
+        self.assertEqual((), derive_keys(b'salt', shared_secret))
+
+    def test_expand_too_long(self):
+        self.assertRaises(ValueError, HkdfSha512(b'salt', b'ikm').expand, b'info', 255 * 64 + 1)
@@ -0,0 +1,186 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
+import unittest
+
+from homekit.controller.read_deduplicator import ReadDeduplicator
+from homekit.exceptions import AccessoryDisconnectedError
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit.controller.ip_implementation import IpPairing
+
+
+class FakeResponse(object):
+
+    def __init__(self, code, body=b''):
+        self.code = code
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class SlowReadSession(object):
+    """
+    A session for one boolean characteristic (1, 10). Reads return the value at the time the request was sent and
+    block until released, writes are done at once.
+    """
+
+    def __init__(self):
+        self.sock = object()
+        self.value = False
+        self.reading = threading.Event()
+        self.release = threading.Event()
+        self.gets = 0
+
+    def close(self):
+        pass
+
+    def get(self, url):
+        self.gets += 1
+        body = json.dumps({'characteristics': [{'aid': 1, 'iid': 10, 'value': self.value}]}).encode()
+        self.reading.set()
+        self.release.wait(5)
+        return FakeResponse(200, body)
+
+    def put(self, url, body):
+        self.value = json.loads(body)['characteristics'][0]['value']
+        return FakeResponse(204)
+
+
+class TestReadDeduplicator(unittest.TestCase):
+
+    def setUp(self):
+        self.reads = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.error = None
+        self.executor = ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    def read(self, characteristics, include_meta=False):
+        self.reads.append((characteristics, include_meta))
+        self.started.set()
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return {(aid, iid): {'value': aid * 100 + iid} for aid, iid in characteristics}
+
+    def wait_for_waiting(self, deduplicator, calls):
+        # the calls are made from other threads, wait until they are registered
+        for _ in range(500):
+            if deduplicator.statistics()['calls'] == calls:
+                return
+            time.sleep(0.01)
+        self.fail('calls did not arrive')
+
+    def test_single_read(self):
+        self.release.set()
+        deduplicator = ReadDeduplicator(self.read)
+        self.assertEqual({(1, 10): {'value': 110}}, deduplicator.read([('1', '10')]))
+        self.assertEqual({(1, 10): {'value': 110}}, deduplicator.read([(1, 10)]))
+        self.assertEqual({'calls': 2, 'reads': 2, 'saved': 0}, deduplicator.statistics())
+
+    def test_concurrent_reads_are_merged(self):
+        deduplicator = ReadDeduplicator(self.read)
+        first = self.executor.submit(deduplicator.read, [(1, 10), (1, 11)])
+        self.started.wait(5)
+        # covered by the running read
+        second = self.executor.submit(deduplicator.read, [(1, 11)])
+        # partially covered, the rest is read together in the next read
+        third = self.executor.submit(deduplicator.read, [(1, 10), (1, 12)])
+        fourth = self.executor.submit(deduplicator.read, [(1, 13), (1, 12)])
+        self.wait_for_waiting(deduplicator, 4)
+        self.release.set()
+
+        self.assertEqual({(1, 10): {'value': 110}, (1, 11): {'value': 111}}, first.result(5))
+        self.assertEqual({(1, 11): {'value': 111}}, second.result(5))
+        self.assertEqual({(1, 10): {'value': 110}, (1, 12): {'value': 112}}, third.result(5))
+        self.assertEqual({(1, 12): {'value': 112}, (1, 13): {'value': 113}}, fourth.result(5))
+        self.assertEqual([[(1, 10), (1, 11)], [(1, 12), (1, 13)]], [sorted(keys) for keys, _ in self.reads])
+        self.assertEqual({'calls': 4, 'reads': 2, 'saved': 2}, deduplicator.statistics())
+
+    def test_written_characteristics_are_read_again(self):
+        deduplicator = ReadDeduplicator(self.read)
+        first = self.executor.submit(deduplicator.read, [(1, 10), (1, 11)])
+        self.started.wait(5)
+        # the running read may return the values from before the write
+        deduplicator.written([(1, 10)])
+        second = self.executor.submit(deduplicator.read, [(1, 10), (1, 11)])
+        self.wait_for_waiting(deduplicator, 2)
+        self.release.set()
+        first.result(5)
+        second.result(5)
+        self.assertEqual([[(1, 10), (1, 11)], [(1, 10)]], [keys for keys, _ in self.reads])
+
+    def test_reads_with_different_options_are_not_merged(self):
+        deduplicator = ReadDeduplicator(self.read)
+        first = self.executor.submit(deduplicator.read, [(1, 10)], False)
+        self.started.wait(5)
+        second = self.executor.submit(deduplicator.read, [(1, 10)], True)
+        self.wait_for_waiting(deduplicator, 2)
+        self.release.set()
+        first.result(5)
+        second.result(5)
+        self.assertEqual([([(1, 10)], False), ([(1, 10)], True)], sorted(self.reads))
+
+    def test_errors_are_passed_to_all_callers(self):
+        self.error = AccessoryDisconnectedError('gone')
+        deduplicator = ReadDeduplicator(self.read)
+        first = self.executor.submit(deduplicator.read, [(1, 10)])
+        self.started.wait(5)
+        second = self.executor.submit(deduplicator.read, [(1, 10)])
+        third = self.executor.submit(deduplicator.read, [(1, 11)])
+        self.wait_for_waiting(deduplicator, 3)
+        self.release.set()
+        for future in [first, second, third]:
+            self.assertIsInstance(future.exception(5), AccessoryDisconnectedError)
+        self.assertEqual(2, len(self.reads))
+
+        # the failed reads do not block later reads
+        self.error = None
+        self.assertEqual({(1, 10): {'value': 110}}, deduplicator.read([(1, 10)]))
+
+    @unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+    def test_ip_pairing_reads_after_write_see_the_write(self):
+        session = SlowReadSession()
+        pairing = IpPairing({'AccessoryPairingID': 'id', 'accessories': [
+            {'aid': 1, 'services': [{'iid': 9, 'type': '43', 'characteristics': [
+                {'iid': 10, 'type': '25', 'format': 'bool'}]}]}]})
+        pairing.session = session
+
+        before = self.executor.submit(pairing.get_characteristics, [(1, 10)])
+        session.reading.wait(5)
+        # the write happens while the read of the old value is running
+        pairing.put_characteristics([(1, 10, True)])
+        after = self.executor.submit(pairing.get_characteristics, [(1, 10)], max_age=60)
+        self.wait_for_waiting(pairing.read_deduplicator, 2)
+        session.release.set()
+
+        self.assertEqual({(1, 10): {'value': False}}, before.result(5))
+        self.assertEqual({(1, 10): {'value': True}}, after.result(5))
+        self.assertEqual(2, session.gets)
+        # the old value of the first read did not replace the one read after the write
+        self.assertEqual({(1, 10): {'value': True}}, pairing.get_characteristics([(1, 10)], max_age=60))
+        self.assertEqual(2, session.gets)
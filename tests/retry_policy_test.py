@@ -0,0 +1,198 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from homekit.controller.connection_manager import ConnectionManager
+from homekit.controller.retry_policy import CircuitBreaker, RetryPolicy
+from homekit.exceptions import AccessoryDisconnectedError, AccessoryNotFoundError, CircuitOpenError, FormatError
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit.controller.ip_implementation import IpPairing
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse(object):
+    code = 204
+
+    def __init__(self, body):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class FakeSession(object):
+    """
+    A session that fails the first requests with the given errors.
+    """
+
+    def __init__(self, errors):
+        self.sock = object()
+        self.errors = errors
+        self.requests = []
+
+    def close(self):
+        self.sock = None
+
+    def _request(self, *args):
+        self.requests.append(args)
+        if self.errors:
+            raise self.errors.pop(0)
+        return FakeResponse(b'{"characteristics": [{"aid": 1, "iid": 4, "value": "lusiardi.de"}]}')
+
+    def get(self, url):
+        return self._request('GET', url)
+
+    def put(self, url, body):
+        return self._request('PUT', url, body)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.policy = RetryPolicy(max_attempts=3, initial_backoff=0.1, max_backoff=0.3, failure_threshold=5,
+                                  reset_timeout=30, sleep=self.clock.sleep, clock=self.clock)
+
+    def failing(self, errors, send=True):
+        attempts = []
+
+        def function(attempt):
+            attempts.append(attempt.number)
+            if send:
+                attempt.request_sent = True
+            if errors:
+                raise errors.pop(0)
+            return 'result'
+        return function, attempts
+
+    def test_retry_with_exponential_backoff(self):
+        function, attempts = self.failing([AccessoryDisconnectedError('a'), AccessoryDisconnectedError('b')])
+        self.assertEqual('result', self.policy.call('id', function, idempotent=True))
+        self.assertEqual([1, 2, 3], attempts)
+        self.assertEqual([0.1, 0.2], self.clock.sleeps)
+        self.assertEqual(CircuitBreaker.CLOSED, self.policy.breaker('id').state)
+        self.assertEqual(0, self.policy.breaker('id').failures)
+
+    def test_backoff_is_limited(self):
+        self.assertEqual([0.1, 0.2, 0.3, 0.3], [self.policy.backoff(n) for n in range(1, 5)])
+
+    def test_gives_up_after_max_attempts(self):
+        function, attempts = self.failing([AccessoryDisconnectedError(str(i)) for i in range(3)])
+        self.assertRaises(AccessoryDisconnectedError, self.policy.call, 'id', function, True)
+        self.assertEqual([1, 2, 3], attempts)
+
+    def test_non_idempotent_call_is_not_repeated_after_sending(self):
+        function, attempts = self.failing([AccessoryDisconnectedError('a')])
+        self.assertRaises(AccessoryDisconnectedError, self.policy.call, 'id', function, False)
+        self.assertEqual([1], attempts)
+
+    def test_non_idempotent_call_is_retried_before_sending(self):
+        function, attempts = self.failing([AccessoryDisconnectedError('a')], send=False)
+        self.assertEqual('result', self.policy.call('id', function, idempotent=False))
+        self.assertEqual([1, 2], attempts)
+
+    def test_other_errors_are_not_retried(self):
+        function, attempts = self.failing([FormatError('a')])
+        self.assertRaises(FormatError, self.policy.call, 'id', function, True)
+        self.assertEqual([1], attempts)
+        self.assertEqual(0, self.policy.breaker('id').failures)
+
+    def test_accessory_not_found_counts_as_failure_without_retry(self):
+        function, attempts = self.failing([AccessoryNotFoundError('a')])
+        self.assertRaises(AccessoryNotFoundError, self.policy.call, 'id', function, True)
+        self.assertEqual([1], attempts)
+        self.assertEqual(1, self.policy.breaker('id').failures)
+
+    def test_circuit_opens_and_fails_fast(self):
+        policy = RetryPolicy(max_attempts=3, initial_backoff=0.1, failure_threshold=2, sleep=self.clock.sleep,
+                             clock=self.clock)
+        function, attempts = self.failing([AccessoryDisconnectedError(str(i)) for i in range(6)])
+        self.assertRaises(AccessoryDisconnectedError, policy.call, 'id', function, True)
+        self.assertEqual(CircuitBreaker.CLOSED, policy.breaker('id').state)
+        # the circuit opens when the second call failed
+        self.assertRaises(AccessoryDisconnectedError, policy.call, 'id', function, True)
+        self.assertEqual(6, len(attempts))
+        self.assertEqual(CircuitBreaker.OPEN, policy.breaker('id').state)
+        self.assertRaises(CircuitOpenError, policy.call, 'id', function, True)
+        self.assertEqual(6, len(attempts))
+        # other accessories are not affected
+        self.assertEqual('result', policy.call('other', function, True))
+
+    def test_failures_are_counted_per_call(self):
+        policy = RetryPolicy(sleep=self.clock.sleep, clock=self.clock)
+        function, attempts = self.failing([AccessoryDisconnectedError(str(i)) for i in range(3)])
+        self.assertRaises(AccessoryDisconnectedError, policy.call, 'id', function, True)
+        self.assertEqual(3, len(attempts))
+        # with the defaults, one call failing all its attempts does not open the circuit
+        self.assertEqual(1, policy.breaker('id').failures)
+        self.assertEqual(CircuitBreaker.CLOSED, policy.breaker('id').state)
+        self.assertEqual('result', policy.call('id', function, True))
+        self.assertEqual(0, policy.breaker('id').failures)
+
+    def test_half_open_circuit(self):
+        breaker = CircuitBreaker('id', failure_threshold=1, reset_timeout=10, clock=self.clock)
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+        self.clock.now += 10
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+        breaker.before_call()
+        # only one trial call at a time
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.clock.now += 10
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        breaker.before_call()
+
+    @unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+    def test_ip_pairing_retries_reads_only(self):
+        sessions = []
+
+        def create_session(pairing):
+            sessions.append(FakeSession([AccessoryDisconnectedError('broken')] if not sessions else []))
+            return sessions[-1]
+
+        manager = ConnectionManager(session_factory=create_session)
+        pairing = IpPairing({'AccessoryPairingID': 'id', 'accessories': []}, manager, self.policy)
+
+        result = pairing.get_characteristics([(1, 4)])
+        self.assertEqual('lusiardi.de', result[(1, 4)]['value'])
+        # the broken session was replaced
+        self.assertEqual(2, len(sessions))
+        self.assertIsNone(sessions[0].sock)
+
+        sessions[1].errors.append(AccessoryDisconnectedError('broken'))
+        self.assertRaises(AccessoryDisconnectedError, pairing.put_characteristics, [(1, 10, True)])
+        self.assertEqual(1, len([r for r in sessions[1].requests if r[0] == 'PUT']))
+        self.assertEqual(2, len(sessions))
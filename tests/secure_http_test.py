@@ -14,12 +14,16 @@
 # limitations under the License.
 #
 
+from concurrent.futures import TimeoutError
 import unittest
 from unittest import mock
 import socket
 import threading
+import time
 
 from homekit.http_impl.secure_http import SecureHttp
+from homekit.http_impl.frame_decoder import HapFrameDecoder
+from homekit.crypto.session_cipher import SessionCipher
 from homekit.exceptions import AccessoryDisconnectedError, EncryptionError
 from homekit.crypto.chacha20poly1305 import chacha20_aead_encrypt, chacha20_aead_decrypt
 
@@ -72,6 +76,69 @@ class ResponseProvider(threading.Thread):
         self.sock.send(combined_data)
 
 
+class ClosingResponseProvider(ResponseProvider):
+    """
+    Closes the connection after sending the response.
+    """
+
+    def run(self):
+        ResponseProvider.run(self)
+        self.sock.close()
+
+
+class PipelinedResponseProvider(threading.Thread):
+    """
+    Waits until all expected requests were received and answers each with its request target as body. If
+    close_after is set, the connection is closed after that number of responses.
+    """
+
+    def __init__(self, sock, c2a_key, a2c_key, expected, close_after=None):
+        threading.Thread.__init__(self)
+        self.sock = sock
+        self.decoder = HapFrameDecoder(SessionCipher(c2a_key))
+        self.a2c_cipher = SessionCipher(a2c_key)
+        self.expected = expected
+        self.close_after = close_after
+        self.targets = []
+
+    def run(self):
+        received = b''
+        while received.count(b'Host:') < self.expected:
+            self.decoder.receive_from(self.sock)
+            received += b''.join(self.decoder.decode())
+        for request in received.split(b'\r\n\r\n')[:-1]:
+            self.targets.append(request.split(b' ')[1])
+
+        responses = b''
+        for target in self.targets[:self.close_after]:
+            responses += b'HTTP/1.1 200 OK\r\nContent-Length: ' + str(len(target)).encode() + b'\r\n\r\n' + target
+        self.sock.sendall(self.a2c_cipher.seal_frames(responses))
+        if self.close_after is not None:
+            self.sock.close()
+
+
+class StaggeredResponseProvider(PipelinedResponseProvider):
+    """
+    Answers the expected requests like PipelinedResponseProvider, but sends each response after the given delay.
+    """
+
+    def __init__(self, sock, c2a_key, a2c_key, expected, delay):
+        PipelinedResponseProvider.__init__(self, sock, c2a_key, a2c_key, expected)
+        self.delay = delay
+
+    def run(self):
+        received = b''
+        while received.count(b'Host:') < self.expected:
+            self.decoder.receive_from(self.sock)
+            received += b''.join(self.decoder.decode())
+        for request in received.split(b'\r\n\r\n')[:-1]:
+            target = request.split(b' ')[1]
+            self.targets.append(target)
+            time.sleep(self.delay)
+            response = b'HTTP/1.1 200 OK\r\nContent-Length: ' + str(len(target)).encode() + b'\r\n\r\n' + target
+            self.sock.sendall(self.a2c_cipher.seal_frames(response))
+
+
 class TestSecureHttp(unittest.TestCase):
     def test_get_on_disconnected_device(self):
         with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
@@ -209,3 +276,396 @@ class TestSecureHttp(unittest.TestCase):
         accessory_socket.close()
         self.assertEqual(200, result.code)
         self.assertEqual(bytearray(b' ' * 1025), result.body)
+
+    def test_event_after_response_is_kept(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        tthread = ResponseProvider(accessory_socket, key_c2a, key_a2c)
+        tthread.data = ['HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n', '{}',
+                        'EVENT/1.0 200 OK\r\nContent-Length: 4\r\n\r\n', 'test']
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10)
+            result = sh.get('/')
+            tthread.join()
+            event = sh.handle_event_response()
+
+        controller_socket.close()
+        accessory_socket.close()
+        self.assertEqual(200, result.code)
+        self.assertEqual(b'{}', result.body)
+        self.assertEqual('EVENT', event.get_http_name())
+        self.assertEqual(b'test', event.body)
+
+    def test_connection_closed_by_accessory(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        tthread = ClosingResponseProvider(accessory_socket, key_c2a, key_a2c)
+        tthread.data = ['HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n', '01234']
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10)
+            start = time.monotonic()
+            self.assertRaises(AccessoryDisconnectedError, sh.get, '/')
+            self.assertLess(time.monotonic() - start, 5)
+
+        controller_socket.close()
+
+    def test_incomplete_response_after_deadline(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        tthread = ResponseProvider(accessory_socket, key_c2a, key_a2c)
+        tthread.data = ['HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n', '01234']
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=0.5)
+            start = time.monotonic()
+            result = sh.get('/')
+            duration = time.monotonic() - start
+
+        controller_socket.close()
+        accessory_socket.close()
+        self.assertEqual(200, result.code)
+        self.assertFalse(result.is_read_completely())
+        self.assertEqual(b'01234', result.body)
+        self.assertGreaterEqual(duration, 0.5)
+        self.assertLess(duration, 5)
+
+    def test_pipelined_requests(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        # the provider only answers once all requests were received
+        tthread = PipelinedResponseProvider(accessory_socket, key_c2a, key_a2c, 3)
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10, pipelining=True)
+            done = []
+            futures = [sh.submit('GET', '/first', callback=done.append),
+                       sh.submit('PUT', '/second', '{}', callback=done.append),
+                       sh.submit('GET', '/third', callback=done.append)]
+            # waiting for the last response also resolves the ones before
+            self.assertEqual(b'/third', futures[2].result().body)
+            tthread.join()
+
+        controller_socket.close()
+        accessory_socket.close()
+        self.assertEqual([b'/first', b'/second', b'/third'], tthread.targets)
+        self.assertEqual(futures, done)
+        self.assertEqual([b'/first', b'/second', b'/third'], [f.result().body for f in futures])
+
+    def test_pipelined_requests_fail_on_disconnect(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        tthread = PipelinedResponseProvider(accessory_socket, key_c2a, key_a2c, 3, close_after=1)
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10, pipelining=True)
+            futures = [sh.submit('GET', '/{}'.format(i)) for i in range(3)]
+            self.assertRaises(AccessoryDisconnectedError, futures[2].result)
+            tthread.join()
+
+        controller_socket.close()
+        self.assertEqual(b'/0', futures[0].result().body)
+        self.assertIsInstance(futures[1].exception(), AccessoryDisconnectedError)
+        self.assertRaises(AccessoryDisconnectedError, sh.get, '/')
+
+    def test_pipelined_result_respects_timeout(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        # the provider only answers once both requests were received
+        tthread = PipelinedResponseProvider(accessory_socket, key_c2a, key_a2c, 2)
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10, pipelining=True)
+            first = sh.submit('GET', '/first')
+            start = time.monotonic()
+            self.assertRaises(TimeoutError, first.result, 0.2)
+            self.assertRaises(TimeoutError, first.exception, 0)
+            duration = time.monotonic() - start
+            # the session is still usable after the caller gave up
+            second = sh.submit('GET', '/second')
+            self.assertEqual(b'/second', second.result(5).body)
+            tthread.join()
+
+        controller_socket.close()
+        accessory_socket.close()
+        self.assertGreaterEqual(duration, 0.2)
+        self.assertLess(duration, 1)
+        self.assertEqual(b'/first', first.result(0).body)
+
+    def test_pipelined_callback_without_waiting(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        tthread = PipelinedResponseProvider(accessory_socket, key_c2a, key_a2c, 1)
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10, pipelining=True)
+            done = threading.Event()
+            future = sh.submit('GET', '/first', callback=lambda f: done.set())
+            # nobody waits for the future, the background reader reads the response
+            self.assertTrue(done.wait(5))
+            tthread.join()
+            # without listeners and outstanding requests, the reader is not needed anymore
+            deadline = time.monotonic() + 5
+            while sh.reader_running and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertFalse(sh.reader_running)
+
+        controller_socket.close()
+        accessory_socket.close()
+        self.assertEqual(b'/first', future.result(0).body)
+
+    def test_requests_are_assembled_without_touching_the_body(self):
+        session = mock.Mock()
+        session.pairing_data = {
+            'AccessoryIP': '10.0.0.2',
+            'AccessoryPort': 3000,
+        }
+        sh = SecureHttp(session)
+
+        with mock.patch.object(sh, '_handle_request') as handle_req:
+            sh.get('/accessories')
+            self.assertEqual(b'GET /accessories HTTP/1.1\r\nHost: 10.0.0.2:3000\r\n\r\n', handle_req.call_args[0][0])
+
+            sh.put('/characteristics', '{"value": "a\nbä"}')
+            self.assertEqual(b'PUT /characteristics HTTP/1.1\r\nHost: 10.0.0.2:3000\r\n'
+                             b'Content-Type: application/hap+json\r\nContent-Length: 18\r\n\r\n'
+                             b'{"value": "a\nb\xc3\xa4"}', handle_req.call_args[0][0])
+
+            sh.post('/pairings', b'\x06\x01\x01\n', 'application/pairing+tlv8')
+            self.assertEqual(b'POST /pairings HTTP/1.1\r\nHost: 10.0.0.2:3000\r\n'
+                             b'Content-Type: application/pairing+tlv8\r\nContent-Length: 4\r\n\r\n'
+                             b'\x06\x01\x01\n', handle_req.call_args[0][0])
+
+    def test_event_before_response_is_passed_to_listener(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        tthread = ResponseProvider(accessory_socket, key_c2a, key_a2c)
+        tthread.data = ['EVENT/1.0 200 OK\r\nContent-Length: 4\r\n\r\n', 'test',
+                        'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n', '{}']
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10)
+            events = []
+            sh.add_event_listener(events.append)
+            result = sh.get('/')
+
+        controller_socket.close()
+        accessory_socket.close()
+        self.assertEqual(b'{}', result.body)
+        self.assertEqual([b'test'], [e.body for e in events])
+
+    def test_background_reader_separates_events_and_responses(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        tthread = ResponseProvider(accessory_socket, key_c2a, key_a2c)
+        tthread.data = ['EVENT/1.0 200 OK\r\nContent-Length: 5\r\n\r\n', 'first',
+                        'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n', '{}',
+                        'EVENT/1.0 200 OK\r\nContent-Length: 6\r\n\r\n', 'second']
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10)
+            events = []
+            sh.add_event_listener(events.append)
+            sh.start_reader()
+            self.assertTrue(sh.reader_running)
+            result = sh.get('/')
+            tthread.join()
+            accessory_socket.close()
+            sh._reader.join(5)
+
+        controller_socket.close()
+        self.assertEqual(b'{}', result.body)
+        self.assertFalse(sh.reader_running)
+        self.assertEqual([b'first', b'second'], [e.body for e in events[:2]])
+        # the listeners learn about the broken connection as well
+        self.assertEqual(3, len(events))
+        self.assertIsInstance(events[2], AccessoryDisconnectedError)
+        self.assertRaises(AccessoryDisconnectedError, sh.get, '/')
+
+    def test_background_reader_stops_without_listeners(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        tthread = ResponseProvider(accessory_socket, key_c2a, key_a2c)
+        tthread.data = ['EVENT/1.0 200 OK\r\nContent-Length: 5\r\n\r\n', 'first',
+                        'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n', '{}']
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10)
+            events = []
+            sh.add_event_listener(events.append)
+            sh.start_reader()
+            result = sh.get('/')
+            tthread.join()
+            self.assertTrue(sh.reader_running)
+
+            sh.remove_event_listener(events.append)
+            deadline = time.monotonic() + 5
+            while sh.reader_running and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+        controller_socket.close()
+        accessory_socket.close()
+        self.assertEqual(b'{}', result.body)
+        self.assertEqual([b'first'], [e.body for e in events])
+        self.assertFalse(sh.reader_running)
+        self.assertIsNone(sh._reader)
+
+    def test_pipelined_result_does_not_wait_for_the_reading_thread(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        key_c2a = b'S2}\xb1}-l\n\x83\xe5}\'U\xc0\x1b\x0f\x08%X\xfdu\x1f\x9el/\x9bZ"\xec5\xa5P'
+        key_a2c = b'\x16\xab\xd3\xfe\x95{\xe56\x1fH\x81\xfd\x914\xa0@\xaa\x0e\xa6\xebw\xf2\xe3w:\x11/\x01\xbb;,\x1d'
+
+        tthread = StaggeredResponseProvider(accessory_socket, key_c2a, key_a2c, 2, 0.7)
+        tthread.start()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = key_a2c
+            session.c2a_key = key_c2a
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10, pipelining=True)
+            first = sh.submit('GET', '/first')
+            second = sh.submit('GET', '/second')
+            # this thread reads until the second response arrived
+            reading = threading.Thread(target=second.result)
+            reading.start()
+            while not sh.lock.locked():
+                time.sleep(0.01)
+            start = time.monotonic()
+            first_body = first.result(5).body
+            duration = time.monotonic() - start
+            reading.join()
+            tthread.join()
+
+        controller_socket.close()
+        accessory_socket.close()
+        self.assertEqual(b'/first', first_body)
+        self.assertEqual(b'/second', second.result(0).body)
+        # the first response is passed on by the reading thread without waiting for the second one
+        self.assertLess(duration, 1.2)
@@ -48,3 +48,34 @@ class TestServerData(unittest.TestCase):
         self.assertEqual(hksd.accessory_ltsk, sk)
 
         os.unlink(fp.name)
+
+    def test_srp_verifier(self):
+        fp = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        data = {
+            'host_ip': '12.34.56.78',
+            'host_port': 4711,
+            'c#': 1,
+            'category': 'bidge',
+            'accessory_pin': '123-45-678',
+            'accessory_pairing_id': '12:34:56:78:90:AB',
+            'name': 'test007',
+            'unsuccessful_tries': 0
+        }
+        json.dump(data, fp)
+        fp.close()
+
+        hksd = AccessoryServerData(fp.name)
+        self.assertIsNone(hksd.srp_verifier)
+        hksd.set_srp_verifier(0x1234, 0xabcdef)
+        self.assertEqual((0x1234, 0xabcdef), AccessoryServerData(fp.name).srp_verifier)
+
+        # a successful pairing drops the verifier, so the next pair setup uses a new salt
+        hksd.clear_srp_verifier()
+        self.assertIsNone(AccessoryServerData(fp.name).srp_verifier)
+        hksd.set_srp_verifier(0x1234, 0xabcdef)
+
+        # the stored verifier belongs to the old setup code
+        hksd.data['accessory_pin'] = '987-65-432'
+        self.assertIsNone(hksd.srp_verifier)
+
+        os.unlink(fp.name)
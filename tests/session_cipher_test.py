@@ -0,0 +1,127 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import unittest
+import os
+
+from homekit.crypto import SessionCipher
+from homekit.crypto.chacha20poly1305 import chacha20_aead_encrypt, chacha20_aead_decrypt
+
+
+class TestSessionCipher(unittest.TestCase):
+
+    def test_seal_frame_matches_aead_function(self):
+        key = os.urandom(32)
+        cipher = SessionCipher(key)
+        for counter in range(3):
+            sealed = cipher.seal_frame(b'some data', b'\x09\x00')
+            cipher_text, tag = chacha20_aead_encrypt(b'\x09\x00', key, counter.to_bytes(8, byteorder='little'),
+                                                     bytes([0, 0, 0, 0]), b'some data')
+            self.assertEqual(bytes(cipher_text + tag), sealed)
+        self.assertEqual(3, cipher.counter)
+
+    def test_open_frame(self):
+        key = os.urandom(32)
+        cipher = SessionCipher(key, counter=5)
+        cipher_text, tag = chacha20_aead_encrypt(b'', key, (5).to_bytes(8, byteorder='little'), bytes([0, 0, 0, 0]),
+                                                 b'some data')
+        self.assertEqual(b'some data', cipher.open_frame(bytes(cipher_text + tag)))
+        self.assertEqual(6, cipher.counter)
+
+    def test_open_frame_failure_keeps_counter(self):
+        cipher = SessionCipher(os.urandom(32))
+        self.assertFalse(cipher.open_frame(os.urandom(32)))
+        self.assertEqual(0, cipher.counter)
+
+    def test_roundtrip(self):
+        key = os.urandom(32)
+        sender = SessionCipher(key)
+        receiver = SessionCipher(key)
+        for length in [0, 1, 1024]:
+            data = os.urandom(length)
+            aad = length.to_bytes(2, byteorder='little')
+            self.assertEqual(data, receiver.open_frame(sender.seal_frame(data, aad), aad))
+
+    def test_seal_frames_splits_at_1024_bytes(self):
+        key = os.urandom(32)
+        data = os.urandom(2500)
+        frames = SessionCipher(key).seal_frames(data)
+        self.assertEqual(2500 + 3 * 18, len(frames))
+
+        receiver = SessionCipher(key)
+        result = b''
+        while frames:
+            length = int.from_bytes(frames[0:2], byteorder='little')
+            result += receiver.open_frame(frames[2:length + 18], frames[0:2])
+            frames = frames[length + 18:]
+        self.assertEqual(data, result)
+        self.assertEqual(3, receiver.counter)
+        self.assertEqual(b'', SessionCipher(key).seal_frames(b''))
+
+    def test_open_frame_accepts_aead_decrypt_data(self):
+        key = os.urandom(32)
+        sealed = SessionCipher(key).seal_frame(b'payload')
+        self.assertEqual(b'payload', chacha20_aead_decrypt(b'', key, bytes(8), bytes([0, 0, 0, 0]), sealed))
+
+    def test_encrypt_into_and_decrypt_into(self):
+        key = os.urandom(32)
+        data = os.urandom(3000)
+        length = SessionCipher.frames_length(len(data))
+        self.assertEqual(3000 + 3 * 18, length)
+        buffer = bytearray(length + 10)
+        sender = SessionCipher(key)
+        self.assertEqual(length, sender.encrypt_into(memoryview(buffer)[10:], data))
+        self.assertEqual(3, sender.counter)
+        self.assertEqual(SessionCipher(key).seal_frames(data), buffer[10:])
+
+        result = bytearray(len(data))
+        receiver = SessionCipher(key)
+        self.assertEqual(len(data), receiver.decrypt_into(result, memoryview(buffer)[10:]))
+        self.assertEqual(data, result)
+        self.assertEqual(3, receiver.counter)
+
+    def test_decrypt_into_failures(self):
+        key = os.urandom(32)
+        frames = SessionCipher(key).seal_frames(b'some data')
+        tampered = bytearray(frames)
+        tampered[5] ^= 0x01
+        self.assertFalse(SessionCipher(key).decrypt_into(bytearray(9), tampered))
+        self.assertRaises(ValueError, SessionCipher(key).decrypt_into, bytearray(9), frames[:-1])
+
+    def test_open_frames(self):
+        key = os.urandom(32)
+        sender = SessionCipher(key)
+        buffer = sender.seal_frames(b'a' * 1500) + sender.seal_frames(b'b' * 10)
+        receiver = SessionCipher(key)
+
+        segments, consumed = receiver.open_frames(buffer[:-5])
+        self.assertEqual([b'a' * 1024, b'a' * 476], segments)
+        self.assertEqual(1500 + 2 * 18, consumed)
+        self.assertEqual(2, receiver.counter)
+
+        segments, consumed = receiver.open_frames(buffer[consumed:])
+        self.assertEqual([b'b' * 10], segments)
+        self.assertEqual(28, consumed)
+        self.assertEqual(([], 0), receiver.open_frames(b'\x01'))
+
+    def test_open_frames_failure(self):
+        key = os.urandom(32)
+        buffer = SessionCipher(key).seal_frames(b'a' * 1500)
+        buffer[1050] ^= 0x01
+        receiver = SessionCipher(key)
+        self.assertEqual((False, 1042), receiver.open_frames(buffer))
+        self.assertEqual(1, receiver.counter)
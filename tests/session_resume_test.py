@@ -0,0 +1,104 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+import tlv8
+
+from homekit.protocol import get_session_keys, ResumeCache, PairingKeys, derive_control_keys, derive_resume_session_id
+from benchmarks.handshake_benchmarks import SimulatedAccessory, perform_pair_verify
+
+
+class TestResumeCache(unittest.TestCase):
+
+    def test_put_and_pop(self):
+        cache = ResumeCache()
+        cache.put('a', b'12345678', b'secret', 'info')
+        self.assertIn('a', cache)
+        self.assertEqual((b'12345678', b'secret', 'info'), cache.pop('a'))
+        self.assertNotIn('a', cache)
+        self.assertIsNone(cache.pop('a'))
+
+    def test_oldest_entries_are_dropped(self):
+        cache = ResumeCache(max_entries=2)
+        cache.put('a', b'1', b'1')
+        cache.put('b', b'2', b'2')
+        cache.put('a', b'3', b'3')
+        cache.put('c', b'4', b'4')
+        self.assertEqual(2, len(cache))
+        self.assertNotIn('b', cache)
+        self.assertEqual(b'3', cache.pop('a')[0])
+
+
+class TestSessionResume(unittest.TestCase):
+
+    def setUp(self):
+        self.accessory = SimulatedAccessory()
+        self.pairing_data = self.accessory.create_pairing_data()
+        self.resume_cache = ResumeCache()
+        self.cache_key = (self.pairing_data['iOSPairingId'], self.pairing_data['AccessoryPairingID'])
+
+    def test_verify_stores_resumable_session(self):
+        keys = perform_pair_verify(self.pairing_data, self.accessory, self.resume_cache)
+        self.assertEqual(derive_control_keys(self.accessory._shared_secret), keys)
+        session_id, shared_secret, _ = self.resume_cache.pop(self.cache_key)
+        self.assertEqual(derive_resume_session_id(self.accessory._shared_secret), session_id)
+        self.assertEqual(self.accessory._shared_secret, shared_secret)
+
+    def test_resume(self):
+        first_keys = perform_pair_verify(self.pairing_data, self.accessory, self.resume_cache)
+        first_session_id = self.resume_cache._entries[self.cache_key][0]
+        keys = perform_pair_verify(self.pairing_data, self.accessory, self.resume_cache)
+        self.assertNotEqual(first_keys, keys)
+        self.assertEqual(derive_control_keys(self.accessory._shared_secret), keys)
+        # the accessory answered with a new session ID that can be used for the next resume
+        session_id = self.resume_cache._entries[self.cache_key][0]
+        self.assertNotEqual(first_session_id, session_id)
+        self.assertIn(session_id, self.accessory.resume_cache)
+        self.assertNotIn(first_session_id, self.accessory.resume_cache)
+
+    def test_resume_unknown_session_falls_back_to_verify(self):
+        perform_pair_verify(self.pairing_data, self.accessory, self.resume_cache)
+        self.accessory.resume_cache.clear()
+        keys = perform_pair_verify(self.pairing_data, self.accessory, self.resume_cache)
+        self.assertEqual(derive_control_keys(self.accessory._shared_secret), keys)
+        self.assertEqual(derive_resume_session_id(self.accessory._shared_secret),
+                         self.resume_cache._entries[self.cache_key][0])
+
+    def test_resume_wrong_secret_falls_back_to_verify(self):
+        perform_pair_verify(self.pairing_data, self.accessory, self.resume_cache)
+        session_id, _, _ = self.resume_cache.pop(self.cache_key)
+        self.resume_cache.put(self.cache_key, session_id, bytes(32))
+        keys = perform_pair_verify(self.pairing_data, self.accessory, self.resume_cache)
+        self.assertEqual(derive_control_keys(self.accessory._shared_secret), keys)
+
+    def test_verify_with_pairing_keys(self):
+        pairing_keys = PairingKeys(self.pairing_data)
+        for key in ['AccessoryLTPK', 'iOSDeviceLTSK', 'iOSDeviceLTPK']:
+            del self.pairing_data[key]
+        for _ in range(2):
+            state_machine = get_session_keys(self.pairing_data, pairing_keys=pairing_keys)
+            request, expected = state_machine.send(None)
+            with self.assertRaises(StopIteration) as result:
+                while True:
+                    response = self.accessory.pair_verify(tlv8.encode(request))
+                    request, expected = state_machine.send(tlv8.decode(response, expected))
+            self.assertEqual(derive_control_keys(self.accessory._shared_secret), result.exception.value)
+
+    def test_without_cache_no_session_is_stored(self):
+        perform_pair_verify(self.pairing_data, self.accessory)
+        self.assertEqual(1, len(self.accessory.resume_cache))
+        self.assertEqual(0, len(self.resume_cache))
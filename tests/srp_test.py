@@ -46,3 +46,28 @@ class TestSrp(unittest.TestCase):
 
         # step M5
         self.assertTrue(client.verify_servers_proof(servers_proof))
+
+    def test_server_with_stored_verifier(self):
+        setup_code = '123-45-678'
+        first_server = SrpServer('Pair-Setup', setup_code)
+        server = SrpServer('Pair-Setup', setup_code, salt=first_server.get_salt(),
+                           verifier=first_server.get_verifier())
+        self.assertEqual(first_server.get_salt(), server.get_salt())
+        self.assertNotEqual(first_server.get_public_key(), server.get_public_key())
+
+        client = SrpClient('Pair-Setup', setup_code)
+        client.set_salt(server.get_salt())
+        client.set_server_public_key(server.get_public_key())
+        server.set_client_public_key(client.get_public_key())
+        clients_proof = client.get_proof()
+        self.assertTrue(server.verify_clients_proof(clients_proof))
+        self.assertTrue(client.verify_servers_proof(server.get_proof(clients_proof)))
+        self.assertEqual(client.get_session_key(), server.get_session_key())
+
+    def test_wrong_setup_code(self):
+        server = SrpServer('Pair-Setup', '123-45-678')
+        client = SrpClient('Pair-Setup', '123-45-679')
+        client.set_salt(server.get_salt())
+        client.set_server_public_key(server.get_public_key())
+        server.set_client_public_key(client.get_public_key())
+        self.assertFalse(server.verify_clients_proof(client.get_proof()))
@@ -0,0 +1,84 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+from unittest import mock
+
+from homekit.controller.value_cache import ValueCache
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit.controller.ip_implementation import IpSession
+
+
+class TestValueCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.cache = ValueCache(clock=lambda: self.now)
+
+    def test_values_expire(self):
+        self.cache.store({(1, 10): {'value': True}, (1, 11): {'status': -70409, 'description': 'gone'}},
+                         self.cache.sequence())
+        self.assertEqual({(1, 10): {'value': True}}, self.cache.lookup([(1, 10), (1, 11)], 5))
+        self.assertEqual({(1, 10): {'value': True}}, self.cache.lookup([('1', '10')], 5))
+        self.now += 5
+        self.assertEqual({(1, 10): {'value': True}}, self.cache.lookup([(1, 10)], 5))
+        self.now += 1
+        self.assertEqual({}, self.cache.lookup([(1, 10)], 5))
+        self.assertEqual({(1, 10): {'value': True}}, self.cache.lookup([(1, 10)], 10))
+        self.assertEqual({'hits': 4, 'misses': 2, 'cached': 1}, self.cache.statistics())
+
+    def test_events_refresh_values(self):
+        self.cache.store({(1, 10): {'value': 20.5}}, self.cache.sequence())
+        self.now += 10
+        self.cache.store_events([(1, 10, 21.0), (1, 11, 40)])
+        self.assertEqual({(1, 10): {'value': 21.0}, (1, 11): {'value': 40}}, self.cache.lookup([(1, 10), (1, 11)], 0))
+
+    def test_writes_invalidate_values(self):
+        self.cache.store({(1, 10): {'value': True}, (1, 11): {'value': 1}}, self.cache.sequence())
+        self.cache.invalidate([(1, 10)])
+        self.assertEqual({(1, 11): {'value': 1}}, self.cache.lookup([(1, 10), (1, 11)], 60))
+        self.cache.clear()
+        self.assertEqual({}, self.cache.lookup([(1, 10), (1, 11)], 60))
+
+    def test_reads_do_not_overwrite_newer_values(self):
+        sequence = self.cache.sequence()
+        # while the read is running, the characteristic is written and receives an event
+        self.cache.invalidate([(1, 10)])
+        self.cache.store_events([(1, 11, 'event')])
+        self.cache.store({(1, 10): {'value': 'old'}, (1, 11): {'value': 'old'}, (1, 12): {'value': 'read'}},
+                         sequence)
+        self.assertEqual({(1, 11): {'value': 'event'}, (1, 12): {'value': 'read'}},
+                         self.cache.lookup([(1, 10), (1, 11), (1, 12)], 60))
+        # reads started afterwards are stored
+        self.cache.store({(1, 10): {'value': 'new'}}, self.cache.sequence())
+        self.assertEqual({(1, 10): {'value': 'new'}}, self.cache.lookup([(1, 10)], 60))
+
+    @unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+    def test_session_clears_values_if_config_number_changed(self):
+        pairing_data = {'AccessoryPairingID': 'id', 'AccessoryConfigNumber': 1}
+        connection_data = {'ip': '127.0.0.1', 'port': 1, 'properties': {'c#': '1'}}
+        self.cache.store({(1, 10): {'value': True}}, self.cache.sequence())
+        with mock.patch('homekit.controller.ip_implementation.find_device_ip_port_props',
+                        return_value=connection_data), \
+                mock.patch.object(IpSession, '_connect', return_value=False):
+            IpSession(pairing_data, value_cache=self.cache)
+            self.assertEqual({(1, 10): {'value': True}}, self.cache.lookup([(1, 10)], 60))
+            connection_data['properties']['c#'] = '2'
+            IpSession(pairing_data, value_cache=self.cache)
+        self.assertEqual({}, self.cache.lookup([(1, 10)], 60))
+        self.assertEqual(2, pairing_data['AccessoryConfigNumber'])
@@ -0,0 +1,117 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import unittest
+
+from homekit.controller.write_coalescer import WriteCoalescer
+from homekit.exceptions import AccessoryDisconnectedError
+
+
+def status(code):
+    return {'status': code, 'description': str(code)}
+
+
+class TestWriteCoalescer(unittest.TestCase):
+
+    def setUp(self):
+        self.writes = []
+        self.error = None
+
+    def write(self, characteristics):
+        self.writes.append(characteristics)
+        if self.error:
+            raise self.error
+        return {(aid, iid): status(-70404 if value == 'read only' else 0) for aid, iid, value in characteristics}
+
+    def test_writes_within_window_are_merged(self):
+        coalescer = WriteCoalescer(self.write, window=60)
+        hue = coalescer.submit([(1, 11, 120)])
+        saturation = coalescer.submit([(1, 12, 50), (1, 11, 240)])
+        brightness = coalescer.submit([(1, 13, 'read only')])
+        self.assertEqual(3, coalescer.pending)
+        coalescer.flush()
+        # one write with the last value per characteristic, in the order of the last writes
+        self.assertEqual([[(1, 12, 50), (1, 11, 240), (1, 13, 'read only')]], self.writes)
+        self.assertEqual({(1, 11): status(0)}, hue.result(0))
+        self.assertEqual({(1, 11): status(0), (1, 12): status(0)}, saturation.result(0))
+        self.assertEqual({(1, 13): status(-70404)}, brightness.result(0))
+        self.assertEqual(0, coalescer.pending)
+
+    def test_window_triggers_write(self):
+        written = threading.Event()
+
+        def write(characteristics):
+            result = self.write(characteristics)
+            written.set()
+            return result
+
+        coalescer = WriteCoalescer(write, window=0.05)
+        first = coalescer.submit([(1, 10, True)])
+        second = coalescer.submit([(1, 10, False)])
+        self.assertEqual({(1, 10): status(0)}, second.result(5))
+        self.assertEqual(first.result(0), second.result(0))
+        self.assertEqual([[(1, 10, False)]], self.writes)
+
+        # the next write starts a new window
+        third = coalescer.submit([(1, 10, True)])
+        third.result(5)
+        self.assertEqual([[(1, 10, False)], [(1, 10, True)]], self.writes)
+
+    def test_errors_are_passed_to_all_futures(self):
+        self.error = AccessoryDisconnectedError('gone')
+        coalescer = WriteCoalescer(self.write, window=60)
+        futures = [coalescer.submit([(1, 10, True)]), coalescer.submit([(1, 11, 1)])]
+        coalescer.flush()
+        for future in futures:
+            self.assertIsInstance(future.exception(0), AccessoryDisconnectedError)
+
+    def test_flushes_are_serialized(self):
+        writing = threading.Event()
+        release = threading.Event()
+        active = []
+
+        def write(characteristics):
+            active.append(characteristics)
+            self.assertEqual(1, len(active))
+            writing.set()
+            release.wait(5)
+            result = self.write(characteristics)
+            active.remove(characteristics)
+            return result
+
+        coalescer = WriteCoalescer(write, window=60)
+        first = coalescer.submit([(1, 10, True)])
+        first_flush = threading.Thread(target=coalescer.flush)
+        first_flush.start()
+        writing.wait(5)
+        second = coalescer.submit([(1, 10, False)])
+        second_flush = threading.Thread(target=coalescer.flush)
+        second_flush.start()
+        # the second flush waits for the first write instead of writing concurrently
+        second_flush.join(0.2)
+        self.assertTrue(second_flush.is_alive())
+        release.set()
+        first_flush.join(5)
+        second_flush.join(5)
+        self.assertEqual([[(1, 10, True)], [(1, 10, False)]], self.writes)
+        self.assertEqual({(1, 10): status(0)}, first.result(0))
+        self.assertEqual({(1, 10): status(0)}, second.result(0))
+
+    def test_empty_flush(self):
+        coalescer = WriteCoalescer(self.write, window=60)
+        coalescer.flush()
+        self.assertEqual([], self.writes)